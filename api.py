@@ -1,4 +1,7 @@
 """Kitchen Helper API"""
+import argparse
+import asyncio
+import signal
 from contextlib import asynccontextmanager
 
 import fastapi.staticfiles
@@ -10,13 +13,15 @@ import features.recipes
 import multiprocessing
 import uvicorn
 from fastapi.middleware.cors import CORSMiddleware
+import common.grpc_client
 import configuration
+import db.connection
 import khLogging
 from features.users.tasks import app_seeder
 from features.recipes.tasks import seed_recipe_categories
-import threading
-from features.users.grpc_server import serve as users_grpc
-from features.images.grpc_server import serve as images_grpc
+import grpc
+from features.users.grpc_server import create_server as create_users_grpc_server
+from features.images.grpc_server import create_server as create_images_grpc_server
 from opentelemetry.instrumentation.fastapi import FastAPIInstrumentor
 
 from opentelemetry import trace
@@ -38,6 +43,39 @@ config = configuration.Config()
 logging = khLogging.Logger('api')
 
 
+async def start_grpc_servers() -> list[grpc.aio.Server]:
+    """
+    Start the gRPC servers on the running event loop
+    :return:
+    """
+
+    grpc_servers = [create_users_grpc_server(), create_images_grpc_server()]
+    for grpc_server in grpc_servers:
+        await grpc_server.start()
+    return grpc_servers
+
+
+async def stop_grpc_servers(grpc_servers: list[grpc.aio.Server]) -> None:
+    """
+    Stop the gRPC servers, letting the running calls finish within the grace period
+    :param grpc_servers:
+    :return:
+    """
+
+    await asyncio.gather(*(grpc_server.stop(config.grpc_server.shutdown_grace) for grpc_server in grpc_servers))
+
+
+async def dispose_resources() -> None:
+    """
+    Release the pooled db connections and grpc channels of the process
+    :return:
+    """
+
+    db.connection.dispose_engines()
+    await db.connection.dispose_async_engines()
+    common.grpc_client.close_channels()
+
+
 @asynccontextmanager
 async def startup_shutdown_lifespan(app: fastapi.FastAPI):
     """
@@ -47,19 +85,39 @@ async def startup_shutdown_lifespan(app: fastapi.FastAPI):
     """
     try:
         app_seeder.apply_async(link=seed_recipe_categories.si())
-        users_grpc_thread = threading.Thread(target=users_grpc)
-        users_grpc_thread.daemon = True
-        users_grpc_thread.start()
-        images_grpc_thread = threading.Thread(target=images_grpc)
-        images_grpc_thread.daemon = True
-        images_grpc_thread.start()
     except Exception:
         error_message = "Seed task is not able to run!"
         if config.running_on_dev:
             logging.warning(error_message)
         else:
             logging.exception(error_message)
+
+    grpc_servers = []
+    if config.grpc_server.embedded:
+        try:
+            grpc_servers = await start_grpc_servers()
+        except Exception:
+            logging.exception("gRPC servers are not able to start!")
     yield
+    await stop_grpc_servers(grpc_servers)
+    await dispose_resources()
+
+
+async def serve_grpc() -> None:
+    """
+    Run only the gRPC servers, so they can be scaled separately from the api
+    :return:
+    """
+
+    grpc_servers = await start_grpc_servers()
+    stop_event = asyncio.Event()
+    for signal_number in (signal.SIGINT, signal.SIGTERM):
+        asyncio.get_running_loop().add_signal_handler(signal_number, stop_event.set)
+    try:
+        await stop_event.wait()
+    finally:
+        await stop_grpc_servers(grpc_servers)
+        await dispose_resources()
 
 
 app = fastapi.FastAPI(
@@ -86,11 +144,17 @@ if config.context != configuration.ContextOptions.TEST:
     FastAPIInstrumentor.instrument_app(app)
 
 if __name__ == '__main__':
-    uvicorn.run(
-        "api:app",
-        reload=config.running_on_dev,
-        workers=CPUS,
-        log_config=khLogging.UVICORN_LOG_CONFIG,
-        port=8000,
-        host='0.0.0.0',
-    )
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--grpc-only', action='store_true', help='run only the gRPC servers')
+    args = parser.parse_args()
+    if args.grpc_only:
+        asyncio.run(serve_grpc())
+    else:
+        uvicorn.run(
+            "api:app",
+            reload=config.running_on_dev,
+            workers=CPUS,
+            log_config=khLogging.UVICORN_LOG_CONFIG,
+            port=8000,
+            host='0.0.0.0',
+        )
@@ -1,5 +1,8 @@
 """Authentication commmon functionality"""
 
+import hashlib
+import threading
+import time
 from typing import Annotated, Optional
 
 import diskcache
@@ -7,6 +10,7 @@ import fastapi
 import pydantic
 from fastapi.security import OAuth2PasswordBearer
 from jose import jwt, JWTError
+import common.cache
 import common.constants
 
 import configuration
@@ -15,10 +19,19 @@ from sqlalchemy import text
 
 CACHE = diskcache.Cache(directory=configuration.CACHE_PATH, disk=diskcache.JSONDisk)
 
+# the system user never changes while the application runs
+_SYSTEM_USER_ID: Optional[int] = None
+_SYSTEM_USER_ID_LOCK = threading.Lock()
+
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/users/signin", auto_error=False)
 
 jwt_config = configuration.JwtToken()
 
+# verified users by the digest of their token, a session sends the same token with every request
+VERIFIED_TOKENS_CACHE = common.cache.TTLCache(
+    jwt_config.verified_tokens_cache_size, jwt_config.verified_tokens_cache_ttl
+)
+
 
 def _get_system_user_id_from_db() -> int:
     with db.connection.get_connection() as connection:
@@ -30,16 +43,23 @@ def _get_system_user_id_from_db() -> int:
 
 def get_system_user_id() -> int:
     """
-    Get system user id
+    Get system user id. It is resolved once per process and kept in memory,
+    the disk cache only spares the other processes the database query
     :return:
     """
 
-    system_user_id = CACHE.get('system_user_id')
-    if not system_user_id:
-        system_user_id = _get_system_user_id_from_db()
-        CACHE.set('system_user_id', system_user_id)
-        return system_user_id
-    return system_user_id
+    global _SYSTEM_USER_ID
+    if _SYSTEM_USER_ID is None:
+        with _SYSTEM_USER_ID_LOCK:
+            if _SYSTEM_USER_ID is None:
+                system_user_id = CACHE.get('system_user_id')
+                if not system_user_id:
+                    system_user_id = _get_system_user_id_from_db()
+                    if not system_user_id:
+                        return system_user_id
+                    CACHE.set('system_user_id', system_user_id)
+                _SYSTEM_USER_ID = system_user_id
+    return _SYSTEM_USER_ID
 
 
 class AuthenticatedUser(pydantic.BaseModel):
@@ -70,6 +90,10 @@ async def extract_user_data_from_jwt(
 
     if not token:
         return None
+    token_digest = hashlib.sha256(token.encode()).digest()
+    user = VERIFIED_TOKENS_CACHE.get(token_digest)
+    if user:
+        return user
     try:
         payload = jwt.decode(token, jwt_config.secret_key, algorithms=[jwt_config.algorithm])
         user_id = int(payload.get("sub"))
@@ -81,7 +105,12 @@ async def extract_user_data_from_jwt(
     except ValueError:
         return None
 
-    return AuthenticatedUser(id=user_id, roles=roles)
+    user = AuthenticatedUser(id=user_id, roles=roles)
+    ttl = jwt_config.verified_tokens_cache_ttl
+    if payload.get("exp"):
+        ttl = min(ttl, payload["exp"] - time.time())
+    VERIFIED_TOKENS_CACHE.set(token_digest, user, ttl)
+    return user
 
 
 class Authenticate:
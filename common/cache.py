@@ -0,0 +1,201 @@
+"""In-process caches"""
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Iterable
+
+import diskcache
+
+import configuration
+
+_MISSING = object()
+
+# generations of the shared caches, seen by all processes of the host
+GENERATIONS = diskcache.Cache(directory=configuration.CACHE_PATH.joinpath('generations'))
+
+
+class TTLCache:
+    """
+    Thread safe least recently used cache with expiring entries.
+    The cache is per process, entries written by other workers are only seen after they expire
+    """
+
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: OrderedDict[Hashable, tuple[Any, float]] = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """
+        Get the value of the key if it did not expire
+        :param key:
+        :param default:
+        :return:
+        """
+
+        with self._lock:
+            value = self._get(key, time.monotonic())
+        return default if value is _MISSING else value
+
+    def get_many(self, keys: Iterable[Hashable]) -> dict:
+        """
+        Get the values of the keys which are cached and did not expire
+        :param keys:
+        :return: values by key, the missing keys are left out
+        """
+
+        now = time.monotonic()
+        with self._lock:
+            values = {key: self._get(key, now) for key in keys}
+        return {key: value for key, value in values.items() if value is not _MISSING}
+
+    def _get(self, key: Hashable, now: float) -> Any:
+        value, expires_on = self._entries.get(key, (_MISSING, 0))
+        if value is not _MISSING and expires_on < now:
+            del self._entries[key]
+            value = _MISSING
+        if value is _MISSING:
+            self.misses += 1
+            return value
+        self.hits += 1
+        self._entries.move_to_end(key)
+        return value
+
+    def set(self, key: Hashable, value: Any, ttl: float = None) -> None:
+        """
+        Set the value of the key, the least recently used entry is dropped when the cache is full
+        :param key:
+        :param value:
+        :param ttl: seconds the entry is kept instead of the ttl of the cache
+        :return:
+        """
+
+        with self._lock:
+            self._set(key, value, ttl)
+
+    def set_many(self, values: dict) -> None:
+        with self._lock:
+            for key, value in values.items():
+                self._set(key, value)
+
+    def _set(self, key: Hashable, value: Any, ttl: float = None) -> None:
+        self._entries[key] = (value, time.monotonic() + (self.ttl if ttl is None else ttl))
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        """
+        Drop the entries and reset the counters
+        :return:
+        """
+
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = 0
+
+    def stats(self) -> dict:
+        """
+        Hit and miss counters of the cache, for monitoring its hit rate
+        :return:
+        """
+
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self._entries), 'max_size': self.max_size}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class SharedTTLCache(TTLCache):
+    """
+    TTL cache which is invalidated in all processes of the host.
+    Invalidating bumps the generation of the cache in a shared disk cache, the other processes compare it with
+    their own at most every `check_interval` seconds and drop their entries when it changed
+    """
+
+    def __init__(self, name: str, max_size: int, ttl: float, check_interval: float = 1.0):
+        super().__init__(max_size, ttl)
+        self.name = name
+        self.check_interval = check_interval
+        self._generation = GENERATIONS.get(self._generation_key, 0)
+        self._checked_on = time.monotonic()
+
+    @property
+    def _generation_key(self) -> str:
+        return f'cache:{self.name}:generation'
+
+    def _check_generation(self) -> None:
+        now = time.monotonic()
+        if now - self._checked_on < self.check_interval:
+            return
+        self._checked_on = now
+        generation = GENERATIONS.get(self._generation_key, 0)
+        if generation != self._generation:
+            with self._lock:
+                self._generation = generation
+                self._entries.clear()
+
+    @property
+    def generation(self) -> int:
+        """
+        Generation of the cache, it changes whenever the cache is invalidated in any process
+        :return:
+        """
+
+        self._check_generation()
+        return self._generation
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        self._check_generation()
+        return super().get(key, default)
+
+    def get_many(self, keys: Iterable[Hashable]) -> dict:
+        self._check_generation()
+        return super().get_many(keys)
+
+    def set_many(self, values: dict, generation: int = None) -> None:
+        """
+        Set the values of the keys. When the generation the values were loaded in is given,
+        they are not cached if the cache was invalidated in the meantime
+        :param values:
+        :param generation:
+        :return:
+        """
+
+        with self._lock:
+            if generation is not None and generation != self._generation:
+                return
+            for key, value in values.items():
+                self._set(key, value)
+
+    def get_or_load(self, key: Hashable, load: Callable[[], Any]) -> Any:
+        """
+        Get the value of the key, loading and caching it when it is missing.
+        Values loaded while the cache was invalidated are not cached
+        :param key:
+        :param load:
+        :return:
+        """
+
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            generation = self._generation
+            value = load()
+            self.set_many({key: value}, generation)
+        return value
+
+    def invalidate(self) -> int:
+        """
+        Drop the entries of the cache in this process and, within `check_interval`, in the other processes
+        :return: the new generation
+        """
+
+        generation = GENERATIONS.incr(self._generation_key, default=0)
+        with self._lock:
+            self._generation = generation
+            self._entries.clear()
+        return generation
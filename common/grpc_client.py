@@ -0,0 +1,195 @@
+"""Shared gRPC client functionality"""
+import os
+import threading
+import time
+from typing import Any
+
+import grpc
+
+import configuration
+import khLogging
+
+logging = khLogging.Logger.get_child_logger(__file__)
+
+config = configuration.Config()
+
+# transport failures which count against the circuit breaker, application errors do not
+BREAKER_STATUS_CODES = (grpc.StatusCode.UNAVAILABLE, grpc.StatusCode.DEADLINE_EXCEEDED)
+
+_CHANNELS: dict[str, grpc.Channel] = {}
+_BREAKERS: dict[str, "CircuitBreaker"] = {}
+_CHANNELS_PID = os.getpid()
+_CHANNELS_LOCK = threading.Lock()
+
+
+class CircuitOpenError(Exception):
+    """The target failed too many times in a row and is not called until the breaker resets"""
+
+
+class CircuitBreaker:
+    """
+    Consecutive failures circuit breaker.
+    After `failure_threshold` failures the breaker opens and calls fail fast for `reset_timeout` seconds,
+    then a single trial call is let through to decide whether to close it again
+    """
+
+    def __init__(self, failure_threshold: int, reset_timeout: float):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_on = None
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    @property
+    def is_open(self) -> bool:
+        return self._opened_on is not None
+
+    def allow(self) -> bool:
+        """
+        Check if a call may go through
+        :return:
+        """
+
+        with self._lock:
+            if self._opened_on is None:
+                return True
+            if self._trial_running or time.monotonic() - self._opened_on < self.reset_timeout:
+                return False
+            self._trial_running = True
+            return True
+
+    def record_success(self) -> None:
+        """
+        Close the breaker
+        :return:
+        """
+
+        with self._lock:
+            self._failures = 0
+            self._opened_on = None
+            self._trial_running = False
+
+    def record_failure(self) -> None:
+        """
+        Count the failure and open the breaker when the threshold is reached or the trial call failed
+        :return:
+        """
+
+        with self._lock:
+            self._failures += 1
+            if self._trial_running or self._failures >= self.failure_threshold:
+                self._opened_on = time.monotonic()
+            self._trial_running = False
+
+
+def _reset_channels_after_fork() -> None:
+    """
+    Drop the channels inherited from the parent process, gRPC channels can not be used across fork
+    :return:
+    """
+
+    global _CHANNELS_PID, _CHANNELS_LOCK
+    _CHANNELS.clear()
+    _BREAKERS.clear()
+    _CHANNELS_PID = os.getpid()
+    _CHANNELS_LOCK = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_channels_after_fork)
+
+
+def _create_channel(target: str) -> grpc.Channel:
+    return grpc.insecure_channel(
+        target,
+        options=[
+            ("grpc.keepalive_time_ms", config.grpc_client.keepalive_time_ms),
+            ("grpc.keepalive_timeout_ms", config.grpc_client.keepalive_timeout_ms),
+            ("grpc.keepalive_permit_without_calls", 1),
+        ],
+    )
+
+
+def get_channel(target: str) -> grpc.Channel:
+    """
+    Return the process-wide channel to the target
+    :param target:
+    :return:
+    """
+
+    if _CHANNELS_PID != os.getpid():
+        _reset_channels_after_fork()
+
+    channel = _CHANNELS.get(target)
+    if channel is None:
+        with _CHANNELS_LOCK:
+            channel = _CHANNELS.get(target)
+            if channel is None:
+                channel = _create_channel(target)
+                _CHANNELS[target] = channel
+    return channel
+
+
+def get_circuit_breaker(target: str) -> CircuitBreaker:
+    """
+    Return the process-wide circuit breaker of the target
+    :param target:
+    :return:
+    """
+
+    breaker = _BREAKERS.get(target)
+    if breaker is None:
+        with _CHANNELS_LOCK:
+            breaker = _BREAKERS.setdefault(
+                target,
+                CircuitBreaker(config.grpc_client.breaker_failure_threshold, config.grpc_client.breaker_reset_timeout),
+            )
+    return breaker
+
+
+def close_channels() -> None:
+    """
+    Close all channels of the current process
+    :return:
+    """
+
+    with _CHANNELS_LOCK:
+        for channel in _CHANNELS.values():
+            channel.close()
+        _CHANNELS.clear()
+
+
+def call(target: str, stub_class: type, method: str, request: Any, timeout: float = None) -> Any:
+    """
+    Call unary method of the target service over the shared channel with a deadline.
+    Raises CircuitOpenError without calling the service while its breaker is open
+
+    :param target:
+    :param stub_class:
+    :param method:
+    :param request:
+    :param timeout:
+    :return:
+    """
+
+    breaker = get_circuit_breaker(target)
+    if not breaker.allow():
+        raise CircuitOpenError(target)
+
+    try:
+        stub = stub_class(get_channel(target))
+        response = getattr(stub, method)(request, timeout=timeout or config.grpc_client.timeout)
+    except grpc.RpcError as error:
+        if error.code() in BREAKER_STATUS_CODES:
+            breaker.record_failure()
+            if breaker.is_open:
+                logging.warning(f"gRPC calls to {target} are suspended after {error.code().name}")
+        else:
+            breaker.record_success()
+        raise
+    except BaseException:
+        # the outcome is always recorded, otherwise a failed trial call would keep the breaker open forever
+        breaker.record_failure()
+        raise
+    breaker.record_success()
+    return response
@@ -0,0 +1,95 @@
+"""Inverted index of documents by their keys"""
+import threading
+from collections import Counter, defaultdict
+from typing import Hashable, Iterable
+
+
+class PostingIndex:
+    """
+    Thread safe in-memory inverted index, keeping the posting list of the documents having every key
+    """
+
+    def __init__(self):
+        self._keys: dict[Hashable, frozenset] = {}
+        self._postings: dict[Hashable, set[Hashable]] = defaultdict(set)
+        self._lock = threading.Lock()
+
+    def set(self, document: Hashable, keys: Iterable[Hashable]) -> None:
+        """
+        Index the keys of the document, replacing the previous keys. Documents without keys are removed
+        :param document:
+        :param keys:
+        :return:
+        """
+
+        keys = frozenset(keys)
+        with self._lock:
+            self._remove(document)
+            if not keys:
+                return
+            self._keys[document] = keys
+            for key in keys:
+                self._postings[key].add(document)
+
+    def remove(self, document: Hashable) -> None:
+        with self._lock:
+            self._remove(document)
+
+    def _remove(self, document: Hashable) -> None:
+        for key in self._keys.pop(document, ()):
+            postings = self._postings[key]
+            postings.discard(document)
+            if not postings:
+                del self._postings[key]
+
+    def get(self, document: Hashable) -> frozenset:
+        return self._keys.get(document, frozenset())
+
+    def load(self, documents: dict[Hashable, Iterable[Hashable]]) -> None:
+        """
+        Replace all documents of the index, the new postings are built before taking the lock
+        :param documents: keys of every document
+        :return:
+        """
+
+        document_keys = {document: frozenset(keys) for document, keys in documents.items() if keys}
+        postings = defaultdict(set)
+        for document, keys in document_keys.items():
+            for key in keys:
+                postings[key].add(document)
+        with self._lock:
+            self._keys = document_keys
+            self._postings = postings
+
+    def rank(
+        self, keys: Iterable[Hashable], others: dict[Hashable, Iterable[Hashable]] | None = None
+    ) -> list[tuple[Hashable, int, int]]:
+        """
+        Rank the documents having any of the keys by the share of their keys which are given,
+        then by the count of the given keys they have
+        :param keys:
+        :param others: keys of documents which are not indexed, ranked together with the indexed ones
+        :return: (document, matched keys, all keys of the document) triples, best first
+        """
+
+        keys = set(keys)
+        matched = Counter()
+        with self._lock:
+            for key in keys:
+                matched.update(self._postings.get(key, ()))
+            ranked = [(document, count, len(self._keys[document])) for document, count in matched.items()]
+        for document, document_keys in (others or {}).items():
+            document_keys = frozenset(document_keys)
+            count = len(keys & document_keys)
+            if count:
+                ranked.append((document, count, len(document_keys)))
+        ranked.sort(key=lambda item: (-item[1] / item[2], -item[1], item[2]))
+        return ranked
+
+    def clear(self) -> None:
+        with self._lock:
+            self._keys.clear()
+            self._postings.clear()
+
+    def __len__(self) -> int:
+        return len(self._keys)
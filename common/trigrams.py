@@ -0,0 +1,124 @@
+"""Trigram similarity, compatible with the PostgreSQL pg_trgm extension"""
+import re
+import threading
+from collections import defaultdict
+from typing import Hashable
+
+
+def get_trigrams(text: str) -> set[str]:
+    """
+    Get the trigrams of the words of the text, the words are padded with two spaces in front and one at the end
+    :param text:
+    :return:
+    """
+
+    trigrams = set()
+    for word in re.findall(r'[^\W_]+', text.lower()):
+        word = f'  {word} '
+        trigrams.update(word[i : i + 3] for i in range(len(word) - 2))
+    return trigrams
+
+
+def similarity(first: str, second: str) -> float:
+    """
+    Share of the trigrams of both texts which they have in common
+    :param first:
+    :param second:
+    :return:
+    """
+
+    return _similarity(get_trigrams(first), get_trigrams(second))
+
+
+def _similarity(first: set[str], second: set[str]) -> float:
+    if not first or not second:
+        return 0.0
+    return len(first & second) / len(first | second)
+
+
+def _word_similarity(query: set[str], text: set[str]) -> float:
+    # share of the query found in the text, the word ends are ignored as the query may not be typed completely yet
+    query = {trigram for trigram in query if not trigram.endswith(' ')}
+    if not query:
+        return 0.0
+    return len(query & text) / len(query)
+
+
+class TrigramIndex:
+    """
+    Thread safe in-memory trigram index of short texts (names) by key
+    """
+
+    def __init__(self):
+        self._texts: dict[Hashable, set[str]] = {}
+        self._postings: dict[str, set[Hashable]] = defaultdict(set)
+        self._lock = threading.Lock()
+
+    def add(self, key: Hashable, text: str) -> None:
+        """
+        Index the text of the key, replacing the previous text
+        :param key:
+        :param text:
+        :return:
+        """
+
+        with self._lock:
+            self._remove(key)
+            self._texts[key] = trigrams = get_trigrams(text)
+            for trigram in trigrams:
+                self._postings[trigram].add(key)
+
+    def remove(self, key: Hashable) -> None:
+        with self._lock:
+            self._remove(key)
+
+    def _remove(self, key: Hashable) -> None:
+        for trigram in self._texts.pop(key, ()):
+            self._postings[trigram].discard(key)
+
+    def search(self, query: str, limit: int, min_score: float = 0.3) -> list[tuple[Hashable, float]]:
+        """
+        Find the keys with the most similar texts. Texts starting with the query score high as well,
+        so the index can be used for autocomplete
+        :param query:
+        :param limit:
+        :param min_score:
+        :return: (key, score) pairs, best first
+        """
+
+        query_trigrams = get_trigrams(query)
+        with self._lock:
+            candidates = set().union(*(self._postings.get(trigram, ()) for trigram in query_trigrams))
+            scores = []
+            for key in candidates:
+                text_trigrams = self._texts[key]
+                text_similarity = _similarity(query_trigrams, text_trigrams)
+                score = max(text_similarity, _word_similarity(query_trigrams, text_trigrams))
+                if score >= min_score:
+                    scores.append((key, score, text_similarity))
+        scores.sort(key=lambda item: (item[1], item[2]), reverse=True)
+        return [(key, score) for key, score, _ in scores[:limit]]
+
+    def similar(self, text: str, min_similarity: float) -> list[tuple[Hashable, float]]:
+        """
+        Find the keys with texts at least `min_similarity` similar to the text, most similar first
+        :param text:
+        :param min_similarity:
+        :return:
+        """
+
+        trigrams = get_trigrams(text)
+        with self._lock:
+            candidates = set().union(*(self._postings.get(trigram, ()) for trigram in trigrams))
+            scores = [(key, _similarity(trigrams, self._texts[key])) for key in candidates]
+        return sorted(
+            [(key, score) for key, score in scores if score >= min_similarity], key=lambda item: item[1], reverse=True
+        )
+
+    def clear(self) -> None:
+        with self._lock:
+            self._texts.clear()
+            self._postings.clear()
+
+    def __len__(self) -> int:
+        return len(self._texts)
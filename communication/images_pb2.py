@@ -14,7 +14,7 @@ _sym_db = _symbol_database.Default()
 
 
 DESCRIPTOR = _descriptor_pool.Default().AddSerializedFile(
-    b'\n\x0cimages.proto\x12\x06images\" \n\x0cImageRequest\x12\x10\n\x08image_id\x18\x01 \x01(\x03\"5\n\rImageResponse\x12\x16\n\timage_url\x18\x01 \x01(\tH\x00\x88\x01\x01\x42\x0c\n\n_image_url2F\n\x06Images\x12<\n\rget_image_url\x12\x14.images.ImageRequest\x1a\x15.images.ImageResponseb\x06proto3'
+    b'\n\x0cimages.proto\x12\x06images\" \n\x0cImageRequest\x12\x10\n\x08image_id\x18\x01 \x01(\x03\"5\n\rImageResponse\x12\x16\n\timage_url\x18\x01 \x01(\tH\x00\x88\x01\x01\x42\x0c\n\n_image_url\"%\n\x10ImageUrlsRequest\x12\x11\n\timage_ids\x18\x01 \x03(\x03\"\x83\x01\n\x11ImageUrlsResponse\x12<\n\nimage_urls\x18\x01 \x03(\x0b\x32(.images.ImageUrlsResponse.ImageUrlsEntry\x1a\x30\n\x0eImageUrlsEntry\x12\x0b\n\x03key\x18\x01 \x01(\x03\x12\r\n\x05value\x18\x02 \x01(\t:\x02\x38\x01\x32\xdb\x01\n\x06Images\x12<\n\rget_image_url\x12\x14.images.ImageRequest\x1a\x15.images.ImageResponse\x12\x45\n\x0eget_image_urls\x12\x18.images.ImageUrlsRequest\x1a\x19.images.ImageUrlsResponse\x12L\n\x11stream_image_urls\x12\x18.images.ImageUrlsRequest\x1a\x19.images.ImageUrlsResponse(\x01\x30\x01\x62\x06proto3'
 )
 
 _globals = globals()
@@ -22,10 +22,18 @@ _builder.BuildMessageAndEnumDescriptors(DESCRIPTOR, _globals)
 _builder.BuildTopDescriptorsAndMessages(DESCRIPTOR, 'images_pb2', _globals)
 if _descriptor._USE_C_DESCRIPTORS == False:
     DESCRIPTOR._options = None
+    _globals['_IMAGEURLSRESPONSE_IMAGEURLSENTRY']._options = None
+    _globals['_IMAGEURLSRESPONSE_IMAGEURLSENTRY']._serialized_options = b'8\001'
     _globals['_IMAGEREQUEST']._serialized_start = 24
     _globals['_IMAGEREQUEST']._serialized_end = 56
     _globals['_IMAGERESPONSE']._serialized_start = 58
     _globals['_IMAGERESPONSE']._serialized_end = 111
-    _globals['_IMAGES']._serialized_start = 113
-    _globals['_IMAGES']._serialized_end = 183
+    _globals['_IMAGEURLSREQUEST']._serialized_start = 113
+    _globals['_IMAGEURLSREQUEST']._serialized_end = 150
+    _globals['_IMAGEURLSRESPONSE']._serialized_start = 153
+    _globals['_IMAGEURLSRESPONSE']._serialized_end = 284
+    _globals['_IMAGEURLSRESPONSE_IMAGEURLSENTRY']._serialized_start = 236
+    _globals['_IMAGEURLSRESPONSE_IMAGEURLSENTRY']._serialized_end = 284
+    _globals['_IMAGES']._serialized_start = 287
+    _globals['_IMAGES']._serialized_end = 506
 # @@protoc_insertion_point(module_scope)
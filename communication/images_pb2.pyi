@@ -1,6 +1,7 @@
+from google.protobuf.internal import containers as _containers
 from google.protobuf import descriptor as _descriptor
 from google.protobuf import message as _message
-from typing import ClassVar as _ClassVar, Optional as _Optional
+from typing import ClassVar as _ClassVar, Iterable as _Iterable, Mapping as _Mapping, Optional as _Optional
 
 DESCRIPTOR: _descriptor.FileDescriptor
 
@@ -15,3 +16,24 @@ class ImageResponse(_message.Message):
     IMAGE_URL_FIELD_NUMBER: _ClassVar[int]
     image_url: str
     def __init__(self, image_url: _Optional[str] = ...) -> None: ...
+
+class ImageUrlsRequest(_message.Message):
+    __slots__ = ("image_ids",)
+    IMAGE_IDS_FIELD_NUMBER: _ClassVar[int]
+    image_ids: _containers.RepeatedScalarFieldContainer[int]
+    def __init__(self, image_ids: _Optional[_Iterable[int]] = ...) -> None: ...
+
+class ImageUrlsResponse(_message.Message):
+    __slots__ = ("image_urls",)
+
+    class ImageUrlsEntry(_message.Message):
+        __slots__ = ("key", "value")
+        KEY_FIELD_NUMBER: _ClassVar[int]
+        VALUE_FIELD_NUMBER: _ClassVar[int]
+        key: int
+        value: str
+        def __init__(self, key: _Optional[int] = ..., value: _Optional[str] = ...) -> None: ...
+
+    IMAGE_URLS_FIELD_NUMBER: _ClassVar[int]
+    image_urls: _containers.ScalarMap[int, str]
+    def __init__(self, image_urls: _Optional[_Mapping[int, str]] = ...) -> None: ...
@@ -19,6 +19,16 @@ class ImagesStub(object):
             request_serializer=images__pb2.ImageRequest.SerializeToString,
             response_deserializer=images__pb2.ImageResponse.FromString,
         )
+        self.get_image_urls = channel.unary_unary(
+            '/images.Images/get_image_urls',
+            request_serializer=images__pb2.ImageUrlsRequest.SerializeToString,
+            response_deserializer=images__pb2.ImageUrlsResponse.FromString,
+        )
+        self.stream_image_urls = channel.stream_stream(
+            '/images.Images/stream_image_urls',
+            request_serializer=images__pb2.ImageUrlsRequest.SerializeToString,
+            response_deserializer=images__pb2.ImageUrlsResponse.FromString,
+        )
 
 
 class ImagesServicer(object):
@@ -30,6 +40,18 @@ class ImagesServicer(object):
         context.set_details('Method not implemented!')
         raise NotImplementedError('Method not implemented!')
 
+    def get_image_urls(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def stream_image_urls(self, request_iterator, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
 
 def add_ImagesServicer_to_server(servicer, server):
     rpc_method_handlers = {
@@ -38,6 +60,16 @@ def add_ImagesServicer_to_server(servicer, server):
             request_deserializer=images__pb2.ImageRequest.FromString,
             response_serializer=images__pb2.ImageResponse.SerializeToString,
         ),
+        'get_image_urls': grpc.unary_unary_rpc_method_handler(
+            servicer.get_image_urls,
+            request_deserializer=images__pb2.ImageUrlsRequest.FromString,
+            response_serializer=images__pb2.ImageUrlsResponse.SerializeToString,
+        ),
+        'stream_image_urls': grpc.stream_stream_rpc_method_handler(
+            servicer.stream_image_urls,
+            request_deserializer=images__pb2.ImageUrlsRequest.FromString,
+            response_serializer=images__pb2.ImageUrlsResponse.SerializeToString,
+        ),
     }
     generic_handler = grpc.method_handlers_generic_handler('images.Images', rpc_method_handlers)
     server.add_generic_rpc_handlers((generic_handler,))
@@ -75,3 +107,61 @@ class Images(object):
             timeout,
             metadata,
         )
+
+    @staticmethod
+    def get_image_urls(
+        request,
+        target,
+        options=(),
+        channel_credentials=None,
+        call_credentials=None,
+        insecure=False,
+        compression=None,
+        wait_for_ready=None,
+        timeout=None,
+        metadata=None,
+    ):
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            '/images.Images/get_image_urls',
+            images__pb2.ImageUrlsRequest.SerializeToString,
+            images__pb2.ImageUrlsResponse.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+        )
+
+    @staticmethod
+    def stream_image_urls(
+        request_iterator,
+        target,
+        options=(),
+        channel_credentials=None,
+        call_credentials=None,
+        insecure=False,
+        compression=None,
+        wait_for_ready=None,
+        timeout=None,
+        metadata=None,
+    ):
+        return grpc.experimental.stream_stream(
+            request_iterator,
+            target,
+            '/images.Images/stream_image_urls',
+            images__pb2.ImageUrlsRequest.SerializeToString,
+            images__pb2.ImageUrlsResponse.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+        )
@@ -14,7 +14,7 @@ _sym_db = _symbol_database.Default()
 
 
 DESCRIPTOR = _descriptor_pool.Default().AddSerializedFile(
-    b'\n\x0busers.proto\x12\x05users\"\"\n\x0fUsernameRequest\x12\x0f\n\x07user_id\x18\x01 \x01(\x03\"$\n\x10UsernameResponse\x12\x10\n\x08username\x18\x01 \x01(\t2H\n\x05Users\x12?\n\x0cget_username\x12\x16.users.UsernameRequest\x1a\x17.users.UsernameResponseb\x06proto3'
+    b'\n\x0busers.proto\x12\x05users\"\"\n\x0fUsernameRequest\x12\x0f\n\x07user_id\x18\x01 \x01(\x03\"$\n\x10UsernameResponse\x12\x10\n\x08username\x18\x01 \x01(\t\"$\n\x10UsernamesRequest\x12\x10\n\x08user_ids\x18\x01 \x03(\x03\"\x81\x01\n\x11UsernamesResponse\x12:\n\tusernames\x18\x01 \x03(\x0b\x32\'.users.UsernamesResponse.UsernamesEntry\x1a\x30\n\x0eUsernamesEntry\x12\x0b\n\x03key\x18\x01 \x01(\x03\x12\r\n\x05value\x18\x02 \x01(\t:\x02\x38\x01\x32\xd7\x01\n\x05Users\x12?\n\x0cget_username\x12\x16.users.UsernameRequest\x1a\x17.users.UsernameResponse\x12\x42\n\rget_usernames\x12\x17.users.UsernamesRequest\x1a\x18.users.UsernamesResponse\x12I\n\x10stream_usernames\x12\x17.users.UsernamesRequest\x1a\x18.users.UsernamesResponse(\x01\x30\x01\x62\x06proto3'
 )
 
 _globals = globals()
@@ -22,10 +22,18 @@ _builder.BuildMessageAndEnumDescriptors(DESCRIPTOR, _globals)
 _builder.BuildTopDescriptorsAndMessages(DESCRIPTOR, 'users_pb2', _globals)
 if _descriptor._USE_C_DESCRIPTORS == False:
     DESCRIPTOR._options = None
+    _globals['_USERNAMESRESPONSE_USERNAMESENTRY']._options = None
+    _globals['_USERNAMESRESPONSE_USERNAMESENTRY']._serialized_options = b'8\001'
     _globals['_USERNAMEREQUEST']._serialized_start = 22
     _globals['_USERNAMEREQUEST']._serialized_end = 56
     _globals['_USERNAMERESPONSE']._serialized_start = 58
     _globals['_USERNAMERESPONSE']._serialized_end = 94
-    _globals['_USERS']._serialized_start = 96
-    _globals['_USERS']._serialized_end = 168
+    _globals['_USERNAMESREQUEST']._serialized_start = 96
+    _globals['_USERNAMESREQUEST']._serialized_end = 132
+    _globals['_USERNAMESRESPONSE']._serialized_start = 135
+    _globals['_USERNAMESRESPONSE']._serialized_end = 264
+    _globals['_USERNAMESRESPONSE_USERNAMESENTRY']._serialized_start = 216
+    _globals['_USERNAMESRESPONSE_USERNAMESENTRY']._serialized_end = 264
+    _globals['_USERS']._serialized_start = 267
+    _globals['_USERS']._serialized_end = 482
 # @@protoc_insertion_point(module_scope)
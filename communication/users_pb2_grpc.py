@@ -19,6 +19,16 @@ class UsersStub(object):
             request_serializer=users__pb2.UsernameRequest.SerializeToString,
             response_deserializer=users__pb2.UsernameResponse.FromString,
         )
+        self.get_usernames = channel.unary_unary(
+            '/users.Users/get_usernames',
+            request_serializer=users__pb2.UsernamesRequest.SerializeToString,
+            response_deserializer=users__pb2.UsernamesResponse.FromString,
+        )
+        self.stream_usernames = channel.stream_stream(
+            '/users.Users/stream_usernames',
+            request_serializer=users__pb2.UsernamesRequest.SerializeToString,
+            response_deserializer=users__pb2.UsernamesResponse.FromString,
+        )
 
 
 class UsersServicer(object):
@@ -30,6 +40,18 @@ class UsersServicer(object):
         context.set_details('Method not implemented!')
         raise NotImplementedError('Method not implemented!')
 
+    def get_usernames(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def stream_usernames(self, request_iterator, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
 
 def add_UsersServicer_to_server(servicer, server):
     rpc_method_handlers = {
@@ -38,6 +60,16 @@ def add_UsersServicer_to_server(servicer, server):
             request_deserializer=users__pb2.UsernameRequest.FromString,
             response_serializer=users__pb2.UsernameResponse.SerializeToString,
         ),
+        'get_usernames': grpc.unary_unary_rpc_method_handler(
+            servicer.get_usernames,
+            request_deserializer=users__pb2.UsernamesRequest.FromString,
+            response_serializer=users__pb2.UsernamesResponse.SerializeToString,
+        ),
+        'stream_usernames': grpc.stream_stream_rpc_method_handler(
+            servicer.stream_usernames,
+            request_deserializer=users__pb2.UsernamesRequest.FromString,
+            response_serializer=users__pb2.UsernamesResponse.SerializeToString,
+        ),
     }
     generic_handler = grpc.method_handlers_generic_handler('users.Users', rpc_method_handlers)
     server.add_generic_rpc_handlers((generic_handler,))
@@ -75,3 +107,61 @@ class Users(object):
             timeout,
             metadata,
         )
+
+    @staticmethod
+    def get_usernames(
+        request,
+        target,
+        options=(),
+        channel_credentials=None,
+        call_credentials=None,
+        insecure=False,
+        compression=None,
+        wait_for_ready=None,
+        timeout=None,
+        metadata=None,
+    ):
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            '/users.Users/get_usernames',
+            users__pb2.UsernamesRequest.SerializeToString,
+            users__pb2.UsernamesResponse.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+        )
+
+    @staticmethod
+    def stream_usernames(
+        request_iterator,
+        target,
+        options=(),
+        channel_credentials=None,
+        call_credentials=None,
+        insecure=False,
+        compression=None,
+        wait_for_ready=None,
+        timeout=None,
+        metadata=None,
+    ):
+        return grpc.experimental.stream_stream(
+            request_iterator,
+            target,
+            '/users.Users/stream_usernames',
+            users__pb2.UsernamesRequest.SerializeToString,
+            users__pb2.UsernamesResponse.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+        )
@@ -17,6 +17,8 @@ MEDIA_PATH = ROOT_PATH.joinpath("media")
 MEDIA_PATH.joinpath("audio").mkdir(exist_ok=True)
 MEDIA_PATH.joinpath("images").mkdir(exist_ok=True)
 AUDIO_PATH = MEDIA_PATH.joinpath("audio")
+ROOT_PATH.joinpath("imports").mkdir(exist_ok=True)
+IMPORTS_PATH = ROOT_PATH.joinpath("imports")
 
 _ENV_FILES_PATHS = (
     pathlib.Path(f"{ROOT_PATH}/.env.template"),
@@ -67,10 +69,20 @@ class SqliteConfig(BaseModel):
 
     file_name: Optional[str] = None
 
+    @property
+    def database_path(self) -> str:
+        """Get database path, in memory databases are shared between the sync and async engines"""
+        return self.file_name if self.file_name else "file:kitchen-helper?mode=memory&cache=shared&uri=true"
+
     @property
     def connection_string(self) -> str:
         """Get connection string"""
-        return f"sqlite:///{self.file_name if self.file_name else ':memory:'}"
+        return f"sqlite:///{self.database_path}"
+
+    @property
+    def async_connection_string(self) -> str:
+        """Get async connection string"""
+        return f"sqlite+aiosqlite:///{self.database_path}"
 
     @property
     def is_in_memory(self) -> bool:
@@ -92,12 +104,125 @@ class PostgresConfig(BaseModel):
         """Get connection string"""
         return f"postgresql+psycopg2://{self.user}:{self.password}@{self.host}:{self.port}/{self.database}"
 
+    @property
+    def async_connection_string(self) -> str:
+        """Get async connection string"""
+        return f"postgresql+asyncpg://{self.user}:{self.password}@{self.host}:{self.port}/{self.database}"
+
     @property
     def are_all_fields_populated(self):
         """Check if all fields are populated"""
         return self.host and self.port and self.user and self.password and self.database
 
 
+class DbPoolConfig(BaseModel):
+    """DB connection pool configuration"""
+
+    size: int = 5
+    max_overflow: int = 10
+    timeout: int = 30
+    recycle: int = 1800
+    pre_ping: bool = True
+
+
+class RecipesCountCacheConfig(BaseModel):
+    """Recipe listing total count cache configuration"""
+
+    max_size: int = 1024
+    ttl: float = 60.0
+    # seconds between the checks for invalidations by other workers
+    check_interval: float = 1.0
+
+
+class IngredientMatchConfig(BaseModel):
+    """Ingredient name trigram matching configuration"""
+
+    # similarity of the names above which a new ingredient reuses the existing one
+    reuse_similarity: float = 0.6
+    suggest_min_score: float = 0.3
+
+
+class ReferenceCacheConfig(BaseModel):
+    """Categories, ingredients and roles cache configuration"""
+
+    max_size: int = 1024
+    ttl: float = 300.0
+    # seconds between the checks for invalidations by other workers
+    check_interval: float = 1.0
+
+
+class UsernamesCacheConfig(BaseModel):
+    """Usernames cache configuration"""
+
+    max_size: int = 10000
+    ttl: float = 600.0
+    # seconds between the checks for username changes by other workers
+    check_interval: float = 1.0
+
+
+class PasswordHashingConfig(BaseModel):
+    """bcrypt password hashing configuration"""
+
+    # cost factor, every increment doubles the hashing time
+    rounds: int = 12
+    workers: int = 4
+    # hashing jobs waiting for a worker before the requests are rejected with 429
+    max_pending: int = 16
+
+
+class PantryIndexConfig(BaseModel):
+    """In-memory ingredient to recipes index configuration"""
+
+    # seconds after which the index is rebuilt, picking up the changes made by other workers
+    refresh_interval: float = 300.0
+
+
+class RecipesImportConfig(BaseModel):
+    """Bulk recipes import configuration"""
+
+    # recipes inserted and committed together
+    chunk_size: int = 1000
+    # larger files are imported by a celery task
+    sync_max_bytes: int = 1024 * 1024
+    # larger uploads are rejected
+    max_bytes: int = 100 * 1024 * 1024
+    # invalid lines reported back, the rest are only counted
+    max_errors: int = 100
+    # seconds the progress of the import tasks is kept
+    progress_ttl: int = 24 * 60 * 60
+
+
+class GrpcClientConfig(BaseModel):
+    """gRPC client configuration"""
+
+    timeout: float = 1.0
+    keepalive_time_ms: int = 30000
+    keepalive_timeout_ms: int = 10000
+    breaker_failure_threshold: int = 5
+    breaker_reset_timeout: float = 30.0
+
+
+class GrpcServerConfig(BaseModel):
+    """gRPC servers configuration"""
+
+    embedded: bool = True
+    maximum_concurrent_rpcs: Optional[int] = 100
+    max_connection_idle_ms: int = 300000
+    # must not be over the keepalive time of the clients, which ping idle connections as well
+    min_ping_interval_ms: int = 20000
+    shutdown_grace: float = 5.0
+
+    @property
+    def options(self) -> list[tuple[str, int]]:
+        """Get server channel options, the workers of the app share the server ports"""
+        return [
+            ("grpc.so_reuseport", 1),
+            ("grpc.max_connection_idle_ms", self.max_connection_idle_ms),
+            ("grpc.keepalive_permit_without_calls", 1),
+            ("grpc.http2.min_ping_interval_without_data_ms", self.min_ping_interval_ms),
+        ]
+
+
 class JwtToken(CustomBaseSettings):
     """JWT Token settings"""
 
@@ -106,6 +231,9 @@ class JwtToken(CustomBaseSettings):
     algorithm: str
     secret_key: str
     refresh_secret_key: str
+    # verified access tokens kept until they expire
+    verified_tokens_cache_size: int = 4096
+    verified_tokens_cache_ttl: float = 900.0
 
 
 class CorsSettings(CustomBaseSettings):
@@ -167,11 +295,21 @@ class Config(CustomBaseSettings):
     log_queries: bool
     sqlite: SqliteConfig
     postgres: PostgresConfig
+    db_pool: DbPoolConfig = DbPoolConfig()
+    recipes_count_cache: RecipesCountCacheConfig = RecipesCountCacheConfig()
+    ingredient_match: IngredientMatchConfig = IngredientMatchConfig()
+    reference_cache: ReferenceCacheConfig = ReferenceCacheConfig()
+    usernames_cache: UsernamesCacheConfig = UsernamesCacheConfig()
+    password_hashing: PasswordHashingConfig = PasswordHashingConfig()
+    pantry_index: PantryIndexConfig = PantryIndexConfig()
+    recipes_import: RecipesImportConfig = RecipesImportConfig()
     server: ServerConfiguration
     rabbitmq: RabbitmqConfiguration
     celery: CelerySettings
     users_grpc_server_host: str
     images_grpc_server_host: str
+    grpc_client: GrpcClientConfig = GrpcClientConfig()
+    grpc_server: GrpcServerConfig = GrpcServerConfig()
 
     @property
     def running_on_dev(self) -> bool:
@@ -184,6 +322,12 @@ class Config(CustomBaseSettings):
             return self.postgres.connection_string
         return self.sqlite.connection_string
 
+    @property
+    def async_connection_string(self):
+        if self.database == DbTypeOptions.POSTGRES:
+            return self.postgres.async_connection_string
+        return self.sqlite.async_connection_string
+
     @model_validator(mode="after")
     def validate_db_configuration(self):
         if self.database == DbTypeOptions.POSTGRES and not self.postgres.are_all_fields_populated:
@@ -1,11 +1,24 @@
 """DB connection module"""
+import contextlib
+import os
+import threading
+from typing import Annotated, AsyncIterator, Iterator
+
+import fastapi
 import sqlalchemy
 import sqlalchemy.orm
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, create_async_engine
 import configuration
 
 config = configuration.Config()
 
 CONNECTION_STRING = config.connection_string
+ASYNC_CONNECTION_STRING = config.async_connection_string
+
+_ENGINES: dict[str, sqlalchemy.Engine] = {}
+_ASYNC_ENGINES: dict[str, AsyncEngine] = {}
+_ENGINES_PID = os.getpid()
+_ENGINES_LOCK = threading.Lock()
 
 
 def _get_test_engine() -> sqlalchemy.Engine:
@@ -14,16 +27,147 @@ def _get_test_engine() -> sqlalchemy.Engine:
     )
 
 
-def get_engine() -> sqlalchemy.Engine:
+def _get_async_test_engine() -> AsyncEngine:
+    return create_async_engine(ASYNC_CONNECTION_STRING, echo=False, poolclass=sqlalchemy.NullPool)
+
+
+def _create_engine() -> sqlalchemy.Engine:
     """
-    Return engine
+    Create pooled engine for the configured database
     :return:
     """
 
-    echo = config.log_queries
     if config.database == configuration.DbTypeOptions.SQLITE and config.sqlite.is_in_memory:
         return _get_test_engine()
-    return sqlalchemy.create_engine(CONNECTION_STRING, echo=echo)
+    return sqlalchemy.create_engine(
+        CONNECTION_STRING,
+        echo=config.log_queries,
+        pool_size=config.db_pool.size,
+        max_overflow=config.db_pool.max_overflow,
+        pool_timeout=config.db_pool.timeout,
+        pool_recycle=config.db_pool.recycle,
+        pool_pre_ping=config.db_pool.pre_ping,
+    )
+
+
+def _create_async_engine() -> AsyncEngine:
+    """
+    Create pooled async engine for the configured database
+    :return:
+    """
+
+    if config.database == configuration.DbTypeOptions.SQLITE and config.sqlite.is_in_memory:
+        return _get_async_test_engine()
+    return create_async_engine(
+        ASYNC_CONNECTION_STRING,
+        echo=config.log_queries,
+        pool_size=config.db_pool.size,
+        max_overflow=config.db_pool.max_overflow,
+        pool_timeout=config.db_pool.timeout,
+        pool_recycle=config.db_pool.recycle,
+        pool_pre_ping=config.db_pool.pre_ping,
+    )
+
+
+def _reset_engines_after_fork() -> None:
+    """
+    Drop the engines inherited from the parent process.
+    The parent's connections must not be closed from the child, so the pools are only dereferenced
+    :return:
+    """
+
+    global _ENGINES_PID, _ENGINES_LOCK
+    for engine in _ENGINES.values():
+        engine.dispose(close=False)
+    for async_engine in _ASYNC_ENGINES.values():
+        async_engine.sync_engine.dispose(close=False)
+    _ENGINES.clear()
+    _ASYNC_ENGINES.clear()
+    _ENGINES_PID = os.getpid()
+    _ENGINES_LOCK = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_engines_after_fork)
+
+
+def get_engine() -> sqlalchemy.Engine:
+    """
+    Return the process-wide engine
+    :return:
+    """
+
+    if _ENGINES_PID != os.getpid():
+        _reset_engines_after_fork()
+
+    engine = _ENGINES.get(CONNECTION_STRING)
+    if engine is None:
+        with _ENGINES_LOCK:
+            engine = _ENGINES.get(CONNECTION_STRING)
+            if engine is None:
+                engine = _create_engine()
+                _ENGINES[CONNECTION_STRING] = engine
+    return engine
+
+
+def get_async_engine() -> AsyncEngine:
+    """
+    Return the process-wide async engine
+    :return:
+    """
+
+    if _ENGINES_PID != os.getpid():
+        _reset_engines_after_fork()
+
+    engine = _ASYNC_ENGINES.get(ASYNC_CONNECTION_STRING)
+    if engine is None:
+        with _ENGINES_LOCK:
+            engine = _ASYNC_ENGINES.get(ASYNC_CONNECTION_STRING)
+            if engine is None:
+                engine = _create_async_engine()
+                _ASYNC_ENGINES[ASYNC_CONNECTION_STRING] = engine
+    return engine
+
+
+def dispose_engines() -> None:
+    """
+    Close all pooled connections of the current process
+    :return:
+    """
+
+    with _ENGINES_LOCK:
+        for engine in _ENGINES.values():
+            engine.dispose()
+        _ENGINES.clear()
+
+
+async def dispose_async_engines() -> None:
+    """
+    Close all pooled async connections of the current process
+    :return:
+    """
+
+    engines = list(_ASYNC_ENGINES.values())
+    _ASYNC_ENGINES.clear()
+    for engine in engines:
+        await engine.dispose()
+
+
+def get_pool_status() -> dict:
+    """
+    Get connection pool statistics of the current process
+    :return:
+    """
+
+    pool = get_engine().pool
+    status = {'pool': pool.__class__.__name__, 'status': pool.status()}
+    if isinstance(pool, sqlalchemy.QueuePool):
+        status.update(
+            size=pool.size(),
+            checked_in=pool.checkedin(),
+            checked_out=pool.checkedout(),
+            overflow=pool.overflow(),
+        )
+    return status
 
 
 def get_connection(engine: sqlalchemy.Engine = None) -> sqlalchemy.Connection:
@@ -39,13 +183,88 @@ def get_connection(engine: sqlalchemy.Engine = None) -> sqlalchemy.Connection:
     return engine.connect()
 
 
-def get_session(engine: sqlalchemy.Engine = None) -> sqlalchemy.orm.Session:
+def get_session(engine: sqlalchemy.Engine = None, expire_on_commit: bool = True) -> sqlalchemy.orm.Session:
     """
     Get session
     :param engine:
+    :param expire_on_commit:
     :return:
     """
 
     if not engine:
         engine = get_engine()
-    return sqlalchemy.orm.Session(bind=engine, autocommit=False, autoflush=False)
+    return sqlalchemy.orm.Session(bind=engine, autocommit=False, autoflush=False, expire_on_commit=expire_on_commit)
+
+
+@contextlib.contextmanager
+def session_scope(session: sqlalchemy.orm.Session = None) -> Iterator[sqlalchemy.orm.Session]:
+    """
+    Reuse the given session or open a short-lived one for a single operation.
+    The objects loaded in the scope stay usable after it is closed
+
+    :param session:
+    :return:
+    """
+
+    if session is not None:
+        yield session
+        return
+    with get_session(expire_on_commit=False) as session:
+        yield session
+
+
+def get_request_session() -> Iterator[sqlalchemy.orm.Session]:
+    """
+    Session (unit of work) shared by all operations of a single request.
+    Operations commit their own changes, everything not committed is rolled back when the request ends
+
+    :return:
+    """
+
+    with get_session(expire_on_commit=False) as session:
+        yield session
+
+
+db_session = Annotated[sqlalchemy.orm.Session, fastapi.Depends(get_request_session)]
+
+
+def get_async_session(engine: AsyncEngine = None) -> AsyncSession:
+    """
+    Get async session
+    :param engine:
+    :return:
+    """
+
+    if not engine:
+        engine = get_async_engine()
+    return AsyncSession(bind=engine, autoflush=False, expire_on_commit=False)
+
+
+@contextlib.asynccontextmanager
+async def async_session_scope(session: AsyncSession = None) -> AsyncIterator[AsyncSession]:
+    """
+    Async variant of session_scope
+
+    :param session:
+    :return:
+    """
+
+    if session is not None:
+        yield session
+        return
+    async with get_async_session() as session:
+        yield session
+
+
+async def get_async_request_session() -> AsyncIterator[AsyncSession]:
+    """
+    Async session shared by all operations of a single request
+
+    :return:
+    """
+
+    async with get_async_session() as session:
+        yield session
+
+
+async_db_session = Annotated[AsyncSession, fastapi.Depends(get_async_request_session)]
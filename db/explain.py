@@ -0,0 +1,29 @@
+"""EXPLAIN statement"""
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.expression import ClauseElement, Executable
+
+
+class Explain(Executable, ClauseElement):
+    """
+    Query plan of a statement, on PostgreSQL the plan is a JSON document with the planner estimates
+    """
+
+    inherit_cache = False
+
+    def __init__(self, statement: ClauseElement):
+        self.statement = statement
+
+
+@compiles(Explain)
+def _compile_explain(element: Explain, compiler, **kw) -> str:
+    return f"EXPLAIN {compiler.process(element.statement, **kw)}"
+
+
+@compiles(Explain, 'sqlite')
+def _compile_explain_sqlite(element: Explain, compiler, **kw) -> str:
+    return f"EXPLAIN QUERY PLAN {compiler.process(element.statement, **kw)}"
+
+
+@compiles(Explain, 'postgresql')
+def _compile_explain_postgresql(element: Explain, compiler, **kw) -> str:
+    return f"EXPLAIN (FORMAT JSON) {compiler.process(element.statement, **kw)}"
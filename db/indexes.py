@@ -0,0 +1,16 @@
+"""Index helpers"""
+from sqlalchemy import Index
+from sqlalchemy.sql.expression import ColumnElement
+
+
+def partial_index(name: str, *columns, where: ColumnElement[bool]) -> Index:
+    """
+    Index of the rows matching the condition only. The queries must repeat the condition as it is written here
+    for the planners to use the index
+    :param name:
+    :param columns:
+    :param where:
+    :return:
+    """
+
+    return Index(name, *columns, postgresql_where=where, sqlite_where=where)
@@ -3,6 +3,7 @@ from logging.config import fileConfig
 from sqlalchemy import engine_from_config
 from sqlalchemy import pool
 from features import DbBaseModel
+import features.recipes.models
 import configuration
 from pathlib import Path
 
@@ -27,6 +28,24 @@ config.set_main_option('sqlalchemy.url', configuration.Config().connection_strin
 # target_metadata = mymodel.Base.metadata
 target_metadata = DbBaseModel.metadata
 
+
+def include_object(object, name, type_, reflected, compare_to) -> bool:
+    """
+    Leave out of the comparison the database objects which are created by the DDL of the models instead of
+    the metadata, autogenerate would drop them otherwise
+    """
+
+    if not reflected or compare_to is not None:
+        return True
+    if type_ == 'table':
+        return not name.startswith(features.recipes.models.DDL_MANAGED_TABLE_PREFIXES)
+    if type_ == 'column':
+        return (object.table.name, name) not in features.recipes.models.DDL_MANAGED_COLUMNS
+    if type_ == 'index':
+        return name not in features.recipes.models.DDL_MANAGED_INDEXES
+    return True
+
+
 # other values from the config, defined by the needs of env.py,
 # can be acquired:
 # my_important_option = config.get_main_option("my_important_option")
@@ -49,6 +68,7 @@ def run_migrations_offline() -> None:
     context.configure(
         url=url,
         target_metadata=target_metadata,
+        include_object=include_object,
         literal_binds=True,
         dialect_opts={"paramstyle": "named"},
     )
@@ -71,9 +91,7 @@ def run_migrations_online() -> None:
     )
 
     with connectable.connect() as connection:
-        context.configure(
-            connection=connection, target_metadata=target_metadata
-        )
+        context.configure(connection=connection, target_metadata=target_metadata, include_object=include_object)
 
         with context.begin_transaction():
             context.run_migrations()
@@ -82,4 +100,4 @@ def run_migrations_online() -> None:
 if context.is_offline_mode():
     run_migrations_offline()
 else:
-    run_migrations_online()
\ No newline at end of file
+    run_migrations_online()
@@ -0,0 +1,79 @@
+"""add denormalized nutrition, time to prepare and complexity columns to recipe
+
+Revision ID: 5b3f1c2e7a9d
+Revises: 0c76ca87fe5c
+Create Date: 2026-10-17 10:12:41.318265
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5b3f1c2e7a9d'
+down_revision: Union[str, None] = '0c76ca87fe5c'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+NUTRIENTS = {
+    'calories': 'calories',
+    'carbo': 'carbo',
+    'fats': 'fats',
+    'proteins': 'protein',
+    'cholesterol': 'cholesterol',
+}
+
+
+def _backfill() -> None:
+    recipes = sa.table(
+        'RECIPES',
+        sa.column('id'),
+        sa.column('time_to_prepare'),
+        sa.column('complexity'),
+        *(sa.column(column) for column in NUTRIENTS),
+    )
+    ingredients = sa.table('INGREDIENTS', sa.column('id'), *(sa.column(column) for column in NUTRIENTS.values()))
+    mapping = sa.table(
+        'RECIPE_INGREDIENTS_MAPPING', sa.column('recipe_id'), sa.column('ingredient_id'), sa.column('quantity')
+    )
+    instructions = sa.table('RECIPE_INSTRUCTIONS', sa.column('recipe_id'), sa.column('time'), sa.column('complexity'))
+
+    values = {
+        column: sa.select(sa.func.coalesce(sa.func.sum(mapping.c.quantity * ingredients.c[nutrient]), 0))
+        .select_from(mapping.join(ingredients, ingredients.c.id == mapping.c.ingredient_id))
+        .where(mapping.c.recipe_id == recipes.c.id)
+        .scalar_subquery()
+        for column, nutrient in NUTRIENTS.items()
+    }
+    values['time_to_prepare'] = (
+        sa.select(sa.func.coalesce(sa.func.sum(instructions.c.time), 0))
+        .where(instructions.c.recipe_id == recipes.c.id)
+        .scalar_subquery()
+    )
+    values['complexity'] = (
+        sa.select(
+            sa.func.coalesce(sa.func.round(sa.cast(sa.func.avg(instructions.c.complexity), sa.Numeric(10, 2)), 1), 0)
+        )
+        .where(instructions.c.recipe_id == recipes.c.id)
+        .scalar_subquery()
+    )
+    op.execute(recipes.update().values(values))
+
+
+def upgrade() -> None:
+    for column in NUTRIENTS:
+        op.add_column(
+            'RECIPES', sa.Column(column, sa.Numeric(precision=10, scale=2), server_default='0', nullable=False)
+        )
+    op.add_column('RECIPES', sa.Column('time_to_prepare', sa.Integer(), server_default='0', nullable=False))
+    op.add_column('RECIPES', sa.Column('complexity', sa.Float(), server_default='0', nullable=False))
+    _backfill()
+
+
+def downgrade() -> None:
+    op.drop_column('RECIPES', 'complexity')
+    op.drop_column('RECIPES', 'time_to_prepare')
+    for column in reversed(list(NUTRIENTS)):
+        op.drop_column('RECIPES', column)
@@ -0,0 +1,62 @@
+"""add full-text search index of the recipe names and summaries
+
+Revision ID: 8e2d4b6a1c3f
+Revises: 5b3f1c2e7a9d
+Create Date: 2026-10-17 14:03:27.512907
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8e2d4b6a1c3f'
+down_revision: Union[str, None] = '5b3f1c2e7a9d'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    if op.get_context().dialect.name == 'postgresql':
+        # the generated column is computed for the existing recipes as well
+        op.execute(
+            'ALTER TABLE "RECIPES" ADD COLUMN search_vector tsvector GENERATED ALWAYS AS ('
+            "setweight(to_tsvector('english', coalesce(name, '')), 'A') || "
+            "setweight(to_tsvector('english', coalesce(summary, '')), 'B')) STORED"
+        )
+        op.execute('CREATE INDEX ix_recipes_search_vector ON "RECIPES" USING gin (search_vector)')
+        return
+
+    op.execute(
+        'CREATE VIRTUAL TABLE "RECIPES_SEARCH" USING fts5('
+        "name, summary, content='RECIPES', content_rowid='id', tokenize='porter unicode61')"
+    )
+    op.execute(
+        'CREATE TRIGGER recipes_search_insert AFTER INSERT ON "RECIPES" BEGIN '
+        'INSERT INTO "RECIPES_SEARCH"(rowid, name, summary) VALUES (new.id, new.name, new.summary); END'
+    )
+    op.execute(
+        'CREATE TRIGGER recipes_search_delete AFTER DELETE ON "RECIPES" BEGIN '
+        'INSERT INTO "RECIPES_SEARCH"("RECIPES_SEARCH", rowid, name, summary) '
+        "VALUES ('delete', old.id, old.name, old.summary); END"
+    )
+    op.execute(
+        'CREATE TRIGGER recipes_search_update AFTER UPDATE OF name, summary ON "RECIPES" BEGIN '
+        'INSERT INTO "RECIPES_SEARCH"("RECIPES_SEARCH", rowid, name, summary) '
+        "VALUES ('delete', old.id, old.name, old.summary); "
+        'INSERT INTO "RECIPES_SEARCH"(rowid, name, summary) VALUES (new.id, new.name, new.summary); END'
+    )
+    op.execute('INSERT INTO "RECIPES_SEARCH"("RECIPES_SEARCH") VALUES (\'rebuild\')')
+
+
+def downgrade() -> None:
+    if op.get_context().dialect.name == 'postgresql':
+        op.execute('DROP INDEX ix_recipes_search_vector')
+        op.execute('ALTER TABLE "RECIPES" DROP COLUMN search_vector')
+        return
+
+    op.execute('DROP TRIGGER recipes_search_update')
+    op.execute('DROP TRIGGER recipes_search_delete')
+    op.execute('DROP TRIGGER recipes_search_insert')
+    op.execute('DROP TABLE "RECIPES_SEARCH"')
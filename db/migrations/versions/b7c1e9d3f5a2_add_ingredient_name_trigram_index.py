@@ -0,0 +1,31 @@
+"""add trigram index of the ingredient names
+
+Revision ID: b7c1e9d3f5a2
+Revises: 8e2d4b6a1c3f
+Create Date: 2026-10-17 16:21:08.904113
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b7c1e9d3f5a2'
+down_revision: Union[str, None] = '8e2d4b6a1c3f'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # sqlite matches the ingredient names in memory
+    if op.get_context().dialect.name != 'postgresql':
+        return
+    op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    op.execute('CREATE INDEX ix_ingredients_name_trgm ON "INGREDIENTS" USING gin (name gin_trgm_ops)')
+
+
+def downgrade() -> None:
+    if op.get_context().dialect.name != 'postgresql':
+        return
+    op.execute('DROP INDEX ix_ingredients_name_trgm')
@@ -0,0 +1,29 @@
+"""add ingredient first index of the recipe ingredients mapping
+
+Revision ID: c4a8f2e6d1b9
+Revises: b7c1e9d3f5a2
+Create Date: 2026-10-17 17:02:45.671230
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c4a8f2e6d1b9'
+down_revision: Union[str, None] = 'b7c1e9d3f5a2'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_index(
+        'ix_recipe_ingredients_mapping_ingredient_id',
+        'RECIPE_INGREDIENTS_MAPPING',
+        ['ingredient_id', 'recipe_id'],
+    )
+
+
+def downgrade() -> None:
+    op.drop_index('ix_recipe_ingredients_mapping_ingredient_id', table_name='RECIPE_INGREDIENTS_MAPPING')
@@ -0,0 +1,67 @@
+"""add secondary and partial indexes of the listing filters, celery scans and token lookups
+
+Revision ID: d9e3b5a7c2f4
+Revises: c4a8f2e6d1b9
+Create Date: 2026-10-17 18:11:52.204718
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd9e3b5a7c2f4'
+down_revision: Union[str, None] = 'c4a8f2e6d1b9'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+NOT_DELETED = sa.column('is_deleted', sa.Boolean).is_(False)
+PUBLISHED = sa.column('is_published', sa.Boolean).is_(True)
+
+
+def _where(condition) -> dict:
+    return {'postgresql_where': condition, 'sqlite_where': condition}
+
+
+def upgrade() -> None:
+    op.create_index(
+        'ix_recipes_published_created_on', 'RECIPES', ['created_on', 'id'], **_where(sa.and_(NOT_DELETED, PUBLISHED))
+    )
+    op.create_index('ix_recipes_created_by_created_on', 'RECIPES', ['created_by', 'created_on'], **_where(NOT_DELETED))
+    op.create_index('ix_recipes_category_id', 'RECIPES', ['category_id'])
+    op.create_index('ix_recipes_updated_on', 'RECIPES', ['updated_on'])
+    # sqlite does not use partial indexes for the branches of OR
+    op.create_index(
+        'ix_recipes_summary_missing', 'RECIPES', ['summary'], postgresql_where=sa.column('summary').is_(None)
+    )
+    op.create_index('ix_recipe_instructions_recipe_id', 'RECIPE_INSTRUCTIONS', ['recipe_id'])
+    op.create_index('ix_recipe_instructions_updated_on', 'RECIPE_INSTRUCTIONS', ['updated_on'])
+    op.create_index(
+        'ix_recipe_instructions_audio_file_missing',
+        'RECIPE_INSTRUCTIONS',
+        ['audio_file'],
+        postgresql_where=sa.column('audio_file').is_(None),
+    )
+    op.create_index(
+        'ix_images_not_in_cloudinary', 'IMAGES', ['id'], **_where(sa.column('in_cloudinary', sa.Boolean).is_(False))
+    )
+    op.create_index('ix_confirmation_token_token', 'CONFIRMATION_TOKEN', ['token'])
+    op.create_index(
+        'ix_confirmation_token_user_id_token_type', 'CONFIRMATION_TOKEN', ['user_id', 'token_type', 'expired_on']
+    )
+
+
+def downgrade() -> None:
+    op.drop_index('ix_confirmation_token_user_id_token_type', table_name='CONFIRMATION_TOKEN')
+    op.drop_index('ix_confirmation_token_token', table_name='CONFIRMATION_TOKEN')
+    op.drop_index('ix_images_not_in_cloudinary', table_name='IMAGES')
+    op.drop_index('ix_recipe_instructions_audio_file_missing', table_name='RECIPE_INSTRUCTIONS')
+    op.drop_index('ix_recipe_instructions_updated_on', table_name='RECIPE_INSTRUCTIONS')
+    op.drop_index('ix_recipe_instructions_recipe_id', table_name='RECIPE_INSTRUCTIONS')
+    op.drop_index('ix_recipes_summary_missing', table_name='RECIPES')
+    op.drop_index('ix_recipes_updated_on', table_name='RECIPES')
+    op.drop_index('ix_recipes_category_id', table_name='RECIPES')
+    op.drop_index('ix_recipes_created_by_created_on', table_name='RECIPES')
+    op.drop_index('ix_recipes_published_created_on', table_name='RECIPES')
@@ -1,14 +1,18 @@
-from db.connection import get_engine
+from db.connection import get_engine, get_pool_status
 from sqlalchemy import exc as sqlalchemy_exc
 
 
 def check_db_status() -> str:
     try:
-        get_engine().connect()
-        return "Working"
+        with get_engine().connect():
+            return "Working"
     except sqlalchemy_exc.DBAPIError as e:
         print(f"Database error: {e}")
         return "Not Working"
     except Exception as e:
         print(f"Unexpected error: {e}")
         return "Not Working"
+
+
+def get_db_pool_status() -> dict:
+    return get_pool_status()
@@ -1,5 +1,5 @@
 import fastapi
-from .operations import check_db_status
+from .operations import check_db_status, get_db_pool_status
 from . import responses
 
 router = fastapi.APIRouter()
@@ -13,5 +13,6 @@ def api_health():
     return responses.BaseHealthResponse(
         status_code=fastapi.status.HTTP_200_OK,
         text="API is healthy",
-        db_status=db_status
+        db_status=db_status,
+        db_pool=get_db_pool_status(),
     )
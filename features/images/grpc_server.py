@@ -1,27 +1,47 @@
 """gRPC server for images feature"""
-from concurrent import futures
 import grpc
 import communication.images_pb2
 import communication.images_pb2_grpc
 import configuration
 import features.images.operations
+from .exceptions import ImageNotFoundException
 import khLogging
 
 
 class ImagesServicer(communication.images_pb2_grpc.ImagesServicer):
-    def get_image_url(self, request, context):
+    async def get_image_url(self, request, context):
         try:
-            image = features.images.operations.get_image(request.image_id)
+            image = await features.images.operations.get_image_async(request.image_id)
             image_url = features.images.operations.generate_image_url(image.name, image.in_cloudinary)
-        except:
+        except ImageNotFoundException:
             image_url = None
         message = communication.images_pb2.ImageResponse(image_url=image_url)
         return message
 
+    async def get_image_urls(self, request, context):
+        images = await features.images.operations.get_images_by_ids(request.image_ids)
+        image_urls = {
+            image.id: features.images.operations.generate_image_url(image.name, image.in_cloudinary) for image in images
+        }
+        message = communication.images_pb2.ImageUrlsResponse(image_urls=image_urls)
+        return message
+
+    async def stream_image_urls(self, request_iterator, context):
+        async for request in request_iterator:
+            yield await self.get_image_urls(request, context)
+
+
+def create_server() -> grpc.aio.Server:
+    """
+    Create the images gRPC server on the running event loop
+    :return:
+    """
 
-def serve():
-    server = grpc.server(futures.ThreadPoolExecutor(max_workers=10))
+    config = configuration.Config()
+    server = grpc.aio.server(
+        maximum_concurrent_rpcs=config.grpc_server.maximum_concurrent_rpcs,
+        options=config.grpc_server.options,
+    )
     communication.images_pb2_grpc.add_ImagesServicer_to_server(ImagesServicer(), server=server)
-    server.add_insecure_port(configuration.Config().images_grpc_server_host)
-    server.start()
-    server.wait_for_termination()
+    server.add_insecure_port(config.images_grpc_server_host)
+    return server
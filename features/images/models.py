@@ -1,4 +1,5 @@
 from sqlalchemy import Integer, String, DateTime, func, Boolean
+from db.indexes import partial_index
 from features import DbBaseModel
 from sqlalchemy.orm import Mapped, mapped_column
 import datetime
@@ -13,9 +14,15 @@ class Image(DbBaseModel):
     width: Mapped[int] = mapped_column(Integer)
     height: Mapped[int] = mapped_column(Integer)
     uploaded_by: Mapped[int] = mapped_column(Integer)
-    uploaded_on: Mapped[datetime.datetime] = mapped_column(DateTime, server_default=func.current_timestamp(), init=False)
+    uploaded_on: Mapped[datetime.datetime] = mapped_column(
+        DateTime, server_default=func.current_timestamp(), init=False
+    )
     updated_by: Mapped[Optional[int]] = mapped_column(Integer, nullable=True, init=False)
-    updated_on: Mapped[datetime.datetime] = mapped_column(DateTime, server_default=func.current_timestamp(),
-                                                          onupdate=func.current_timestamp(), init=False)
+    updated_on: Mapped[datetime.datetime] = mapped_column(
+        DateTime, server_default=func.current_timestamp(), onupdate=func.current_timestamp(), init=False
+    )
     in_cloudinary: Mapped[bool] = mapped_column(Boolean, default=False)
 
+
+# the images still to be uploaded by the celery task
+partial_index('ix_images_not_in_cloudinary', Image.id, where=Image.in_cloudinary.is_(False))
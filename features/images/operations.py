@@ -1,6 +1,10 @@
 import io
 import uuid
 from pathlib import Path
+from typing import Iterable
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 
 import db.connection
 from .constants import IMAGES_DIR
@@ -91,11 +95,11 @@ async def add_image(added_by, url: str = None, image: bytes = None):
     logging.info(
         f"User {added_by} added picture to file system from {'url' if url else 'file'}. Image name: {file_name}"
     )
-    with db.connection.get_session() as session:
+    async with db.connection.async_session_scope() as session:
         image_db = Image(**image_metadata)
         session.add(image_db)
-        session.commit()
-        session.refresh(image_db)
+        await session.commit()
+        await session.refresh(image_db)
 
     return image_db
 
@@ -115,13 +119,47 @@ def get_image(image_id: int):
         return image
 
 
-async def get_images():
+async def get_images_by_ids(image_ids: Iterable[int], session: AsyncSession = None) -> list[Image]:
+    """
+    Get multiple images with a single query
+    :param image_ids:
+    :param session:
+    :return:
+    """
+
+    image_ids = set(image_ids)
+    if not image_ids:
+        return []
+
+    async with db.connection.async_session_scope(session) as session:
+        return list((await session.scalars(select(Image).where(Image.id.in_(image_ids)))).all())
+
+
+async def get_image_async(image_id: int, session: AsyncSession = None):
+    """
+    Get image without blocking the event loop
+    :param image_id:
+    :param session:
+    :return:
+    """
+
+    async with db.connection.async_session_scope(session) as session:
+        image = await session.get(Image, image_id)
+
+    if not image:
+        raise ImageNotFoundException
+    return image
+
+
+async def get_images(session: AsyncSession = None):
     """
     Get images
+    :param session:
     :return:
     """
-    with db.connection.get_session() as session:
-        return session.query(Image).all()
+
+    async with db.connection.async_session_scope(session) as session:
+        return list((await session.scalars(select(Image))).all())
 
 
 def generate_image_url(image_name: str, in_cloudinary: bool = False) -> str:
@@ -1,6 +1,7 @@
 import fastapi
 
 import common.authentication
+import db.connection
 import features.images.operations
 from .responses import ImageResponse
 from .exceptions import InvalidCreationInputException, ImageUrlIsNotReachable, ImageNotFoundException
@@ -48,15 +49,16 @@ async def upload_image(
 
 
 @router.get('/{image_id}', response_model=ImageResponse)
-async def get_image(image_id: int = fastapi.Path()):
+async def get_image(session: db.connection.async_db_session, image_id: int = fastapi.Path()):
     """
     Get image
+    :param session:
     :param image_id:
     :return:
     """
 
     try:
-        return features.images.operations.get_image(image_id)
+        return await features.images.operations.get_image_async(image_id, session=session)
     except ImageNotFoundException:
         raise fastapi.HTTPException(
             status_code=fastapi.status.HTTP_404_NOT_FOUND, detail=f"Image with id: {image_id} does not exist!"
@@ -64,10 +66,11 @@ async def get_image(image_id: int = fastapi.Path()):
 
 
 @router.get('/', response_model=list[ImageResponse])
-async def get_images():
+async def get_images(session: db.connection.async_db_session):
     """
     Get images
+    :param session:
     :return:
     """
 
-    return await features.images.operations.get_images()
+    return await features.images.operations.get_images(session=session)
@@ -0,0 +1,23 @@
+"""Backfill the denormalized nutrition, time to prepare and complexity columns of the recipes
+
+Usage: python -m features.recipes.backfill [--batch-size 500]
+"""
+import argparse
+
+import features.recipes.operations
+import khLogging
+
+logging = khLogging.Logger("recipes-backfill")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--batch-size', type=int, default=500, help='recipes refreshed per transaction')
+    args = parser.parse_args()
+
+    refreshed = features.recipes.operations.refresh_all_recipes_summary(batch_size=args.batch_size)
+    logging.info(f"Backfill finished, {refreshed} recipes were refreshed")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,42 +1,325 @@
+import base64
+import csv
+import decimal
+import io
+import json
 import math
+import re
 from datetime import datetime, timedelta
+from typing import Sequence, Iterable, Iterator
 
+import sqlalchemy.event
+import sqlalchemy.orm
 from fastapi import Query
-from sqlalchemy import desc, asc, func, or_, distinct
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import desc, asc, func, or_, and_, distinct, select, Select, cast, Float, Numeric, String
+from sqlalchemy import column, literal_column, table
+from sqlalchemy.dialects.postgresql import TSVECTOR
+from sqlalchemy.ext.asyncio import AsyncSession
+
+import common.cache
+import configuration
+import db.explain
+from features.recipes.input_models import PSFRecipesInputModel, CountOptions
+from features.recipes.models import RecipeCategory, Recipe, RecipeIngredient, Ingredient, RecipeInstruction
+from features.recipes.responses import RecipeResponse, PSFRecipesResponseModel, get_usernames, get_image_urls
+
+config = configuration.Config()
+
+# full-text search index of the recipes, see the search DDL of the recipe models
+SEARCH_VECTOR = literal_column('"RECIPES".search_vector', type_=TSVECTOR)
+SEARCH_TABLE = table('RECIPES_SEARCH', column('rowid'))
+
+# size of the streamed export chunks
+EXPORT_CHUNK_SIZE = 64 * 1024
+
+# exact total counts of the recipe listings by filters and visibility, dropped in all workers on change
+RECIPES_COUNT_CACHE = common.cache.SharedTTLCache(
+    'recipes_count',
+    config.recipes_count_cache.max_size,
+    config.recipes_count_cache.ttl,
+    config.recipes_count_cache.check_interval,
+)
+
+
+def paginate_recipes(
+    filtered_recipes: Query, paginated_input_model: PSFRecipesInputModel, count_key: str = None
+) -> PSFRecipesResponseModel:
+    """
+    Create recipes paginated response
+    :param filtered_recipes:
+    :param paginated_input_model:
+    :param count_key: key of the cached total count, see get_count_key
+    :return:
+    """
+
+    if paginated_input_model.cursor is not None:
+        return _paginate_recipes_by_cursor(filtered_recipes, paginated_input_model, count_key)
 
-import db.connection
-from features.recipes.input_models import PSFRecipesInputModel
-from features.recipes.models import RecipeCategory, Recipe, RecipeIngredient
-from features.recipes.responses import RecipeResponse, PSFRecipesResponseModel
+    total_items = _count_recipes(filtered_recipes, paginated_input_model, count_key)
+    current_page, total_pages = _get_current_page(total_items, paginated_input_model)
 
+    if current_page > 0:
+        offset = (current_page - 1) * paginated_input_model.page_size
 
-def paginate_recipes(filtered_recipes: Query, paginated_input_model: PSFRecipesInputModel) -> PSFRecipesResponseModel:
+        filtered_recipes = filtered_recipes.offset(offset).limit(paginated_input_model.page_size)
+
+    return _build_paginated_response(
+        current_page,
+        total_pages,
+        total_items,
+        paginated_input_model,
+        build_recipe_responses(filtered_recipes.all()),
+    )
+
+
+async def paginate_recipes_async(
+    statement: Select, paginated_input_model: PSFRecipesInputModel, session: AsyncSession, count_key: str = None
+) -> PSFRecipesResponseModel:
     """
-    Create recipes paginated response
+    Create recipes paginated response without blocking the event loop
+    :param statement:
+    :param paginated_input_model:
+    :param session:
+    :param count_key: key of the cached total count, see get_count_key
+    :return:
+    """
+
+    if paginated_input_model.cursor is not None:
+        return await _paginate_recipes_by_cursor_async(statement, paginated_input_model, session, count_key)
+
+    total_items = await _count_recipes_async(statement, paginated_input_model, session, count_key)
+    current_page, total_pages = _get_current_page(total_items, paginated_input_model)
+
+    if current_page > 0:
+        offset = (current_page - 1) * paginated_input_model.page_size
+        statement = statement.offset(offset).limit(paginated_input_model.page_size)
+
+    filtered_recipes = (await session.scalars(statement)).all()
+    # usernames and image urls are resolved with blocking grpc calls
+    recipes = await run_in_threadpool(build_recipe_responses, filtered_recipes)
+    return _build_paginated_response(current_page, total_pages, total_items, paginated_input_model, recipes)
+
+
+def _paginate_recipes_by_cursor(
+    filtered_recipes: Query, paginated_input_model: PSFRecipesInputModel, count_key: str = None
+) -> PSFRecipesResponseModel:
+    """
+    Create recipes page starting after the cursor, the total count is only made when requested
     :param filtered_recipes:
     :param paginated_input_model:
+    :param count_key:
     :return:
     """
-    current_page = paginated_input_model.page
-    page_size = paginated_input_model.page_size
 
-    total_items = filtered_recipes.count()
-    total_pages = math.ceil(total_items / page_size)
+    total_items = _count_recipes(filtered_recipes, paginated_input_model, count_key)
 
-    current_page = total_pages if current_page > total_pages else current_page
+    sort_keys = paginated_input_model.sort_keys
+    if paginated_input_model.cursor_values:
+        filtered_recipes = filtered_recipes.filter(
+            get_keyset_expression(sort_keys, paginated_input_model.cursor_values)
+        )
+    # one more recipe than the page size tells if there is a next page
+    rows = filtered_recipes.add_columns(*[key for key, _ in sort_keys]).limit(paginated_input_model.page_size + 1).all()
 
-    if total_items > 0:
-        offset = (current_page - 1) * page_size
+    recipes, next_cursor = _get_cursor_page(rows, paginated_input_model)
+    return _build_cursor_response(next_cursor, total_items, paginated_input_model, build_recipe_responses(recipes))
 
-        filtered_recipes = filtered_recipes.offset(offset).limit(page_size)
 
-    sort = f'&sort={paginated_input_model.sort}' if paginated_input_model.sort else ''
-    filters = f'&filters={paginated_input_model.filters}' if paginated_input_model.filters else ''
+async def _paginate_recipes_by_cursor_async(
+    statement: Select, paginated_input_model: PSFRecipesInputModel, session: AsyncSession, count_key: str = None
+) -> PSFRecipesResponseModel:
+    """
+    Async variant of _paginate_recipes_by_cursor
+    :param statement:
+    :param paginated_input_model:
+    :param session:
+    :param count_key:
+    :return:
+    """
+
+    total_items = await _count_recipes_async(statement, paginated_input_model, session, count_key)
+
+    sort_keys = paginated_input_model.sort_keys
+    if paginated_input_model.cursor_values:
+        statement = statement.where(get_keyset_expression(sort_keys, paginated_input_model.cursor_values))
+    statement = statement.add_columns(*[key for key, _ in sort_keys]).limit(paginated_input_model.page_size + 1)
+    rows = (await session.execute(statement)).all()
+
+    recipes, next_cursor = _get_cursor_page(rows, paginated_input_model)
+    recipes = await run_in_threadpool(build_recipe_responses, recipes)
+    return _build_cursor_response(next_cursor, total_items, paginated_input_model, recipes)
+
+
+def _count_recipes(
+    filtered_recipes: Query, paginated_input_model: PSFRecipesInputModel, count_key: str = None
+) -> int | None:
+    """
+    Count the filtered recipes as requested by the count option, exact counts are cached under the count key
+    :param filtered_recipes:
+    :param paginated_input_model:
+    :param count_key:
+    :return:
+    """
+
+    count = _get_count_option(paginated_input_model)
+    if count is None:
+        return None
+
+    session = filtered_recipes.session
+    if count == CountOptions.ESTIMATE and session.get_bind().dialect.name == 'postgresql':
+        return _get_estimated_rows(session.execute(db.explain.Explain(filtered_recipes.order_by(None).statement)))
+
+    total_items = RECIPES_COUNT_CACHE.get(count_key) if count_key else None
+    if total_items is None:
+        generation = RECIPES_COUNT_CACHE.generation
+        total_items = filtered_recipes.count()
+        if count_key:
+            RECIPES_COUNT_CACHE.set_many({count_key: total_items}, generation)
+    return total_items
+
+
+async def _count_recipes_async(
+    statement: Select, paginated_input_model: PSFRecipesInputModel, session: AsyncSession, count_key: str = None
+) -> int | None:
+    """
+    Async variant of _count_recipes
+    :param statement:
+    :param paginated_input_model:
+    :param session:
+    :param count_key:
+    :return:
+    """
+
+    count = _get_count_option(paginated_input_model)
+    if count is None:
+        return None
+
+    statement = statement.order_by(None)
+    if count == CountOptions.ESTIMATE and session.bind.dialect.name == 'postgresql':
+        return _get_estimated_rows(await session.execute(db.explain.Explain(statement)))
+
+    total_items = RECIPES_COUNT_CACHE.get(count_key) if count_key else None
+    if total_items is None:
+        generation = RECIPES_COUNT_CACHE.generation
+        total_items = await session.scalar(select(func.count()).select_from(statement.subquery()))
+        if count_key:
+            RECIPES_COUNT_CACHE.set_many({count_key: total_items}, generation)
+    return total_items
+
+
+def _get_count_option(paginated_input_model: PSFRecipesInputModel) -> CountOptions | None:
+    # offset pagination needs the total count to know the last page, cursor pagination counts only when asked
+    if paginated_input_model.count is None and paginated_input_model.cursor is None:
+        return CountOptions.EXACT
+    return paginated_input_model.count
+
+
+def _get_estimated_rows(explain_result) -> int:
+    plan = explain_result.scalar()
+    # asyncpg does not decode json
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
+def get_count_key(paginated_input_model: PSFRecipesInputModel, visibility_expression: list) -> str:
+    """
+    Create the key of the cached total count from the normalized filters and the visibility predicate of the user
+    :param paginated_input_model:
+    :param visibility_expression:
+    :return:
+    """
+
+    filters = ','.join(sorted(paginated_input_model.filters.split(','))) if paginated_input_model.filters else ''
+    visibility = ' AND '.join(
+        str(expression.compile(compile_kwargs={'literal_binds': True})) for expression in visibility_expression
+    )
+    return f'{filters}|{visibility}'
+
+
+def invalidate_recipes_count(session: sqlalchemy.orm.Session = None) -> None:
+    """
+    Drop the cached total counts in all workers, when a session is given the counts are dropped after it commits
+    :param session:
+    :return:
+    """
+
+    if session is None:
+        RECIPES_COUNT_CACHE.invalidate()
+        return
+    sqlalchemy.event.listen(session, 'after_commit', lambda _: RECIPES_COUNT_CACHE.invalidate(), once=True)
+
+
+def _get_cursor_page(rows: Sequence, paginated_input_model: PSFRecipesInputModel) -> tuple[list[Recipe], str | None]:
+    """
+    Split the (recipe, *sort key values) rows into the recipes of the page and the cursor of the next page
+    :param rows:
+    :param paginated_input_model:
+    :return:
+    """
+
+    page_rows = rows[: paginated_input_model.page_size]
+    next_cursor = None
+    if len(rows) > paginated_input_model.page_size:
+        next_cursor = encode_cursor(tuple(page_rows[-1])[1:], paginated_input_model)
+    return [row[0] for row in page_rows], next_cursor
+
+
+def build_recipe_responses(recipes: list[Recipe]) -> list[RecipeResponse]:
+    """
+    Build recipe responses, resolving the creators and pictures of all recipes with one lookup per service
+    :param recipes:
+    :return:
+    """
+
+    context = {
+        'usernames': get_usernames(r.created_by for r in recipes),
+        'image_urls': get_image_urls(r.picture for r in recipes),
+    }
+    return [RecipeResponse.model_validate(r.to_dict(), context=context) for r in recipes]
+
+
+def _get_current_page(total_items: int, paginated_input_model: PSFRecipesInputModel) -> tuple[int, int]:
+    """
+    Get the current page, limited by the total pages, and the total pages
+    :param total_items:
+    :param paginated_input_model:
+    :return:
+    """
+
+    total_pages = math.ceil(total_items / paginated_input_model.page_size)
+    current_page = paginated_input_model.page
+    # estimated counts may be lower than the real ones, the requested page is kept
+    if paginated_input_model.count != CountOptions.ESTIMATE:
+        current_page = total_pages if current_page > total_pages else current_page
+    return current_page, total_pages
+
+
+def _build_paginated_response(
+    current_page: int,
+    total_pages: int,
+    total_items: int,
+    paginated_input_model: PSFRecipesInputModel,
+    recipes: list[RecipeResponse],
+) -> PSFRecipesResponseModel:
+    """
+    Build the paginated response with the links to the neighbour pages
+    :param current_page:
+    :param total_pages:
+    :param total_items:
+    :param paginated_input_model:
+    :param recipes:
+    :return:
+    """
+
+    page_size = paginated_input_model.page_size
+    query_string = _get_query_string(paginated_input_model)
     previous_page = (
-        f"recipes/?page={current_page - 1}&page_size={page_size}{sort}{filters}" if current_page - 1 > 0 else None
+        f"recipes/?page={current_page - 1}&page_size={page_size}{query_string}" if current_page - 1 > 0 else None
     )
     next_page = (
-        f"recipes/?page={current_page + 1}&page_size={page_size}{sort}{filters}" if current_page < total_pages else None
+        f"recipes/?page={current_page + 1}&page_size={page_size}{query_string}" if current_page < total_pages else None
     )
 
     response = PSFRecipesResponseModel(
@@ -46,11 +329,49 @@ def paginate_recipes(filtered_recipes: Query, paginated_input_model: PSFRecipesI
         next_page=next_page,
         total_pages=total_pages,
         total_items=total_items,
-        recipes=[RecipeResponse(**r.to_dict()) for r in filtered_recipes],
+        recipes=recipes,
     )
     return response
 
 
+def _build_cursor_response(
+    next_cursor: str | None,
+    total_items: int | None,
+    paginated_input_model: PSFRecipesInputModel,
+    recipes: list[RecipeResponse],
+) -> PSFRecipesResponseModel:
+    """
+    Build the cursor paginated response, cursor pages are only followed forward
+    :param next_cursor:
+    :param total_items:
+    :param paginated_input_model:
+    :param recipes:
+    :return:
+    """
+
+    page_size = paginated_input_model.page_size
+    query_string = _get_query_string(paginated_input_model)
+    next_page = f"recipes/?cursor={next_cursor}&page_size={page_size}{query_string}" if next_cursor else None
+
+    return PSFRecipesResponseModel(
+        page_number=None,
+        page_size=page_size,
+        previous_page=None,
+        next_page=next_page,
+        next_cursor=next_cursor,
+        total_pages=math.ceil(total_items / page_size) if total_items is not None else None,
+        total_items=total_items,
+        recipes=recipes,
+    )
+
+
+def _get_query_string(paginated_input_model: PSFRecipesInputModel) -> str:
+    sort = f'&sort={paginated_input_model.sort}' if paginated_input_model.sort else ''
+    filters = f'&filters={paginated_input_model.filters}' if paginated_input_model.filters else ''
+    count = f'&count={paginated_input_model.count}' if paginated_input_model.count else ''
+    return f'{sort}{filters}{count}'
+
+
 def filter_recipes(filters: str) -> list:
     """
     Create filter expression
@@ -59,15 +380,18 @@ def filter_recipes(filters: str) -> list:
     """
     filter_expression = []
 
+    range_filter_fields = ('complexity', 'calories', 'carbo', 'fats', 'proteins', 'cholesterol')
+
     filter_fields = (
         'category',
         'created_by',
         'period',
         'ingredient',
         'search',
-        'ingredient',
         'published',
-        'deleted'
+        'deleted',
+        'time_to_prepare',
+        *range_filter_fields,
     )
 
     # different filters are separated with commas ","
@@ -87,10 +411,13 @@ def filter_recipes(filters: str) -> list:
             raise ValueError(f"Invalid conditions for {filter_name}")
 
         # &filters=complexity:1-5 / from(number)-to(number) separated with "-" / using range to avoid lt, gt ...
-        if filter_name == 'complexity':
+        # the stored nutrition columns are filtered the same way, e.g. &filters=calories:0-500
+        if filter_name in range_filter_fields:
             conditions = conditions.split('-')
             try:
-                filter_expression.append(Recipe.complexity.between(float(conditions[0]), float(conditions[1])))
+                filter_expression.append(
+                    getattr(Recipe, filter_name).between(float(conditions[0]), float(conditions[1]))
+                )
             except (ValueError, IndexError):
                 raise ValueError(f"Invalid range for {filter_name}.")
 
@@ -147,41 +474,20 @@ def filter_recipes(filters: str) -> list:
             else:
                 raise ValueError("Invalid conditions for ingredient")
 
-            if filter_type == 'any':
-                with db.connection.get_session() as session:
-                    subquery = (
-                        session.query(RecipeIngredient.recipe_id)
-                        .filter(RecipeIngredient.ingredient_id.in_(ids))
-                        .group_by(RecipeIngredient.recipe_id)
-                    )
-            else:
-                with db.connection.get_session() as session:
-                    subquery = (
-                        session.query(RecipeIngredient.recipe_id)
-                        .filter(RecipeIngredient.ingredient_id.in_(ids))
-                        .group_by(RecipeIngredient.recipe_id)
-                        .having(func.count(distinct(RecipeIngredient.ingredient_id)) == len(ids))
-                    )
+            subquery = (
+                select(RecipeIngredient.recipe_id)
+                .where(RecipeIngredient.ingredient_id.in_(ids))
+                .group_by(RecipeIngredient.recipe_id)
+            )
+            if filter_type != 'any':
+                subquery = subquery.having(func.count(distinct(RecipeIngredient.ingredient_id)) == len(ids))
             filter_expression.append(Recipe.id.in_(subquery))
 
-        # &filters=title/summary/any:expression
-        # search by word or expression in recipe name/summary/both
+        # &filters=search:title/summary/any-words / full-text search of the recipe name/summary/both,
+        # all words must match, the last letters of the words may be omitted, e.g. search:any-chick curry
         if filter_name == 'search':
-            conditions = conditions.split('-')
-
-            if len(conditions) > 1 and conditions[0] in ('title', 'summary', 'any'):
-                search_type = conditions.pop(0)
-            else:
-                raise ValueError('Invalid conditions for search')
-
-            if search_type == 'title':
-                filter_expression.append(Recipe.name.ilike(f"%{conditions[0]}%"))
-            elif search_type == 'summary':
-                filter_expression.append(Recipe.summary.ilike(f"%{conditions[0]}%"))
-            elif search_type == 'any':
-                filter_expression.append(
-                    or_(Recipe.name.ilike(f"%{conditions[0]}%"), Recipe.summary.ilike(f"%{conditions[0]}%"))
-                )
+            search_type, terms = _parse_search_conditions(conditions)
+            filter_expression.append(_get_search_expression(search_type, terms))
 
         # &filters=published:true/false
         if filter_name == 'published':
@@ -202,13 +508,27 @@ def filter_recipes(filters: str) -> list:
     return filter_expression
 
 
-def sort_recipes(sort: str) -> list:
+def sort_recipes(sort: str, filters: str = None) -> list:
     """
     Create order expression
     :param sort:
+    :param filters:
     :return:
     """
-    order_expression = []
+
+    return [desc(key) if descending else asc(key) for key, descending in get_sort_keys(sort, filters)]
+
+
+def get_sort_keys(sort: str, filters: str = None) -> list[tuple]:
+    """
+    Create the (expression, descending) pairs of the ordering.
+    The recipe id is always the last key, so the ordering is unique and can be used as a cursor
+    :param sort:
+    :param filters: searched recipes are ordered by relevance when there is no explicit sort
+    :return:
+    """
+    sort_keys = []
+    sorted_by_id = False
 
     sort_fields = (
         'id',
@@ -218,11 +538,21 @@ def sort_recipes(sort: str) -> list:
         'updated_on',
         'category.name',
         'category.id',
+        'time_to_prepare',
+        'complexity',
+        'calories',
+        'carbo',
+        'fats',
+        'proteins',
+        'cholesterol',
     )
 
     # default sorting
     if not sort:
-        return [desc(Recipe.created_on)]
+        search_rank = get_search_rank(filters) if filters else None
+        if search_rank is not None:
+            return [(search_rank, True), (Recipe.id, True)]
+        return [(Recipe.created_on, True), (Recipe.id, True)]
 
     # different sorters are separated with commas ",", directions are separated with ":"
     # example &sort=complexity:asc,created_on:desc,category.name:desc
@@ -237,16 +567,217 @@ def sort_recipes(sort: str) -> list:
         if direction and direction not in ['asc', 'desc']:
             raise ValueError(f"Invalid sorting direction: {direction}.")
 
+        sorted_by_id = sorted_by_id or column == 'id'
         sort_column = getattr(Recipe, column, None)
 
         if not sort_column:
             sort_column = getattr(RecipeCategory, column.split('.')[1], None)
 
         if sort_column in [Recipe.name, RecipeCategory.name]:
-            ordering = desc(func.lower(sort_column)) if direction == 'desc' else asc(func.lower(sort_column))
-        else:
-            ordering = desc(sort_column) if direction == 'desc' else asc(sort_column)
+            sort_column = func.lower(sort_column, type_=String)
+
+        # the category is outer joined, recipes without category are ordered first in every database
+        if column.startswith('category.'):
+            sort_column = func.coalesce(sort_column, '' if column == 'category.name' else 0)
+
+        sort_keys.append((sort_column, direction == 'desc'))
+
+    if not sorted_by_id:
+        sort_keys.append((Recipe.id, sort_keys[-1][1]))
+
+    return sort_keys
+
+
+def get_search_rank(filters: str):
+    """
+    Create the relevance of the recipes to the search filter, higher is better
+    :param filters:
+    :return:
+    """
+
+    for data in filters.split(','):
+        filter_name, _, conditions = data.partition(':')
+        if filter_name == 'search':
+            search_type, terms = _parse_search_conditions(conditions)
+            if config.database == configuration.DbTypeOptions.POSTGRES:
+                rank = func.ts_rank(SEARCH_VECTOR, _get_postgres_search_query(search_type, terms), type_=Float)
+            else:
+                # bm25 is lower for better matches
+                rank = -(
+                    select(func.bm25(literal_column('"RECIPES_SEARCH"'), type_=Float))
+                    .where(SEARCH_TABLE.c.rowid == Recipe.id, _get_sqlite_search_match(search_type, terms))
+                    .correlate(Recipe)
+                    .scalar_subquery()
+                )
+            return rank.label('search_rank')
+    return None
+
 
-        order_expression.append(ordering)
+def _parse_search_conditions(conditions: str) -> tuple[str, list[str]]:
+    search_type, _, text = conditions.partition('-')
+    terms = re.findall(r'\w+', text.lower())
+    if search_type not in ('title', 'summary', 'any') or not terms:
+        raise ValueError('Invalid conditions for search')
+    return search_type, terms
+
+
+def _get_search_expression(search_type: str, terms: list[str]):
+    if config.database == configuration.DbTypeOptions.POSTGRES:
+        return SEARCH_VECTOR.op('@@')(_get_postgres_search_query(search_type, terms))
+    return Recipe.id.in_(select(SEARCH_TABLE.c.rowid).where(_get_sqlite_search_match(search_type, terms)))
+
+
+def _get_postgres_search_query(search_type: str, terms: list[str]):
+    # the name is weighted A and the summary B in the search vector
+    weight = {'title': 'A', 'summary': 'B', 'any': ''}[search_type]
+    return func.to_tsquery('english', ' & '.join(f'{term}:*{weight}' for term in terms))
+
+
+def _get_sqlite_search_match(search_type: str, terms: list[str]):
+    column_filter = {'title': 'name : ', 'summary': 'summary : ', 'any': ''}[search_type]
+    return literal_column('"RECIPES_SEARCH"').op('MATCH')(' AND '.join(f'{column_filter}"{term}"*' for term in terms))
+
+
+def get_keyset_expression(sort_keys: list[tuple], values: list):
+    """
+    Create the expression selecting the recipes ordered after the given sort key values
+    :param sort_keys:
+    :param values:
+    :return:
+    """
+
+    # (a > x) or (a = x and b > y) or ..., the directions of the keys may differ so row values can not be compared
+    conditions = []
+    for index, (key, descending) in enumerate(sort_keys):
+        previous_keys_equal = [previous_key == value for (previous_key, _), value in zip(sort_keys, values[:index])]
+        after = key < values[index] if descending else key > values[index]
+        conditions.append(and_(*previous_keys_equal, after))
+    return or_(*conditions)
+
+
+def encode_cursor(values: Sequence, paginated_input_model: PSFRecipesInputModel) -> str:
+    """
+    Encode the sort key values of the last recipe of a page into an opaque cursor
+    :param values:
+    :param paginated_input_model:
+    :return:
+    """
+
+    payload = {
+        'sort': paginated_input_model.sort,
+        'filters': paginated_input_model.filters,
+        'values': [value.isoformat() if isinstance(value, datetime) else value for value in values],
+    }
+    cursor = base64.urlsafe_b64encode(json.dumps(payload, default=str).encode())
+    return cursor.decode().rstrip('=')
+
+
+def decode_cursor(cursor: str, sort_keys: list[tuple], paginated_input_model: PSFRecipesInputModel) -> list:
+    """
+    Decode the sort key values of a cursor, the cursor is valid only for the sort and filters it was created with
+    :param cursor:
+    :param sort_keys:
+    :param paginated_input_model:
+    :return:
+    """
+
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        values = payload['values']
+        if (
+            payload['sort'] != paginated_input_model.sort
+            or payload['filters'] != paginated_input_model.filters
+            or len(values) != len(sort_keys)
+        ):
+            raise ValueError
+        return [_parse_sort_key_value(key, value) for (key, _), value in zip(sort_keys, values)]
+    except (ValueError, KeyError, TypeError):
+        raise ValueError("Invalid cursor")
+
+
+def _parse_sort_key_value(key, value):
+    python_type = key.type.python_type
+    if python_type is datetime:
+        return datetime.fromisoformat(value)
+    return python_type(value)
+
+
+def get_recipe_summary_values() -> dict:
+    """
+    Create the correlated subqueries computing the stored nutrition, time to prepare and complexity of a recipe
+    :return:
+    """
+
+    nutrients = {
+        'calories': Ingredient.calories,
+        'carbo': Ingredient.carbo,
+        'fats': Ingredient.fats,
+        'proteins': Ingredient.protein,
+        'cholesterol': Ingredient.cholesterol,
+    }
+    values = {
+        column: select(func.coalesce(func.sum(RecipeIngredient.quantity * nutrient), 0))
+        .join(Ingredient, Ingredient.id == RecipeIngredient.ingredient_id)
+        .where(RecipeIngredient.recipe_id == Recipe.id)
+        .scalar_subquery()
+        for column, nutrient in nutrients.items()
+    }
+    values['time_to_prepare'] = (
+        select(func.coalesce(func.sum(RecipeInstruction.time), 0))
+        .where(RecipeInstruction.recipe_id == Recipe.id)
+        .scalar_subquery()
+    )
+    values['complexity'] = (
+        select(func.coalesce(func.round(cast(func.avg(RecipeInstruction.complexity), Numeric(10, 2)), 1), 0))
+        .where(RecipeInstruction.recipe_id == Recipe.id)
+        .scalar_subquery()
+    )
+    return values
+
+
+def _export_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, decimal.Decimal):
+        return float(value)
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+def stream_ndjson(rows: Iterable[dict]) -> Iterator[str]:
+    """
+    Serialize the rows as JSON lines, joined in chunks of about EXPORT_CHUNK_SIZE characters
+    :param rows:
+    :return:
+    """
+
+    lines, size = [], 0
+    for row in rows:
+        line = json.dumps(row, default=_export_default) + '\n'
+        lines.append(line)
+        size += len(line)
+        if size >= EXPORT_CHUNK_SIZE:
+            yield ''.join(lines)
+            lines, size = [], 0
+    if lines:
+        yield ''.join(lines)
+
+
+def stream_csv(rows: Iterable[dict], fields: Sequence[str]) -> Iterator[str]:
+    """
+    Serialize the rows as CSV with a header, list values are written as JSON arrays.
+    The rows are written in chunks of about EXPORT_CHUNK_SIZE characters
+    :param rows:
+    :param fields:
+    :return:
+    """
 
-    return order_expression
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fields)
+    writer.writeheader()
+    for row in rows:
+        writer.writerow({key: json.dumps(value) if isinstance(value, list) else value for key, value in row.items()})
+        if buffer.tell() >= EXPORT_CHUNK_SIZE:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
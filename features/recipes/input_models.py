@@ -1,9 +1,11 @@
 """Recipe feature input model"""
+from enum import auto
 from typing import Optional, Union, Any
 
 import fastapi
 import pydantic
 
+import configuration
 import features.recipes.helpers
 from features.recipes import constants
 
@@ -121,6 +123,21 @@ class PatchInstructionInputModel(pydantic.BaseModel):
         return self
 
 
+class CountOptions(configuration.CaseInsensitiveEnum):
+    """Total count options of the paginated recipes"""
+
+    EXACT = auto()
+    # planner statistics on postgres, exact count on other databases
+    ESTIMATE = auto()
+
+
+class ExportFormats(configuration.CaseInsensitiveEnum):
+    """Recipes export formats"""
+
+    NDJSON = auto()
+    CSV = auto()
+
+
 class PSFRecipesInputModel(pydantic.BaseModel):
     """Paginate, sort, filter Recipes"""
 
@@ -128,15 +145,28 @@ class PSFRecipesInputModel(pydantic.BaseModel):
     page_size: int = pydantic.Field(default=10, gt=0)
     sort: Optional[str] = None
     filters: Optional[str] = None
+    # cursor pagination is used when the cursor is given, an empty cursor starts from the first recipe
+    cursor: Optional[str] = None
+    # offset pagination always counts the recipes, cursor pagination only when requested
+    count: Optional[CountOptions] = None
     order_expression: Optional[list] = None
     filter_expression: Optional[list] = None
+    sort_keys: Optional[list] = None
+    cursor_values: Optional[list] = None
 
     def model_post_init(self, __context: Any) -> None:
         try:
-            self.order_expression = features.recipes.helpers.sort_recipes(self.sort) or []
+            self.sort_keys = features.recipes.helpers.get_sort_keys(self.sort, self.filters)
+            self.order_expression = features.recipes.helpers.sort_recipes(self.sort, self.filters) or []
         except ValueError as ve:
             raise fastapi.HTTPException(status_code=422, detail=str(ve))
 
+        if self.cursor:
+            try:
+                self.cursor_values = features.recipes.helpers.decode_cursor(self.cursor, self.sort_keys, self)
+            except ValueError as ve:
+                raise fastapi.HTTPException(status_code=422, detail=str(ve))
+
         if self.filters:
             try:
                 self.filter_expression = features.recipes.helpers.filter_recipes(self.filters) or []
@@ -171,6 +201,23 @@ class IngredientInput(pydantic.BaseModel):
     #     return value
 
 
+class ImportRecipeIngredientInputModel(IngredientInput):
+    """Ingredient of an imported recipe, created from the nutrition values when it does not exist"""
+
+    quantity: float = pydantic.Field(gt=0)
+
+
+class ImportRecipeInputModel(pydantic.BaseModel):
+    """Imported recipe, one per line of the imported NDJSON file"""
+
+    name: str = pydantic.Field(max_length=255)
+    serves: Optional[int] = pydantic.Field(gt=0, default=1)
+    summary: Optional[str] = pydantic.Field(max_length=1000, default=None)
+    category: Optional[str] = pydantic.Field(min_length=3, max_length=50, default=None)
+    instructions: list[CreateInstructionInputModel] = []
+    ingredients: list[ImportRecipeIngredientInputModel] = []
+
+
 class UpdateIngredientInputModel(pydantic.BaseModel):
     """Update Ingredient Input Model"""
 
@@ -238,7 +285,6 @@ class PatchRecipeInputModel(pydantic.BaseModel):
             "NAME",
             'PICTURE',
             'SUMMARY',
-            'TIME_TO_PREPARE',
             'CATEGORY_ID',
             'IS_PUBLISHED',
         ]
@@ -289,7 +335,6 @@ class PatchRecipeInputModel(pydantic.BaseModel):
             'NAME': [_validate_name],
             'PICTURE': [_validate_positive_integer],
             'SUMMARY': [_validate_summary],
-            'TIME_TO_PREPARE': [_validate_positive_integer],
             'CATEGORY_ID': [_validate_positive_integer],
             'IS_PUBLISHED': [validate_is_published],
         }
@@ -314,6 +359,6 @@ class PatchRecipeInputModel(pydantic.BaseModel):
                 return eval(value.capitalize())
             return False
 
-        parsers = {'PICTURE': int, 'TIME_TO_PREPARE': int, 'CATEGORY_ID': int, 'IS_PUBLISHED': _parse_bool}
+        parsers = {'PICTURE': int, 'CATEGORY_ID': int, 'IS_PUBLISHED': _parse_bool}
 
         self.value = parsers.get(self.field.upper(), lambda x: x)(self.value)
@@ -1,10 +1,11 @@
 from features import DbBaseModel
 from sqlalchemy.orm import Mapped, mapped_column, relationship
-from sqlalchemy.ext.hybrid import hybrid_property
-from sqlalchemy import String, Integer, Float, func, ForeignKey, DateTime, Boolean, Numeric
+from sqlalchemy import String, Integer, Float, func, ForeignKey, DateTime, Boolean, Numeric, DDL, event, Index, and_
 import datetime
 from typing import Optional
 
+from db.indexes import partial_index
+
 
 class RecipeCategory(DbBaseModel):
     """Recipe category"""
@@ -19,11 +20,14 @@ class RecipeCategory(DbBaseModel):
     updated_on: Mapped[datetime.datetime] = mapped_column(
         DateTime, server_default=func.current_timestamp(), onupdate=func.current_timestamp(), init=False
     )
-    recipes: Mapped[list["Recipe"]] = relationship("Recipe", back_populates="category", init=False, lazy="selectin")
+    recipes: Mapped[list["Recipe"]] = relationship("Recipe", back_populates="category", init=False, lazy="raise")
 
 
 class Recipe(DbBaseModel):
-    """Recipe DB Model"""
+    """
+    Recipe DB Model.
+    The relationships are never loaded implicitly, the queries request what they need with loader options
+    """
 
     __tablename__ = "RECIPES"
 
@@ -36,14 +40,14 @@ class Recipe(DbBaseModel):
         DateTime, server_default=func.current_timestamp(), onupdate=func.current_timestamp(), init=False
     )
     category: Mapped[RecipeCategory] = relationship(
-        "RecipeCategory", back_populates="recipes", default=None, lazy="selectin"
+        "RecipeCategory", back_populates="recipes", default=None, lazy="raise"
     )
     category_id: Mapped[int] = mapped_column(ForeignKey("RECIPE_CATEGORIES.id"), nullable=True, default=None)
     picture: Mapped[int] = mapped_column(ForeignKey("IMAGES.id"), default=None, nullable=True)
     summary: Mapped[Optional[str]] = mapped_column(String(1000), nullable=True, default=None)
     serves: Mapped[int] = mapped_column(Integer, default=1, server_default='1')
     instructions: Mapped[list["RecipeInstruction"]] = relationship(
-        "RecipeInstruction", back_populates="recipe", init=False, lazy='selectin'
+        "RecipeInstruction", back_populates="recipe", init=False, lazy='raise'
     )
     is_published: Mapped[bool] = mapped_column(Boolean, default=False)
     published_on: Mapped[datetime.datetime] = mapped_column(DateTime, nullable=True, default=None)
@@ -53,58 +57,22 @@ class Recipe(DbBaseModel):
     deleted_by: Mapped[Optional[int]] = mapped_column(ForeignKey("Users.id"), nullable=True, default=None)
     ingredients = relationship(
         "RecipeIngredient",
-        lazy="selectin",
+        lazy="raise",
         primaryjoin="Recipe.id == RecipeIngredient.recipe_id",
     )
 
-    @hybrid_property
-    def calories(self) -> float:
-        calories = 0
-        for ingredient_mapping in self.ingredients:
-            calories += ingredient_mapping.quantity * ingredient_mapping.ingredient.calories
-        return calories
-
-    @hybrid_property
-    def carbo(self) -> float:
-        carbo = 0
-        for ingredient_mapping in self.ingredients:
-            carbo += ingredient_mapping.quantity * ingredient_mapping.ingredient.carbo
-        return carbo
-
-    @hybrid_property
-    def fats(self) -> float:
-        fats = 0
-        for ingredient_mapping in self.ingredients:
-            fats += ingredient_mapping.quantity * ingredient_mapping.ingredient.fats
-        return fats
-
-    @hybrid_property
-    def proteins(self) -> float:
-        protein = 0
-        for ingredient_mapping in self.ingredients:
-            protein += ingredient_mapping.quantity * ingredient_mapping.ingredient.protein
-        return protein
-
-    @hybrid_property
-    def cholesterol(self) -> float:
-        cholesterol = 0
-        for ingredient_mapping in self.ingredients:
-            cholesterol += ingredient_mapping.quantity * ingredient_mapping.ingredient.cholesterol
-        return cholesterol
-
-    @hybrid_property
-    def complexity(self) -> float:
-        if not self.instructions:
-            return 0
-        return round(sum(_.complexity for _ in self.instructions) / len(self.instructions), 1)
-
-    @hybrid_property
-    def time_to_prepare(self) -> int:
-        return sum(_.time for _ in self.instructions)
+    # denormalized from the ingredients and instructions, kept in sync by the operations which change them
+    calories: Mapped[float] = mapped_column(Numeric(10, 2), default=0, server_default='0', init=False)
+    carbo: Mapped[float] = mapped_column(Numeric(10, 2), default=0, server_default='0', init=False)
+    fats: Mapped[float] = mapped_column(Numeric(10, 2), default=0, server_default='0', init=False)
+    proteins: Mapped[float] = mapped_column(Numeric(10, 2), default=0, server_default='0', init=False)
+    cholesterol: Mapped[float] = mapped_column(Numeric(10, 2), default=0, server_default='0', init=False)
+    time_to_prepare: Mapped[int] = mapped_column(Integer, default=0, server_default='0', init=False)
+    complexity: Mapped[float] = mapped_column(Float, default=0, server_default='0', init=False)
 
     def to_dict(self):
         """
-        Parse the model to dictionary, including the hybrid_properties as well
+        Parse the model to dictionary, including the expired summary columns as well
         :return:
         """
 
@@ -131,7 +99,7 @@ class RecipeInstruction(DbBaseModel):
     complexity: Mapped[float] = mapped_column(Float)
 
     recipe_id: Mapped[int] = mapped_column(ForeignKey('RECIPES.id'), nullable=True, init=False)
-    recipe: Mapped[Recipe] = relationship('Recipe', back_populates='instructions', init=False, lazy='selectin')
+    recipe: Mapped[Recipe] = relationship('Recipe', back_populates='instructions', init=False, lazy='raise')
     updated_by: Mapped[Optional[int]] = mapped_column(ForeignKey("Users.id"), nullable=True, init=False)
     updated_on: Mapped[datetime.datetime] = mapped_column(
         DateTime, server_default=func.current_timestamp(), onupdate=func.current_timestamp(), init=False
@@ -168,12 +136,79 @@ class RecipeIngredient(DbBaseModel):
     """RecipeIngredient DB model"""
 
     __tablename__ = 'RECIPE_INGREDIENTS_MAPPING'
+    # the primary key leads with the recipe, the recipes having an ingredient are looked up by this index
+    __table_args__ = (Index('ix_recipe_ingredients_mapping_ingredient_id', 'ingredient_id', 'recipe_id'),)
 
     recipe_id: Mapped[int] = mapped_column(Integer, ForeignKey('RECIPES.id'), primary_key=True)
     ingredient_id: Mapped[int] = mapped_column(Integer, ForeignKey('INGREDIENTS.id'), primary_key=True)
     ingredient = relationship(
         "Ingredient",
-        lazy="selectin",
+        lazy="raise",
         primaryjoin="RecipeIngredient.ingredient_id == Ingredient.id",
     )
     quantity: Mapped[float] = mapped_column(Numeric(8, 2), nullable=False)
+
+
+# full-text search of the recipe names and summaries, the index is maintained by the database on every write.
+# postgres keeps a generated tsvector column with a GIN index, names weigh more than summaries
+POSTGRES_SEARCH_DDL = (
+    'ALTER TABLE "RECIPES" ADD COLUMN search_vector tsvector GENERATED ALWAYS AS ('
+    "setweight(to_tsvector('english', coalesce(name, '')), 'A') || "
+    "setweight(to_tsvector('english', coalesce(summary, '')), 'B')) STORED",
+    'CREATE INDEX ix_recipes_search_vector ON "RECIPES" USING gin (search_vector)',
+)
+# sqlite keeps an external content FTS5 table synchronized with triggers
+SQLITE_SEARCH_DDL = (
+    'CREATE VIRTUAL TABLE "RECIPES_SEARCH" USING fts5('
+    "name, summary, content='RECIPES', content_rowid='id', tokenize='porter unicode61')",
+    'CREATE TRIGGER recipes_search_insert AFTER INSERT ON "RECIPES" BEGIN '
+    'INSERT INTO "RECIPES_SEARCH"(rowid, name, summary) VALUES (new.id, new.name, new.summary); END',
+    'CREATE TRIGGER recipes_search_delete AFTER DELETE ON "RECIPES" BEGIN '
+    'INSERT INTO "RECIPES_SEARCH"("RECIPES_SEARCH", rowid, name, summary) '
+    "VALUES ('delete', old.id, old.name, old.summary); END",
+    'CREATE TRIGGER recipes_search_update AFTER UPDATE OF name, summary ON "RECIPES" BEGIN '
+    'INSERT INTO "RECIPES_SEARCH"("RECIPES_SEARCH", rowid, name, summary) '
+    "VALUES ('delete', old.id, old.name, old.summary); "
+    'INSERT INTO "RECIPES_SEARCH"(rowid, name, summary) VALUES (new.id, new.name, new.summary); END',
+)
+
+# trigram index of the ingredient names for fuzzy matching and autocomplete, sqlite matches in memory
+POSTGRES_INGREDIENT_TRIGRAM_DDL = (
+    'CREATE EXTENSION IF NOT EXISTS pg_trgm',
+    'CREATE INDEX ix_ingredients_name_trgm ON "INGREDIENTS" USING gin (name gin_trgm_ops)',
+)
+
+# the objects created by the DDL are not in the metadata, autogenerate must not drop them.
+# the sqlite fts5 shadow tables share the prefix of the search table
+DDL_MANAGED_TABLE_PREFIXES = ('RECIPES_SEARCH',)
+DDL_MANAGED_COLUMNS = (('RECIPES', 'search_vector'),)
+DDL_MANAGED_INDEXES = ('ix_recipes_search_vector', 'ix_ingredients_name_trgm')
+
+for _statement in POSTGRES_SEARCH_DDL:
+    event.listen(Recipe.__table__, 'after_create', DDL(_statement).execute_if(dialect='postgresql'))
+for _statement in SQLITE_SEARCH_DDL:
+    event.listen(Recipe.__table__, 'after_create', DDL(_statement).execute_if(dialect='sqlite'))
+for _statement in POSTGRES_INGREDIENT_TRIGRAM_DDL:
+    event.listen(Ingredient.__table__, 'after_create', DDL(_statement).execute_if(dialect='postgresql'))
+
+# indexes of the listing visibility filters, the ordering of the default sort and the celery scans.
+# sqlite does not use partial indexes for the branches of OR, the scans of the missing values are partial on postgres only
+partial_index(
+    'ix_recipes_published_created_on',
+    Recipe.created_on,
+    Recipe.id,
+    where=and_(Recipe.is_deleted.is_(False), Recipe.is_published.is_(True)),
+)
+partial_index(
+    'ix_recipes_created_by_created_on', Recipe.created_by, Recipe.created_on, where=Recipe.is_deleted.is_(False)
+)
+Index('ix_recipes_category_id', Recipe.category_id)
+Index('ix_recipes_updated_on', Recipe.updated_on)
+Index('ix_recipes_summary_missing', Recipe.summary, postgresql_where=Recipe.summary.is_(None))
+Index('ix_recipe_instructions_recipe_id', RecipeInstruction.recipe_id)
+Index('ix_recipe_instructions_updated_on', RecipeInstruction.updated_on)
+Index(
+    'ix_recipe_instructions_audio_file_missing',
+    RecipeInstruction.audio_file,
+    postgresql_where=RecipeInstruction.audio_file.is_(None),
+)
@@ -1,11 +1,22 @@
 """Recipes feature business logic"""
+import threading
+import time
 from datetime import datetime
-from typing import Type, Optional
+from collections import defaultdict
+from typing import Type, Optional, Iterable, Iterator, Callable
 
+import pydantic
+import sqlalchemy.event
 import sqlalchemy.exc
-from sqlalchemy import update, and_, or_
+import sqlalchemy.orm
+from sqlalchemy import update, and_, or_, select, insert, delete, Select, func, literal
+from sqlalchemy.orm import contains_eager, joinedload, selectinload
+from sqlalchemy.ext.asyncio import AsyncSession
 
 import common.authentication
+import common.cache
+import common.postings
+import common.trigrams
 import db.connection
 from .exceptions import (
     CategoryNotFoundException,
@@ -18,9 +29,16 @@ from .exceptions import (
     RecipeIngredientDoesNotExistException,
     IngredientAlreadyInRecipe,
 )
-from .helpers import paginate_recipes
+from .helpers import (
+    paginate_recipes,
+    paginate_recipes_async,
+    get_recipe_summary_values,
+    get_count_key,
+    invalidate_recipes_count,
+)
 from .input_models import (
     CreateInstructionInputModel,
+    ImportRecipeInputModel,
     PSFRecipesInputModel,
     IngredientInput,
     RecipeInputModel,
@@ -44,71 +62,209 @@ CONFIG = configuration.Config()
 
 logging = khLogging.Logger.get_child_logger(__file__)
 
+NUTRIENT_FIELDS = ('calories', 'carbo', 'fats', 'protein', 'cholesterol')
+RECIPE_EXPORT_FIELDS = (
+    'id',
+    'name',
+    'summary',
+    'serves',
+    'category',
+    'ingredients',
+    'calories',
+    'carbo',
+    'fats',
+    'proteins',
+    'cholesterol',
+    'time_to_prepare',
+    'complexity',
+    'created_by',
+    'created_on',
+    'updated_on',
+    'published_on',
+)
+INSTRUCTION_SUMMARY_FIELDS = ('time', 'complexity')
+
+# loader options of the recipe graph, the relationships raise when they were not loaded by the query
+# list and detail queries outer join the category for filtering, so it is populated from the join
+RECIPE_LIST_OPTIONS = (
+    contains_eager(Recipe.category),
+    selectinload(Recipe.instructions),
+    selectinload(Recipe.ingredients).joinedload(RecipeIngredient.ingredient),
+)
+RECIPE_DETAIL_OPTIONS = (
+    contains_eager(Recipe.category),
+    joinedload(Recipe.instructions),
+    selectinload(Recipe.ingredients).joinedload(RecipeIngredient.ingredient),
+)
+RECIPE_TASK_OPTIONS = (
+    joinedload(Recipe.category),
+    selectinload(Recipe.instructions),
+    selectinload(Recipe.ingredients).joinedload(RecipeIngredient.ingredient),
+)
+
+# categories and ingredients change rarely, they are cached in every worker and invalidated in all of them on change
+CATEGORIES_CACHE = common.cache.SharedTTLCache(
+    'categories', CONFIG.reference_cache.max_size, CONFIG.reference_cache.ttl, CONFIG.reference_cache.check_interval
+)
+INGREDIENTS_CACHE = common.cache.SharedTTLCache(
+    'ingredients', CONFIG.reference_cache.max_size, CONFIG.reference_cache.ttl, CONFIG.reference_cache.check_interval
+)
+
+# trigram index of the ingredient names when the database has no pg_trgm, it is loaded again when
+# the ingredients are changed by another worker
+INGREDIENT_NAME_INDEX = common.trigrams.TrigramIndex()
+_INGREDIENT_NAME_INDEX_GENERATION: Optional[int] = None
+_INGREDIENT_NAME_INDEX_LOCK = threading.Lock()
 
-def get_all_recipe_categories() -> list[Type[RecipeCategory]]:
+# ingredient to published recipes index for the pantry ranking, the recipes changed, published or deleted by
+# this process are refreshed on the next use and the whole index is rebuilt periodically to pick up the changes
+# of the other workers
+RECIPE_INGREDIENTS_INDEX = common.postings.PostingIndex()
+_RECIPE_INGREDIENTS_INDEX_LOADED_ON: Optional[float] = None
+_STALE_RECIPE_IDS: set[int] = set()
+_RECIPE_INGREDIENTS_INDEX_LOCK = threading.Lock()
+
+
+def _refresh_recipes_summary(recipe_ids: Iterable[int] | Select, session: sqlalchemy.orm.Session, **values) -> None:
     """
-    Get all recipe categories
+    Recompute the stored nutrition, time to prepare and complexity of the touched recipes only.
+    The pending changes are flushed first, committing is left to the caller
+
+    :param recipe_ids:
+    :param session:
+    :param values: other columns of the recipes to set with the same statement
     :return:
     """
-    with db.connection.get_session() as session:
-        return session.query(RecipeCategory).all()
+
+    session.flush()
+    session.execute(
+        update(Recipe)
+        .where(Recipe.id.in_(recipe_ids))
+        .values({**get_recipe_summary_values(), **values})
+        .execution_options(synchronize_session='fetch')
+    )
+    # the counts of the listings filtered by the summary columns change
+    invalidate_recipes_count(session)
+    if not isinstance(recipe_ids, Select):
+        _reindex_recipes(recipe_ids, session)
+
+
+def _reindex_recipes(recipe_ids: Iterable[int], session: sqlalchemy.orm.Session) -> None:
+    """
+    Refresh the recipes in the pantry index on the next use after the session is committed
+
+    :param recipe_ids:
+    :param session:
+    :return:
+    """
+
+    recipe_ids = set(recipe_ids)
+    sqlalchemy.event.listen(session, 'after_commit', lambda _: _STALE_RECIPE_IDS.update(recipe_ids), once=True)
+
+
+def refresh_all_recipes_summary(batch_size: int = 500, session: sqlalchemy.orm.Session = None) -> int:
+    """
+    Backfill the stored nutrition, time to prepare and complexity of all recipes, committing after every batch
+
+    :param batch_size:
+    :param session:
+    :return: number of refreshed recipes
+    """
+
+    refreshed = 0
+    last_id = 0
+    with db.connection.session_scope(session) as session:
+        while True:
+            recipe_ids = session.scalars(
+                select(Recipe.id).where(Recipe.id > last_id).order_by(Recipe.id).limit(batch_size)
+            ).all()
+            if not recipe_ids:
+                break
+            _refresh_recipes_summary(recipe_ids, session)
+            session.commit()
+            refreshed += len(recipe_ids)
+            last_id = recipe_ids[-1]
+            logging.info(f"Refreshed the summary of {refreshed} recipes")
+    return refreshed
+
+
+def get_all_recipe_categories(session: sqlalchemy.orm.Session = None) -> list[Type[RecipeCategory]]:
+    """
+    Get all recipe categories, cached.
+    The cached categories are loaded with a session of their own, so they are never expired by the given one
+    :param session:
+    :return:
+    """
+
+    def _load():
+        with db.connection.session_scope() as own_session:
+            return own_session.query(RecipeCategory).all()
+
+    return list(CATEGORIES_CACHE.get_or_load('all', _load))
 
 
-def get_category_by_id_or_name(*, category_id: int = None, category_name: str = None) -> Type[RecipeCategory]:
+def get_category_by_id_or_name(
+    *, category_id: int = None, category_name: str = None, session: sqlalchemy.orm.Session = None
+) -> Type[RecipeCategory]:
     """
-    Get category by id
+    Get category by id, cached like all categories
 
     :param category_id:
     :param category_name:
+    :param session:
     :return:
     """
 
-    with db.connection.get_session() as session:
-        query = session.query(RecipeCategory)
-        filters = []
+    if category_id:
+        key, condition = ('id', category_id), RecipeCategory.id == category_id
+    elif category_name:
+        key, condition = ('name', category_name), RecipeCategory.name == category_name
+    else:
+        raise CategoryNotFoundException()
 
-        if category_id:
-            filters.append(RecipeCategory.id == category_id)
-        elif category_name:
-            filters.append(RecipeCategory.name == category_name)
+    def _load():
+        with db.connection.session_scope() as own_session:
+            return own_session.query(RecipeCategory).filter(condition).first()
 
-        if filters:
-            category = query.filter(*filters).first()
+    category = CATEGORIES_CACHE.get_or_load(key, _load)
+    if not category:
+        raise CategoryNotFoundException()
+    return category
 
-        if not category:
-            raise CategoryNotFoundException()
-        return category
 
-
-def update_category(category_id: int, field: str, value: str, updated_by: int) -> Type[RecipeCategory]:
+def update_category(
+    category_id: int, field: str, value: str, updated_by: int, session: sqlalchemy.orm.Session = None
+) -> Type[RecipeCategory]:
     """Update category"""
-    category = get_category_by_id_or_name(category_id=category_id)
     try:
-        with db.connection.get_session() as session:
+        with db.connection.session_scope(session) as session:
+            category = get_category_by_id_or_name(category_id=category_id, session=session)
             session.execute(
                 update(RecipeCategory),
                 [{"id": category.id, f"{field}": value, "updated_by": updated_by}],
             )
             session.commit()
-            RecipeCategory.__setattr__(category, field, value)
+            CATEGORIES_CACHE.invalidate()
             logging.info(f"User {updated_by} updated Category (#{category_id}). Set {field} to {value}")
-            return category
+            # the cached category is shared, the updated one is loaded again instead of changing it
+            return get_category_by_id_or_name(category_id=category.id)
     except sqlalchemy.exc.IntegrityError as ex:
         raise CategoryNameViolationException(ex)
 
 
-def create_category(category_name: str, created_by: int) -> RecipeCategory:
+def create_category(category_name: str, created_by: int, session: sqlalchemy.orm.Session = None) -> RecipeCategory:
     """Create category"""
 
     try:
-        category = get_category_by_id_or_name(category_name=category_name)
+        category = get_category_by_id_or_name(category_name=category_name, session=session)
         if category:
             raise CategoryNameViolationException()
     except CategoryNotFoundException:
         category = RecipeCategory(name=category_name, created_by=created_by)
-        with db.connection.get_session() as session:
+        with db.connection.session_scope(session) as session:
             session.add(category)
             session.commit()
+            CATEGORIES_CACHE.invalidate()
             session.refresh(category)
             logging.info(f"User {created_by} created Category (#{category.id}).")
             return category
@@ -126,6 +282,7 @@ def create_recipe(
     serves: int,
     instructions: list[CreateInstructionInputModel],
     ingredients: list[RecipeIngredientInputModel],
+    session: sqlalchemy.orm.Session = None,
 ):
     """
     Create recipe
@@ -138,38 +295,278 @@ def create_recipe(
     :param created_by:
     :param instructions:
     :param ingredients:
+    :param session:
     :return:
     """
 
-    category = None
-    if category_id:
-        category = get_category_by_id_or_name(category_id=category_id)
-
-    recipe = Recipe(
-        name=name,
-        category=category,
-        picture=picture,
-        summary=summary,
-        serves=serves,
-        created_by=created_by.id,
-    )
-    if instructions:
-        recipe.instructions = [RecipeInstruction(**instruction.model_dump()) for instruction in instructions]
+    with db.connection.session_scope(session) as session:
+        category = None
+        if category_id:
+            # the cached category is shared between the sessions, a copy of it is linked
+            category = session.merge(get_category_by_id_or_name(category_id=category_id, session=session), load=False)
+
+        recipe = Recipe(
+            name=name,
+            category=category,
+            picture=picture,
+            summary=summary,
+            serves=serves,
+            created_by=created_by.id,
+        )
+        if instructions:
+            recipe.instructions = [RecipeInstruction(**instruction.model_dump()) for instruction in instructions]
 
-    with db.connection.get_session() as session:
+        invalidate_recipes_count(session)
         session.add(recipe)
-        session.commit()
-        session.refresh(recipe)
+        session.flush()
 
         if ingredients:
-            add_ingredients_to_recipe(ingredients, recipe.id, created_by)
+            _attach_ingredients(recipe, ingredients, created_by, session)
+        elif instructions:
+            _refresh_recipes_summary([recipe.id], session)
+        session.commit()
 
-        session.refresh(recipe)
+        recipe = _load_recipe_detail(recipe.id, session)
 
     logging.info(f"User {created_by} create Recipe (#{recipe.id}).")
     return recipe
 
 
+def import_recipes(
+    lines: Iterable[bytes | str],
+    created_by: common.authentication.AuthenticatedUser,
+    progress: Callable[[dict], None] = None,
+    session: sqlalchemy.orm.Session = None,
+) -> dict:
+    """
+    Import recipes from NDJSON lines, inserting and committing them in chunks.
+    The categories and ingredients are resolved by their exact names, the missing ones are created
+    and committed with the chunk. Invalid lines are skipped and reported
+
+    :param lines:
+    :param created_by:
+    :param progress: called with the report after every chunk
+    :param session:
+    :return: report with the imported and failed counts and the first errors
+    """
+
+    report = {'imported': 0, 'failed': 0, 'errors': []}
+    chunk_size = CONFIG.recipes_import.chunk_size
+
+    with db.connection.session_scope(session) as session:
+        categories = {
+            name.upper(): category_id
+            for category_id, name in session.execute(select(RecipeCategory.id, RecipeCategory.name))
+        }
+        ingredients = {
+            name.upper(): ingredient_id
+            for ingredient_id, name in session.execute(
+                select(Ingredient.id, Ingredient.name).where(Ingredient.is_deleted == False)
+            )
+        }
+
+        chunk = []
+        created = []
+        for line_number, line in enumerate(lines, start=1):
+            if not line.strip():
+                continue
+            try:
+                recipe = ImportRecipeInputModel.model_validate_json(line)
+                chunk.append(_resolve_imported_recipe(recipe, categories, ingredients, created, created_by, session))
+            except (pydantic.ValidationError, CategoryNameViolationException) as error:
+                report['failed'] += 1
+                if len(report['errors']) < CONFIG.recipes_import.max_errors:
+                    report['errors'].append({'line': line_number, 'error': _get_import_error_text(error)})
+                continue
+
+            if len(chunk) == chunk_size:
+                report['imported'] += _insert_imported_recipes(chunk, created_by, session)
+                _announce_imported_references(created)
+                chunk = []
+                if progress:
+                    progress(report)
+        if chunk:
+            report['imported'] += _insert_imported_recipes(chunk, created_by, session)
+        _announce_imported_references(created)
+
+    logging.info(f"User {created_by.id} imported {report['imported']} recipes, {report['failed']} failed")
+    return report
+
+
+def _get_import_error_text(error: Exception) -> str:
+    if isinstance(error, pydantic.ValidationError):
+        details = error.errors()[0]
+        location = '.'.join(str(_) for _ in details['loc'])
+        return f"{location}: {details['msg']}" if location else details['msg']
+    return f"Category could not be created: {error}"
+
+
+def _resolve_imported_recipe(
+    recipe: ImportRecipeInputModel,
+    categories: dict[str, int],
+    ingredients: dict[str, int],
+    created: list[RecipeCategory | Ingredient],
+    created_by: common.authentication.AuthenticatedUser,
+    session: sqlalchemy.orm.Session,
+) -> tuple[ImportRecipeInputModel, Optional[int], dict[int, float]]:
+    """
+    Resolve the category and the ingredients of the imported recipe by their exact names.
+    The missing ones are added to the session and committed with the chunk, close matches are never reused
+    :param recipe:
+    :param categories: category ids by upper case name, updated with the created categories
+    :param ingredients: ingredient ids by upper case name, updated with the created ingredients
+    :param created: the created categories and ingredients are appended
+    :param created_by:
+    :param session:
+    :return: the recipe, its category id and its ingredient quantities by id
+    """
+
+    category_id = None
+    if recipe.category:
+        category_id = categories.get(recipe.category.upper())
+        if not category_id:
+            category = RecipeCategory(name=recipe.category, created_by=created_by.id)
+            try:
+                with session.begin_nested():
+                    session.add(category)
+            except sqlalchemy.exc.IntegrityError as ex:
+                raise CategoryNameViolationException(ex)
+            created.append(category)
+            category_id = categories[recipe.category.upper()] = category.id
+
+    quantities = {}
+    for ingredient in recipe.ingredients:
+        ingredient_id = ingredients.get(ingredient.name.upper())
+        if not ingredient_id:
+            new_ingredient = Ingredient(
+                name=ingredient.name.lower(),
+                calories=ingredient.calories,
+                carbo=ingredient.carbo,
+                fats=ingredient.fats,
+                protein=ingredient.protein,
+                cholesterol=ingredient.cholesterol,
+                measurement=ingredient.measurement.lower(),
+                category=ingredient.category.lower(),
+                created_by=created_by.id,
+            )
+            session.add(new_ingredient)
+            session.flush([new_ingredient])
+            created.append(new_ingredient)
+            ingredient_id = ingredients[ingredient.name.upper()] = new_ingredient.id
+        quantities[ingredient_id] = quantities.get(ingredient_id, 0) + ingredient.quantity
+    return recipe, category_id, quantities
+
+
+def _announce_imported_references(created: list[RecipeCategory | Ingredient]) -> None:
+    """
+    Invalidate the caches of the categories and ingredients created by a committed import chunk
+    :param created: emptied afterwards
+    :return:
+    """
+
+    if any(isinstance(reference, RecipeCategory) for reference in created):
+        CATEGORIES_CACHE.invalidate()
+    new_ingredients = [(_.id, _.name) for _ in created if isinstance(_, Ingredient)]
+    if new_ingredients:
+        _update_ingredient_name_index(
+            lambda index: [index.add(ingredient_id, name) for ingredient_id, name in new_ingredients]
+        )
+    created.clear()
+
+
+def _insert_imported_recipes(
+    recipes: list[tuple[ImportRecipeInputModel, Optional[int], dict[int, float]]],
+    created_by: common.authentication.AuthenticatedUser,
+    session: sqlalchemy.orm.Session,
+) -> int:
+    """
+    Insert the resolved recipes with their instructions and ingredients, one multi-row statement per table
+    :param recipes:
+    :param created_by:
+    :param session:
+    :return: count of the inserted recipes
+    """
+
+    recipe_ids = list(
+        session.scalars(
+            insert(Recipe).returning(Recipe.id, sort_by_parameter_order=True),
+            [
+                {
+                    'name': recipe.name,
+                    'category_id': category_id,
+                    'summary': recipe.summary,
+                    'serves': recipe.serves,
+                    'created_by': created_by.id,
+                }
+                for recipe, category_id, _ in recipes
+            ],
+        )
+    )
+    instructions = [
+        {**instruction.model_dump(), 'recipe_id': recipe_id}
+        for recipe_id, (recipe, _, _) in zip(recipe_ids, recipes)
+        for instruction in recipe.instructions
+    ]
+    if instructions:
+        session.execute(insert(RecipeInstruction), instructions)
+    recipe_ingredients = [
+        {'recipe_id': recipe_id, 'ingredient_id': ingredient_id, 'quantity': quantity}
+        for recipe_id, (_, _, quantities) in zip(recipe_ids, recipes)
+        for ingredient_id, quantity in quantities.items()
+    ]
+    if recipe_ingredients:
+        session.execute(insert(RecipeIngredient), recipe_ingredients)
+    _refresh_recipes_summary(recipe_ids, session)
+    session.commit()
+    return len(recipe_ids)
+
+
+def export_recipes(
+    user: Optional[common.authentication.AuthenticatedUser],
+    batch_size: int = 1000,
+    session: sqlalchemy.orm.Session = None,
+) -> Iterator[dict]:
+    """
+    Export the recipes visible to the user as flat rows, the ingredients as a list of names.
+    The rows are fetched in batches with a server side cursor where supported, so the memory use does not
+    depend on the count of the recipes. The ingredient names of every batch are fetched with one more query
+
+    :param user:
+    :param batch_size:
+    :param session:
+    :return:
+    """
+
+    columns = {'category': RecipeCategory.name}
+    statement = (
+        select(
+            *(
+                columns.get(field, getattr(Recipe, field)).label(field)
+                for field in RECIPE_EXPORT_FIELDS
+                if field != 'ingredients'
+            )
+        )
+        .join(RecipeCategory, isouter=True)
+        .where(*_get_published_filter_expression(user))
+        .order_by(Recipe.id)
+        .execution_options(yield_per=batch_size)
+    )
+
+    with db.connection.session_scope(session) as session:
+        for rows in session.execute(statement).partitions():
+            ingredients = defaultdict(list)
+            for recipe_id, name in session.execute(
+                select(RecipeIngredient.recipe_id, Ingredient.name)
+                .join(Ingredient, RecipeIngredient.ingredient_id == Ingredient.id)
+                .where(RecipeIngredient.recipe_id.in_([row.id for row in rows]))
+                .order_by(RecipeIngredient.recipe_id, Ingredient.name)
+            ):
+                ingredients[recipe_id].append(name)
+            for row in rows:
+                values = {**row._asdict(), 'ingredients': ingredients.get(row.id, [])}
+                yield {field: values[field] for field in RECIPE_EXPORT_FIELDS}
+
+
 def _get_published_filter_expression(user: Optional[common.authentication.AuthenticatedUser]):
     """
     Get published filters
@@ -190,12 +587,15 @@ def _get_published_filter_expression(user: Optional[common.authentication.Authen
 
 
 def get_all_recipes(
-    paginated_input_model: PSFRecipesInputModel, user: common.authentication.AuthenticatedUser
+    paginated_input_model: PSFRecipesInputModel,
+    user: common.authentication.AuthenticatedUser,
+    session: sqlalchemy.orm.Session = None,
 ) -> PSFRecipesResponseModel:
     """
     Get all recipes paginated, sorted, and filtered
     :param paginated_input_model:
     :param user:
+    :param session:
     :return:
     """
 
@@ -204,7 +604,7 @@ def get_all_recipes(
     published_expression = _get_published_filter_expression(user)
     filter_expression.extend(published_expression)
 
-    with db.connection.get_session() as session:
+    with db.connection.session_scope(session) as session:
         filtered_recipes = (
             session.query(Recipe)
             .join(RecipeCategory, isouter=True)
@@ -212,23 +612,64 @@ def get_all_recipes(
                 *filter_expression,
             )
             .order_by(*order_expression)
+            .options(*RECIPE_LIST_OPTIONS)
         )
 
-        response = paginate_recipes(filtered_recipes, paginated_input_model)
+        count_key = get_count_key(paginated_input_model, published_expression)
+        response = paginate_recipes(filtered_recipes, paginated_input_model, count_key)
         return response
 
 
-def get_recipe_by_id(recipe_id: int, user: common.authentication.AuthenticatedUser = None):
-    """Get recipe by id"""
+async def get_all_recipes_async(
+    paginated_input_model: PSFRecipesInputModel,
+    user: common.authentication.AuthenticatedUser,
+    session: AsyncSession = None,
+) -> PSFRecipesResponseModel:
+    """
+    Get all recipes paginated, sorted, and filtered without blocking the event loop
+    :param paginated_input_model:
+    :param user:
+    :param session:
+    :return:
+    """
+
+    filter_expression = paginated_input_model.filter_expression
+    order_expression = paginated_input_model.order_expression
+    published_expression = _get_published_filter_expression(user)
+    filter_expression.extend(published_expression)
+
+    statement = (
+        select(Recipe)
+        .join(RecipeCategory, isouter=True)
+        .where(
+            *filter_expression,
+        )
+        .order_by(*order_expression)
+        .options(*RECIPE_LIST_OPTIONS)
+    )
+
+    async with db.connection.async_session_scope(session) as session:
+        count_key = get_count_key(paginated_input_model, published_expression)
+        return await paginate_recipes_async(statement, paginated_input_model, session, count_key)
+
+
+def get_recipe_by_id(
+    recipe_id: int,
+    user: common.authentication.AuthenticatedUser = None,
+    session: sqlalchemy.orm.Session = None,
+    options: tuple = (),
+):
+    """Get recipe by id, the relationships are loaded only when requested with the loader options"""
 
     filters = _get_published_filter_expression(user)
 
-    with db.connection.get_session() as session:
+    with db.connection.session_scope(session) as session:
         recipe = (
             session.query(Recipe)
             .join(Recipe.category, isouter=True)
             .where(Recipe.id == recipe_id)
             .filter(and_(*filters))
+            .options(*options)
             .first()
         )
         if not recipe:
@@ -236,18 +677,81 @@ def get_recipe_by_id(recipe_id: int, user: common.authentication.AuthenticatedUs
         return recipe
 
 
-def get_instruction_by_id(instruction_id: int):
+async def get_recipe_by_id_async(
+    recipe_id: int,
+    user: common.authentication.AuthenticatedUser = None,
+    session: AsyncSession = None,
+    options: tuple = (),
+) -> Recipe:
+    """Get recipe by id without blocking the event loop"""
+
+    filters = _get_published_filter_expression(user)
+
+    async with db.connection.async_session_scope(session) as session:
+        recipe = (
+            (
+                await session.scalars(
+                    select(Recipe)
+                    .join(Recipe.category, isouter=True)
+                    .where(Recipe.id == recipe_id)
+                    .filter(and_(*filters))
+                    .options(*options)
+                    .limit(1)
+                )
+            )
+            .unique()
+            .first()
+        )
+        if not recipe:
+            raise RecipeNotFoundException
+        return recipe
+
+
+def _load_recipe_detail(recipe_id: int, session: sqlalchemy.orm.Session) -> Recipe:
+    """
+    Reload the recipe with the graph of the recipe response, replacing the state of the already loaded recipe
+    :param recipe_id:
+    :param session:
+    :return:
+    """
+
+    return (
+        session.query(Recipe)
+        .join(Recipe.category, isouter=True)
+        .where(Recipe.id == recipe_id)
+        .options(*RECIPE_DETAIL_OPTIONS)
+        .populate_existing()
+        .one()
+    )
+
+
+def get_instruction_by_id(instruction_id: int, session: sqlalchemy.orm.Session = None):
     """Get instruction by id"""
 
-    with db.connection.get_session() as session:
+    with db.connection.session_scope(session) as session:
         instruction = session.query(RecipeInstruction).filter(RecipeInstruction.id == instruction_id).first()
         if not instruction:
             raise InstructionNotFoundException
         return instruction
 
 
+async def get_instruction_by_id_async(instruction_id: int, session: AsyncSession = None) -> RecipeInstruction:
+    """Get instruction by id without blocking the event loop"""
+
+    async with db.connection.async_session_scope(session) as session:
+        instruction = await session.get(RecipeInstruction, instruction_id)
+        if not instruction:
+            raise InstructionNotFoundException
+        return instruction
+
+
 def update_instruction(
-    recipe_id: int, instruction_id: int, field: str, value: str, user: common.authentication.AuthenticatedUser
+    recipe_id: int,
+    instruction_id: int,
+    field: str,
+    value: str,
+    user: common.authentication.AuthenticatedUser,
+    session: sqlalchemy.orm.Session = None,
 ):
     """
     Update instruction
@@ -256,19 +760,22 @@ def update_instruction(
     :param field:
     :param value:
     :param user:
+    :param session:
     """
 
-    instruction = get_instruction_by_id(instruction_id)
-    recipe = get_recipe_by_id(recipe_id, user=user)
+    try:
+        with db.connection.session_scope(session) as session:
+            instruction = get_instruction_by_id(instruction_id, session=session)
+            get_recipe_by_id(recipe_id, user=user, session=session)
 
-    if instruction.recipe_id != recipe_id:
-        raise RecipeWithInstructionNotFoundException
+            if instruction.recipe_id != recipe_id:
+                raise RecipeWithInstructionNotFoundException
 
-    try:
-        with db.connection.get_session() as session:
             session.execute(
                 update(RecipeInstruction), [{"id": instruction.id, f"{field}": value, "updated_by": user.id}]
             )
+            if field.lower() in INSTRUCTION_SUMMARY_FIELDS:
+                _refresh_recipes_summary([recipe_id], session)
             session.commit()
             RecipeInstruction.__setattr__(instruction, field, value)
             logging.info(f"Instruction #({instruction_id}) was updated. Set {field} = {value}")
@@ -278,16 +785,21 @@ def update_instruction(
         raise InstructionNameViolationException(ex)
 
 
-def create_instruction(recipe_id: int, instruction_request, user: common.authentication.AuthenticatedUser):
+def create_instruction(
+    recipe_id: int,
+    instruction_request,
+    user: common.authentication.AuthenticatedUser,
+    session: sqlalchemy.orm.Session = None,
+):
     """
     Create instructions
 
     :param recipe_id:
     :param instruction_request:
     :param user:
+    :param session:
     """
 
-    recipe = get_recipe_by_id(recipe_id, user=user)
     instruction = RecipeInstruction(
         instruction=instruction_request.instruction,
         time=instruction_request.time,
@@ -295,39 +807,49 @@ def create_instruction(recipe_id: int, instruction_request, user: common.authent
         category=instruction_request.category,
     )
 
-    with db.connection.get_session() as session:
+    with db.connection.session_scope(session) as session:
+        recipe = get_recipe_by_id(recipe_id, user=user, session=session)
         instruction.recipe_id = recipe.id
         session.add(instruction)
+        _refresh_recipes_summary([recipe.id], session)
         session.commit()
         session.refresh(instruction)
     return instruction
 
 
-def delete_instruction(recipe_id: int, instruction_id: int, user: Optional[common.authentication.AuthenticatedUser]):
-    recipe = get_recipe_by_id(recipe_id, user=user)
-    instruction = get_instruction_by_id(instruction_id)
+def delete_instruction(
+    recipe_id: int,
+    instruction_id: int,
+    user: Optional[common.authentication.AuthenticatedUser],
+    session: sqlalchemy.orm.Session = None,
+):
+    with db.connection.session_scope(session) as session:
+        get_recipe_by_id(recipe_id, user=user, session=session)
+        instruction = get_instruction_by_id(instruction_id, session=session)
 
-    if instruction.recipe_id != recipe_id:
-        raise RecipeWithInstructionNotFoundException
+        if instruction.recipe_id != recipe_id:
+            raise RecipeWithInstructionNotFoundException
 
-    with db.connection.get_session() as session:
         session.delete(instruction)
+        _refresh_recipes_summary([recipe_id], session)
         session.commit()
         logging.info(f"Instruction #{instruction_id} was deleted from Recipe #{recipe_id}")
 
 
-def delete_recipe(*, recipe_id: int, deleted_by: common.authentication.authenticated_user):
+def delete_recipe(
+    *, recipe_id: int, deleted_by: common.authentication.authenticated_user, session: sqlalchemy.orm.Session = None
+):
     """
     Delete recipe
 
     :param recipe_id:
     :param deleted_by:
+    :param session:
     :return:
     """
 
-    recipe = get_recipe_by_id(recipe_id, user=deleted_by)
-
-    with db.connection.get_session() as session:
+    with db.connection.session_scope(session) as session:
+        recipe = get_recipe_by_id(recipe_id, user=deleted_by, session=session, options=RECIPE_DETAIL_OPTIONS)
         session.execute(
             update(Recipe),
             [
@@ -339,19 +861,22 @@ def delete_recipe(*, recipe_id: int, deleted_by: common.authentication.authentic
                 }
             ],
         )
+        invalidate_recipes_count(session)
+        _reindex_recipes([recipe.id], session)
         session.commit()
         return recipe
 
 
-def get_ingredient_from_db(*, pk: int = None, name: str = None):
+def get_ingredient_from_db(*, pk: int = None, name: str = None, session: sqlalchemy.orm.Session = None):
     """
     Get ingredient from database
 
     :param pk:
     :param name:
+    :param session:
     :return:
     """
-    with db.connection.get_session() as session:
+    with db.connection.session_scope(session) as session:
         query = session.query(Ingredient)
         filters = []
 
@@ -370,27 +895,174 @@ def get_ingredient_from_db(*, pk: int = None, name: str = None):
     return ingredient
 
 
-def get_all_ingredients_from_db():
+def get_all_ingredients_from_db(session: sqlalchemy.orm.Session = None):
+    """
+    Get all ingredients from database, cached.
+    The cached ingredients are loaded with a session of their own, so they are never expired by the given one
+    :param session:
+    :return:
+    """
+
+    def _load():
+        with db.connection.session_scope() as own_session:
+            return own_session.query(Ingredient).filter(Ingredient.is_deleted == False).all()
+
+    return list(INGREDIENTS_CACHE.get_or_load('all', _load))
+
+
+def _get_ingredient_name_index(session: sqlalchemy.orm.Session) -> common.trigrams.TrigramIndex:
+    """
+    Get the in-memory trigram index of the ingredient names used when the database has no trigram support.
+    It is loaded again whenever the generation of the ingredients cache changed since it was loaded,
+    the changes of this process are applied to it directly
+    :param session:
+    :return:
+    """
+
+    global INGREDIENT_NAME_INDEX, _INGREDIENT_NAME_INDEX_GENERATION
+    generation = INGREDIENTS_CACHE.generation
+    if generation == _INGREDIENT_NAME_INDEX_GENERATION:
+        return INGREDIENT_NAME_INDEX
+
+    with _INGREDIENT_NAME_INDEX_LOCK:
+        if generation != _INGREDIENT_NAME_INDEX_GENERATION:
+            # the index in use is replaced only when the new one is complete
+            index = common.trigrams.TrigramIndex()
+            ingredients = session.execute(select(Ingredient.id, Ingredient.name).where(Ingredient.is_deleted == False))
+            for ingredient_id, name in ingredients:
+                index.add(ingredient_id, name)
+            INGREDIENT_NAME_INDEX, _INGREDIENT_NAME_INDEX_GENERATION = index, generation
+        return INGREDIENT_NAME_INDEX
+
+
+def _update_ingredient_name_index(update: Callable[[common.trigrams.TrigramIndex], None] = None) -> None:
+    """
+    Invalidate the ingredients in all workers after a committed change and apply the change to the trigram index.
+    The index is kept only when no other worker changed the ingredients since it was loaded
+    :param update:
+    :return:
+    """
+
+    global _INGREDIENT_NAME_INDEX_GENERATION
+    with _INGREDIENT_NAME_INDEX_LOCK:
+        loaded_generation = _INGREDIENT_NAME_INDEX_GENERATION
+        generation = INGREDIENTS_CACHE.invalidate()
+        if loaded_generation is None or generation != loaded_generation + 1:
+            _INGREDIENT_NAME_INDEX_GENERATION = None
+            return
+        if update:
+            update(INGREDIENT_NAME_INDEX)
+        _INGREDIENT_NAME_INDEX_GENERATION = generation
+
+
+def _reindex_ingredient_name(index: common.trigrams.TrigramIndex, ingredient: Ingredient) -> None:
+    # the trigrams of the old name must not match anymore
+    index.remove(ingredient.id)
+    index.add(ingredient.id, ingredient.name)
+
+
+def reset_ingredient_name_index() -> None:
+    """
+    Drop the in-memory trigram index of the ingredient names, it is loaded again on the next use
+    :return:
+    """
+
+    global _INGREDIENT_NAME_INDEX_GENERATION
+    with _INGREDIENT_NAME_INDEX_LOCK:
+        INGREDIENT_NAME_INDEX.clear()
+        _INGREDIENT_NAME_INDEX_GENERATION = None
+
+
+def _uses_pg_trgm(session: sqlalchemy.orm.Session) -> bool:
+    return session.get_bind().dialect.name == 'postgresql'
+
+
+def suggest_ingredients(query: str, limit: int = 10, session: sqlalchemy.orm.Session = None) -> list[Ingredient]:
     """
-    Get all ingredients from database
+    Get the ingredients with names most similar to the query, names starting with the query match as well
+    :param query:
+    :param limit:
+    :param session:
     :return:
     """
-    with db.connection.get_session() as session:
-        all_ingredients = session.query(Ingredient).filter(Ingredient.is_deleted == False).all()
-    return all_ingredients
+
+    min_score = CONFIG.ingredient_match.suggest_min_score
+    with db.connection.session_scope(session) as session:
+        if _uses_pg_trgm(session):
+            score = func.greatest(func.similarity(Ingredient.name, query), func.word_similarity(query, Ingredient.name))
+            return (
+                session.query(Ingredient)
+                .filter(
+                    Ingredient.is_deleted == False,
+                    or_(Ingredient.name.op('%')(query), literal(query).op('<%')(Ingredient.name)),
+                    score >= min_score,
+                )
+                .order_by(score.desc(), func.similarity(Ingredient.name, query).desc(), Ingredient.id)
+                .limit(limit)
+                .all()
+            )
+
+        matches = _get_ingredient_name_index(session).search(query, limit, min_score)
+        ingredients = {
+            ingredient.id: ingredient
+            for ingredient in session.query(Ingredient).filter(
+                Ingredient.id.in_([ingredient_id for ingredient_id, _ in matches]), Ingredient.is_deleted == False
+            )
+        }
+        return [ingredients[ingredient_id] for ingredient_id, _ in matches if ingredient_id in ingredients]
 
 
-def create_or_get_ingredient(ingredient: IngredientInput, created_by: int):
+def _get_similar_ingredient(name: str, measurement: str, session: sqlalchemy.orm.Session) -> Optional[Ingredient]:
     """
-    Create a new ingredient or get an existing one by name
+    Get the existing ingredient with the most similar name and the same measurement,
+    the nutrition values are per measurement unit so ingredients measured differently are never reused
+    :param name:
+    :param measurement:
+    :param session:
+    :return:
+    """
+
+    min_similarity = CONFIG.ingredient_match.reuse_similarity
+    filters = (Ingredient.is_deleted == False, Ingredient.measurement == measurement)
+    if _uses_pg_trgm(session):
+        similarity = func.similarity(Ingredient.name, name)
+        return (
+            session.query(Ingredient)
+            .filter(*filters, Ingredient.name.op('%')(name), similarity >= min_similarity)
+            .order_by(similarity.desc(), Ingredient.id)
+            .first()
+        )
+
+    matches = _get_ingredient_name_index(session).similar(name, min_similarity)
+    ingredients = {
+        ingredient.id: ingredient
+        for ingredient in session.query(Ingredient).filter(
+            *filters, Ingredient.id.in_([ingredient_id for ingredient_id, _ in matches])
+        )
+    }
+    return next((ingredients[ingredient_id] for ingredient_id, _ in matches if ingredient_id in ingredients), None)
+
+
+def create_or_get_ingredient(ingredient: IngredientInput, created_by: int, session: sqlalchemy.orm.Session = None):
+    """
+    Create a new ingredient or get an existing one by name, or by a close enough name
     :param ingredient:
     :param created_by:
+    :param session:
     :return:
     """
     try:
-        ingredient = get_ingredient_from_db(name=ingredient.name.lower())
+        ingredient = get_ingredient_from_db(name=ingredient.name.lower(), session=session)
         return ingredient
     except IngredientDoesNotExistException:
+        with db.connection.session_scope(session) as scoped_session:
+            similar_ingredient = _get_similar_ingredient(
+                ingredient.name.lower(), ingredient.measurement.lower(), scoped_session
+            )
+        if similar_ingredient:
+            logging.info(f"Reusing Ingredient #{similar_ingredient.id} {similar_ingredient.name} for {ingredient.name}")
+            return similar_ingredient
+
         new_ingredient = Ingredient(
             name=ingredient.name.lower(),
             calories=ingredient.calories,
@@ -403,77 +1075,66 @@ def create_or_get_ingredient(ingredient: IngredientInput, created_by: int):
             created_by=created_by,
         )
 
-        with db.connection.get_session() as session:
+        with db.connection.session_scope(session) as session:
             session.add(new_ingredient)
             session.commit()
             session.refresh(new_ingredient)
-
+        _update_ingredient_name_index(lambda index: index.add(new_ingredient.id, new_ingredient.name))
         return new_ingredient
 
 
-def _remove_ingredient_from_all_recipes(ingredient_id: int, user: common.authentication.authenticated_user):
+def _remove_ingredient_from_all_recipes(
+    ingredient_id: int, user: common.authentication.authenticated_user, session: sqlalchemy.orm.Session
+) -> list[int]:
     """
-    Remove deleted ingredient from all recipes
+    Remove deleted ingredient from all recipes with one statement, committing is left to the caller
     :param ingredient_id:
     :param user:
-    :return:
+    :param session:
+    :return: ids of the recipes which had the ingredient
     """
-    with db.connection.get_session() as session:
-        ingredient = session.query(Ingredient).get(ingredient_id)
-
-        if ingredient:
-            all_recipes_with_ingredient = (
-                session.query(Recipe)
-                .join(RecipeIngredient)
-                .filter(
-                    RecipeIngredient.ingredient_id == ingredient.id,
-                )
-                .all()
-            )
-
-            for recipe in all_recipes_with_ingredient:
-                recipe_ingredient = (
-                    session.query(RecipeIngredient)
-                    .filter_by(
-                        recipe_id=recipe.id,
-                        ingredient_id=ingredient.id,
-                    )
-                    .first()
-                )
-
-                if recipe_ingredient:
-                    session.delete(recipe_ingredient)
-
-                    recipe.updated_by = user.id
-                    recipe.updated_on = datetime.utcnow()
-
-                    session.commit()
 
-            session.commit()
+    recipe_ids = list(
+        session.scalars(
+            delete(RecipeIngredient)
+            .where(RecipeIngredient.ingredient_id == ingredient_id)
+            .returning(RecipeIngredient.recipe_id)
+        )
+    )
+    if recipe_ids:
+        _refresh_recipes_summary(recipe_ids, session, updated_by=user.id, updated_on=datetime.utcnow())
+    return recipe_ids
 
 
-def delete_ingredient(pk: int, user: common.authentication.authenticated_user):
+def delete_ingredient(
+    pk: int, user: common.authentication.authenticated_user, session: sqlalchemy.orm.Session = None
+) -> list[int]:
     """
     Delete ingredient and remove the relations with recipes
     :param pk:
     :param user:
-    :return:
+    :param session:
+    :return: ids of the recipes which had the ingredient
     """
-    ingredient = get_ingredient_from_db(pk=pk)
-    if not ingredient:
-        raise IngredientDoesNotExistException(text=f"Ingredient with id {pk} does not exist")
-    with db.connection.get_session() as session:
+    with db.connection.session_scope(session) as session:
+        ingredient = get_ingredient_from_db(pk=pk, session=session)
+        if not ingredient:
+            raise IngredientDoesNotExistException(text=f"Ingredient with id {pk} does not exist")
         ingredient.is_deleted = True
         ingredient.deleted_by = user.id
         ingredient.deleted_on = datetime.utcnow()
-        session.add(ingredient)
+
+        recipe_ids = _remove_ingredient_from_all_recipes(pk, user=user, session=session)
         session.commit()
-        session.refresh(ingredient)
+        _update_ingredient_name_index(lambda index: index.remove(pk))
 
-        _remove_ingredient_from_all_recipes(pk, user=user)
+    logging.info(f"User {user.id} deleted Ingredient #{pk}, it was removed from {len(recipe_ids)} recipes")
+    return recipe_ids
 
 
-def update_ingredient(ingredient_id: int, field: str, value: str | float, updated_by: int):
+def update_ingredient(
+    ingredient_id: int, field: str, value: str | float, updated_by: int, session: sqlalchemy.orm.Session = None
+):
     """
     Update Ingredient
 
@@ -481,25 +1142,37 @@ def update_ingredient(ingredient_id: int, field: str, value: str | float, update
     :param field:
     :param value:
     :param updated_by:
+    :param session:
     :return:
     """
 
-    db_ingredient = get_ingredient_from_db(pk=ingredient_id)
-    with db.connection.get_session() as session:
+    with db.connection.session_scope(session) as session:
+        db_ingredient = get_ingredient_from_db(pk=ingredient_id, session=session)
         session.execute(
             update(Ingredient),
             [{"id": ingredient_id, f"{field}": str(value), "updated_by": updated_by}],
         )
+        if field.lower() in NUTRIENT_FIELDS:
+            _refresh_recipes_summary(
+                select(RecipeIngredient.recipe_id).where(RecipeIngredient.ingredient_id == ingredient_id), session
+            )
         session.commit()
-        session.add(db_ingredient)
         session.refresh(db_ingredient)
+        if field.lower() == 'name':
+            _update_ingredient_name_index(lambda index: _reindex_ingredient_name(index, db_ingredient))
+        else:
+            _update_ingredient_name_index()
 
         logging.info(f"Ingredient #{db_ingredient.id} updated. {updated_by} set {field}={value}")
         return db_ingredient
 
 
 def patch_recipe(
-    *, recipe_id: int, patch_input_model: PatchRecipeInputModel, patched_by: common.authentication.AuthenticatedUser
+    *,
+    recipe_id: int,
+    patch_input_model: PatchRecipeInputModel,
+    patched_by: common.authentication.AuthenticatedUser,
+    session: sqlalchemy.orm.Session = None,
 ):
     """
     Patch recipe
@@ -507,25 +1180,31 @@ def patch_recipe(
     :param recipe_id:
     :param patch_input_model:
     :param patched_by:
+    :param session:
     :return:
     """
 
-    recipe = get_recipe_by_id(recipe_id, patched_by)
-    with db.connection.get_session() as session:
+    with db.connection.session_scope(session) as session:
+        recipe = get_recipe_by_id(recipe_id, patched_by, session=session)
         values = {patch_input_model.field: patch_input_model.value, 'updated_by': patched_by.id}
         if patch_input_model.field.upper() == 'IS_PUBLISHED':
             values['published_on'] = datetime.utcnow()
             values['published_by'] = patched_by.id
         session.execute(update(Recipe).where(Recipe.id == recipe.id).values(values))
+        invalidate_recipes_count(session)
+        _reindex_recipes([recipe.id], session)
         session.commit()
-        session.add(recipe)
-        session.refresh(recipe)
+        recipe = _load_recipe_detail(recipe.id, session)
 
     return recipe
 
 
 def update_recipe(
-    *, recipe_id: int, update_recipe_input_model: RecipeInputModel, updated_by: common.authentication.AuthenticatedUser
+    *,
+    recipe_id: int,
+    update_recipe_input_model: RecipeInputModel,
+    updated_by: common.authentication.AuthenticatedUser,
+    session: sqlalchemy.orm.Session = None,
 ):
     """
     Update recipe
@@ -533,26 +1212,31 @@ def update_recipe(
     :param recipe_id:
     :param update_recipe_input_model:
     :param updated_by:
+    :param session:
     :return:
     """
 
-    recipe = get_recipe_by_id(recipe_id, user=updated_by)
-    for field, value in iter(update_recipe_input_model):
-        if field.casefold() in ['instructions']:
-            value = [RecipeInstruction(**instruction.model_dump()) for instruction in value]
-        Recipe.__setattr__(recipe, field, value)
+    with db.connection.session_scope(session) as session:
+        recipe = get_recipe_by_id(recipe_id, user=updated_by, session=session, options=RECIPE_DETAIL_OPTIONS)
+        for field, value in iter(update_recipe_input_model):
+            if field.casefold() in ['instructions']:
+                value = [RecipeInstruction(**instruction.model_dump()) for instruction in value]
+            Recipe.__setattr__(recipe, field, value)
 
-    recipe.updated_by = updated_by.id
+        recipe.updated_by = updated_by.id
 
-    with db.connection.get_session() as session:
-        session.add(recipe)
+        _refresh_recipes_summary([recipe.id], session)
         session.commit()
-        session.refresh(recipe)
+        recipe = _load_recipe_detail(recipe.id, session)
     return recipe
 
 
 def add_ingredient_to_recipe(
-    recipe_id: int, ingredient_id: int, quantity: float, user: common.authentication.AuthenticatedUser
+    recipe_id: int,
+    ingredient_id: int,
+    quantity: float,
+    user: common.authentication.AuthenticatedUser,
+    session: sqlalchemy.orm.Session = None,
 ):
     """
     Add ingredient to recipe
@@ -560,51 +1244,96 @@ def add_ingredient_to_recipe(
     :param ingredient_id:
     :param quantity:
     :param user:
+    :param session:
     :return:
     """
-    with db.connection.get_session() as session:
-        db_ingredient = get_ingredient_from_db(pk=ingredient_id)
-        db_recipe = get_recipe_by_id(recipe_id=recipe_id, user=user)
-
-        if db_ingredient in db_recipe.ingredients:
-            raise IngredientAlreadyInRecipe()
-
-        recipe_ingredient = RecipeIngredient(recipe_id=recipe_id, ingredient_id=db_ingredient.id, quantity=quantity)
-
-        db_recipe.updated_by = user.id
-        db_recipe.updated_on = datetime.utcnow()
-
-        session.add(recipe_ingredient)
-        session.commit()
-        session.add(db_recipe)
-        session.commit()
+    add_ingredients_to_recipe(
+        [RecipeIngredientInputModel(ingredient_id=ingredient_id, quantity=quantity)], recipe_id, user, session=session
+    )
 
 
 def add_ingredients_to_recipe(
-    ingredients: list[RecipeIngredientInputModel], recipe_id: int, user: common.authentication.authenticated_user
+    ingredients: list[RecipeIngredientInputModel],
+    recipe_id: int,
+    user: common.authentication.authenticated_user,
+    session: sqlalchemy.orm.Session = None,
 ):
     """
-    Add ingredients to recipe
+    Add ingredients to recipe, all of them or none
     :param ingredients:
     :param recipe_id:
     :param user:
+    :param session:
     :return:
     """
-    for ingredient in ingredients:
-        add_ingredient_to_recipe(recipe_id, ingredient.ingredient_id, ingredient.quantity, user=user)
+    with db.connection.session_scope(session) as session:
+        db_recipe = get_recipe_by_id(recipe_id=recipe_id, user=user, session=session)
+        _attach_ingredients(db_recipe, ingredients, user, session)
+        session.commit()
+
+
+def _attach_ingredients(
+    recipe: Recipe,
+    ingredients: list[RecipeIngredientInputModel],
+    user: common.authentication.AuthenticatedUser,
+    session: sqlalchemy.orm.Session,
+) -> None:
+    """
+    Validate the ingredients with one query and insert all mapping rows with one statement,
+    committing is left to the caller
+    :param recipe:
+    :param ingredients:
+    :param user:
+    :param session:
+    :return:
+    """
+
+    ingredient_ids = [ingredient.ingredient_id for ingredient in ingredients]
+    if len(set(ingredient_ids)) != len(ingredient_ids):
+        raise IngredientAlreadyInRecipe()
+
+    existing_ids = set(
+        session.scalars(select(Ingredient.id).where(Ingredient.id.in_(ingredient_ids), Ingredient.is_deleted == False))
+    )
+    missing_ids = [ingredient_id for ingredient_id in ingredient_ids if ingredient_id not in existing_ids]
+    if missing_ids:
+        raise IngredientDoesNotExistException(
+            text=f"Ingredient with id {', '.join(str(ingredient_id) for ingredient_id in missing_ids)} does not exist"
+        )
+    if session.scalars(
+        select(RecipeIngredient.ingredient_id).where(
+            RecipeIngredient.recipe_id == recipe.id, RecipeIngredient.ingredient_id.in_(ingredient_ids)
+        )
+    ).first():
+        raise IngredientAlreadyInRecipe()
+
+    session.execute(
+        insert(RecipeIngredient),
+        [
+            {"recipe_id": recipe.id, "ingredient_id": ingredient.ingredient_id, "quantity": ingredient.quantity}
+            for ingredient in ingredients
+        ],
+    )
+    recipe.updated_by = user.id
+    recipe.updated_on = datetime.utcnow()
+    _refresh_recipes_summary([recipe.id], session)
 
 
 def remove_ingredient_from_recipe(
-    recipe: Recipe, ingredient: Ingredient, user: common.authentication.authenticated_user
+    recipe: Recipe,
+    ingredient: Ingredient,
+    user: common.authentication.authenticated_user,
+    session: sqlalchemy.orm.Session = None,
 ):
     """
     Remove ingredient from recipe
     :param recipe:
     :param ingredient:
     :param user:
+    :param session:
     :return:
     """
-    with db.connection.get_session() as session:
+    with db.connection.session_scope(session) as session:
         recipe_ingredient = (
             session.query(RecipeIngredient).filter_by(recipe_id=recipe.id, ingredient_id=ingredient.id).first()
         )
@@ -615,6 +1344,140 @@ def remove_ingredient_from_recipe(
             recipe.updated_by = user.id
             recipe.updated_on = datetime.utcnow()
 
+            _refresh_recipes_summary([recipe.id], session)
             session.commit()
         else:
             raise RecipeIngredientDoesNotExistException()
+
+
+def _load_recipe_ingredients(
+    session: sqlalchemy.orm.Session, recipe_ids: Optional[set[int]] = None
+) -> dict[int, list[int]]:
+    """
+    Load the ingredients of the published and not deleted recipes
+    :param session:
+    :param recipe_ids: only these recipes, all when missing
+    :return: ingredient ids by recipe id
+    """
+
+    query = (
+        select(RecipeIngredient.recipe_id, RecipeIngredient.ingredient_id)
+        .join(Recipe, Recipe.id == RecipeIngredient.recipe_id)
+        .where(Recipe.is_published.is_(True), Recipe.is_deleted.is_(False))
+    )
+    if recipe_ids is not None:
+        query = query.where(RecipeIngredient.recipe_id.in_(recipe_ids))
+    recipe_ingredients = {}
+    for recipe_id, ingredient_id in session.execute(query):
+        recipe_ingredients.setdefault(recipe_id, []).append(ingredient_id)
+    return recipe_ingredients
+
+
+def _get_recipe_ingredients_index(session: sqlalchemy.orm.Session) -> common.postings.PostingIndex:
+    """
+    Get the in-memory index of the published recipes by their ingredients, loading it when it is missing or expired
+    and refreshing the recipes changed since the last use. The database is queried without holding the lock,
+    the other threads keep using the current index meanwhile
+    :param session:
+    :return:
+    """
+
+    global _RECIPE_INGREDIENTS_INDEX_LOADED_ON
+    with _RECIPE_INGREDIENTS_INDEX_LOCK:
+        loaded_on = _RECIPE_INGREDIENTS_INDEX_LOADED_ON
+        reload = loaded_on is None or time.monotonic() - loaded_on > CONFIG.pantry_index.refresh_interval
+        if reload and loaded_on is not None:
+            # only one thread rebuilds an expired index
+            _RECIPE_INGREDIENTS_INDEX_LOADED_ON = time.monotonic()
+        stale_recipe_ids = set(_STALE_RECIPE_IDS)
+        _STALE_RECIPE_IDS.clear()
+
+    try:
+        if reload:
+            recipe_ingredients = _load_recipe_ingredients(session)
+        elif stale_recipe_ids:
+            recipe_ingredients = _load_recipe_ingredients(session, stale_recipe_ids)
+        else:
+            return RECIPE_INGREDIENTS_INDEX
+    except Exception:
+        with _RECIPE_INGREDIENTS_INDEX_LOCK:
+            _RECIPE_INGREDIENTS_INDEX_LOADED_ON = loaded_on
+            _STALE_RECIPE_IDS.update(stale_recipe_ids)
+        raise
+
+    if reload:
+        with _RECIPE_INGREDIENTS_INDEX_LOCK:
+            RECIPE_INGREDIENTS_INDEX.load(recipe_ingredients)
+            _RECIPE_INGREDIENTS_INDEX_LOADED_ON = time.monotonic()
+        logging.info(f"Loaded the ingredients of {len(RECIPE_INGREDIENTS_INDEX)} recipes")
+    else:
+        # the unpublished and deleted recipes are removed
+        for recipe_id in stale_recipe_ids:
+            RECIPE_INGREDIENTS_INDEX.set(recipe_id, recipe_ingredients.get(recipe_id, ()))
+    return RECIPE_INGREDIENTS_INDEX
+
+
+def reset_recipe_ingredients_index() -> None:
+    """
+    Drop the in-memory index of the recipes by their ingredients, it is loaded again on the next use
+    :return:
+    """
+
+    global _RECIPE_INGREDIENTS_INDEX_LOADED_ON
+    with _RECIPE_INGREDIENTS_INDEX_LOCK:
+        RECIPE_INGREDIENTS_INDEX.clear()
+        _STALE_RECIPE_IDS.clear()
+        _RECIPE_INGREDIENTS_INDEX_LOADED_ON = None
+
+
+def rank_recipes_by_pantry(
+    ingredient_ids: Iterable[int],
+    user: Optional[common.authentication.AuthenticatedUser],
+    limit: int = 20,
+    session: sqlalchemy.orm.Session = None,
+) -> list[tuple[Recipe, int, list[int]]]:
+    """
+    Rank the recipes by the share of their ingredients found in the pantry. The unpublished recipes the user
+    can see are ranked together with the indexed published ones and only the best ranked recipes are loaded
+    :param ingredient_ids: ingredients in the pantry
+    :param user:
+    :param limit:
+    :param session:
+    :return: (recipe, matched ingredients count, missing ingredient ids) triples, best first
+    """
+
+    ingredient_ids = set(ingredient_ids)
+    with db.connection.session_scope(session) as session:
+        index = _get_recipe_ingredients_index(session)
+        # the index has the published recipes only, the other recipes the user can see are ranked with them
+        private_recipes = {}
+        if user:
+            for recipe_id, ingredient_id in session.execute(
+                select(RecipeIngredient.recipe_id, RecipeIngredient.ingredient_id)
+                .join(Recipe, Recipe.id == RecipeIngredient.recipe_id)
+                .where(
+                    *_get_published_filter_expression(user),
+                    ~and_(Recipe.is_published.is_(True), Recipe.is_deleted.is_(False)),
+                    RecipeIngredient.recipe_id.in_(
+                        select(RecipeIngredient.recipe_id).where(RecipeIngredient.ingredient_id.in_(ingredient_ids))
+                    ),
+                )
+            ):
+                private_recipes.setdefault(recipe_id, set()).add(ingredient_id)
+
+        ranked = index.rank(ingredient_ids, private_recipes)[:limit]
+        recipes = {
+            recipe.id: recipe
+            for recipe in session.query(Recipe)
+            .join(RecipeCategory, isouter=True)
+            .filter(Recipe.id.in_([recipe_id for recipe_id, _, _ in ranked]), *_get_published_filter_expression(user))
+            .options(*RECIPE_LIST_OPTIONS)
+        }
+        results = []
+        for recipe_id, matched, _ in ranked:
+            # the recipes unpublished by other workers since the index was refreshed are skipped
+            if recipe_id in recipes:
+                recipe_ingredients = private_recipes.get(recipe_id) or index.get(recipe_id)
+                results.append((recipes[recipe_id], matched, sorted(recipe_ingredients - ingredient_ids)))
+        return results
+        return results
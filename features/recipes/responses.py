@@ -1,17 +1,23 @@
 """Recipes feature responses"""
 import datetime
-from typing import Optional, Any
+from typing import Optional, Any, Iterable
 import pydantic
 import communication.users_pb2_grpc
 import communication.users_pb2
 import communication.images_pb2
 import communication.images_pb2_grpc
 import grpc
+import common.grpc_client
 import configuration
 import khLogging
 
 config = configuration.Config()
 
+logging = khLogging.Logger.get_child_logger(__file__)
+
+# lookups fall back to the raw ids when the services are slow, down or their circuit breaker is open
+GRPC_ERRORS = (grpc.RpcError, common.grpc_client.CircuitOpenError)
+
 
 class Category(pydantic.BaseModel):
     """Category response"""
@@ -95,18 +101,27 @@ class RecipeResponse(pydantic.BaseModel):
     ingredients: list[RecipeIngredientResponse] | Any = None
 
     def model_post_init(self, __context: Any):
-        try:
-            self.created_by = _get_username(self.created_by)
-        except Exception:
-            # TODO enhance error handling during grpc calls
-            pass
-        if self.picture:
-            try:
-                self.picture = _get_image_url(self.picture)
-            except Exception:
-                # TODO enhance error handling during grpc calls
-                pass
-        else:
+        # usernames and image urls resolved for the whole page are passed as validation context
+        usernames = __context.get('usernames') if __context else None
+        image_urls = __context.get('image_urls') if __context else None
+
+        if isinstance(self.created_by, int):
+            if usernames is not None:
+                self.created_by = usernames.get(self.created_by, self.created_by)
+            else:
+                try:
+                    self.created_by = _get_username(self.created_by)
+                except GRPC_ERRORS:
+                    pass
+        if isinstance(self.picture, int):
+            if image_urls is not None:
+                self.picture = image_urls.get(self.picture, self.picture)
+            else:
+                try:
+                    self.picture = _get_image_url(self.picture)
+                except GRPC_ERRORS:
+                    pass
+        elif not self.picture:
             self.picture = "https://res.cloudinary.com/dipxtlowj/image/upload/084892ec-9a02-4335-941a-d8a2795358ce.jpeg"
         if self.category:
             self.category = CategoryShortResponse(**self.category.__dict__)
@@ -129,26 +144,99 @@ class RecipeResponse(pydantic.BaseModel):
 class PSFRecipesResponseModel(pydantic.BaseModel):
     """Recipe pagination, sorting, and filtering response"""
 
-    page_number: int
+    page_number: int | None
     page_size: int
     previous_page: str | None
     next_page: str | None
-    total_pages: int
-    total_items: int
+    next_cursor: str | None = None
+    total_pages: int | None
+    total_items: int | None
     recipes: list[RecipeResponse]
 
 
+class PantryRecipeResponse(pydantic.BaseModel):
+    """Recipe ranked by the share of its ingredients found in the pantry"""
+
+    coverage: float
+    matched_ingredients: int
+    missing_ingredients: list[int]
+    recipe: RecipeResponse
+
+
+class ImportErrorResponse(pydantic.BaseModel):
+    """Invalid line of an imported file"""
+
+    line: int
+    error: str
+
+
+class ImportRecipesResponse(pydantic.BaseModel):
+    """Progress or result of a recipes import"""
+
+    state: str
+    task_id: Optional[str] = None
+    imported: int = 0
+    failed: int = 0
+    errors: list[ImportErrorResponse] = []
+
+
 def _get_username(user_id: int) -> str:
-    with grpc.insecure_channel(config.users_grpc_server_host) as channel:
-        stud = communication.users_pb2_grpc.UsersStub(channel)
-        request = communication.users_pb2.UsernameRequest(user_id=user_id)
-        response = stud.get_username(request)
-        return response.username
+    request = communication.users_pb2.UsernameRequest(user_id=user_id)
+    response = common.grpc_client.call(
+        config.users_grpc_server_host, communication.users_pb2_grpc.UsersStub, 'get_username', request
+    )
+    return response.username
 
 
 def _get_image_url(image_id: int) -> Optional[str]:
-    with grpc.insecure_channel(config.images_grpc_server_host) as channel:
-        stud = communication.images_pb2_grpc.ImagesStub(channel)
-        request = communication.images_pb2.ImageRequest(image_id=image_id)
-        response = stud.get_image_url(request)
-        return response.image_url
+    request = communication.images_pb2.ImageRequest(image_id=image_id)
+    response = common.grpc_client.call(
+        config.images_grpc_server_host, communication.images_pb2_grpc.ImagesStub, 'get_image_url', request
+    )
+    return response.image_url
+
+
+def get_usernames(user_ids: Iterable[int]) -> dict[int, str]:
+    """
+    Resolve the usernames of distinct user ids with a single batched call.
+    Ids which can not be resolved are left out
+    :param user_ids:
+    :return:
+    """
+
+    user_ids = {user_id for user_id in user_ids if user_id}
+    if not user_ids:
+        return {}
+
+    request = communication.users_pb2.UsernamesRequest(user_ids=user_ids)
+    try:
+        response = common.grpc_client.call(
+            config.users_grpc_server_host, communication.users_pb2_grpc.UsersStub, 'get_usernames', request
+        )
+    except GRPC_ERRORS as error:
+        logging.warning(f"Could not resolve usernames: {error!r}")
+        return {}
+    return dict(response.usernames)
+
+
+def get_image_urls(image_ids: Iterable[int]) -> dict[int, str]:
+    """
+    Resolve the urls of distinct image ids with a single batched call.
+    Ids which can not be resolved are left out
+    :param image_ids:
+    :return:
+    """
+
+    image_ids = {image_id for image_id in image_ids if image_id}
+    if not image_ids:
+        return {}
+
+    request = communication.images_pb2.ImageUrlsRequest(image_ids=image_ids)
+    try:
+        response = common.grpc_client.call(
+            config.images_grpc_server_host, communication.images_pb2_grpc.ImagesStub, 'get_image_urls', request
+        )
+    except GRPC_ERRORS as error:
+        logging.warning(f"Could not resolve image urls: {error!r}")
+        return {}
+    return dict(response.image_urls)
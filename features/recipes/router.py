@@ -1,11 +1,15 @@
 """Recipes feature endpoints"""
 import json
+import uuid
 
 import aiofiles
 import fastapi
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
 
 import common.authentication
 import configuration
+import db.connection
 import features.recipes.exceptions
 import features.recipes.exceptions
 import features.recipes.operations
@@ -17,16 +21,21 @@ from .input_models import (
     CreateCategoryInputModel,
     RecipeInputModel,
     PSFRecipesInputModel,
+    CountOptions,
+    ExportFormats,
     UpdateIngredientInputModel,
     PatchRecipeInputModel,
     RecipeIngredientInputModel,
 )
 from .input_models import PatchInstructionInputModel, CreateInstructionInputModel, IngredientInput
-from .responses import RecipeResponse
+from .responses import RecipeResponse, PantryRecipeResponse, ImportRecipesResponse
+from .helpers import build_recipe_responses, stream_csv, stream_ndjson
 import features.recipes.tasks
 from typing import Annotated, Optional
 from fastapi import WebSocket
 
+config = configuration.Config()
+
 categories_router = fastapi.APIRouter()
 recipes_router = fastapi.APIRouter()
 ingredient_router = fastapi.APIRouter()
@@ -37,31 +46,35 @@ def _common_parameters(
     page_size: int = 10,
     sort: Optional[str] = None,
     filters: Optional[str] = None,
+    cursor: Optional[str] = None,
+    count: Optional[CountOptions] = None,
 ):
     return PSFRecipesInputModel(**locals())
 
 
 @categories_router.get("/", response_model=list[Category])
-def get_all_categories():
+def get_all_categories(session: db.connection.db_session):
     """
     Get all categories
+    :param session:
     :return:
     """
 
-    return features.recipes.operations.get_all_recipe_categories()
+    return features.recipes.operations.get_all_recipe_categories(session=session)
 
 
 @categories_router.get("/{category_id}", response_model=Category)
-def get_category(category_id: int = fastapi.Path()):
+def get_category(session: db.connection.db_session, category_id: int = fastapi.Path()):
     """
     Get category
 
+    :param session:
     :param category_id:
     :return:
     """
 
     try:
-        return features.recipes.operations.get_category_by_id_or_name(category_id=category_id)
+        return features.recipes.operations.get_category_by_id_or_name(category_id=category_id, session=session)
     except features.recipes.exceptions.CategoryNotFoundException:
         raise fastapi.HTTPException(
             status_code=fastapi.status.HTTP_404_NOT_FOUND,
@@ -76,17 +89,21 @@ def create_category(
         common.authentication.AuthenticatedUser,
         fastapi.Depends(common.authentication.admin),
     ],
+    session: db.connection.db_session,
 ):
     """
     Crate category
 
     :param create_category_input_model:
     :param user:
+    :param session:
     :return:
     """
 
     try:
-        return features.recipes.operations.create_category(create_category_input_model.name, created_by=user.id)
+        return features.recipes.operations.create_category(
+            create_category_input_model.name, created_by=user.id, session=session
+        )
     except features.recipes.exceptions.CategoryNameViolationException:
         raise fastapi.HTTPException(
             status_code=fastapi.status.HTTP_400_BAD_REQUEST,
@@ -100,6 +117,7 @@ def update_category(
         common.authentication.AuthenticatedUser,
         fastapi.Depends(common.authentication.admin),
     ],
+    session: db.connection.db_session,
     category_id: int = fastapi.Path(),
     patch_category_input_model: PatchCategoryInputModel = fastapi.Body(),
 ):
@@ -107,6 +125,7 @@ def update_category(
     Update category
 
     :param user:
+    :param session:
     :param category_id:
     :param patch_category_input_model:
     :return:
@@ -116,6 +135,7 @@ def update_category(
             category_id=category_id,
             **patch_category_input_model.model_dump(),
             updated_by=user.id,
+            session=session,
         )
     except features.recipes.exceptions.CategoryNotFoundException:
         raise fastapi.HTTPException(
@@ -130,25 +150,175 @@ def update_category(
 
 
 @recipes_router.get("/", response_model=PSFRecipesResponseModel)
-def get_all_recipes(
+async def get_all_recipes(
     paginated_input_model: Annotated[PSFRecipesInputModel, fastapi.Depends(_common_parameters)],
     user: common.authentication.optional_user,
+    session: db.connection.async_db_session,
 ):
     """
     Get all recipes
     :param paginated_input_model:
     :param user:
+    :param session:
+    """
+
+    return await features.recipes.operations.get_all_recipes_async(paginated_input_model, user=user, session=session)
+
+
+@recipes_router.get("/export")
+def export_recipes(
+    user: common.authentication.authenticated_user,
+    session: db.connection.db_session,
+    export_format: ExportFormats = fastapi.Query(default=ExportFormats.NDJSON, alias="format"),
+):
+    """
+    Stream all recipes visible to the user as NDJSON or CSV.
+    The request session stays open until the response is streamed
+
+    :param user:
+    :param session:
+    :param export_format:
+    :return:
+    """
+
+    rows = features.recipes.operations.export_recipes(user, session=session)
+    if export_format == ExportFormats.CSV:
+        content, media_type = stream_csv(rows, features.recipes.operations.RECIPE_EXPORT_FIELDS), "text/csv"
+    else:
+        content, media_type = stream_ndjson(rows), "application/x-ndjson"
+    return StreamingResponse(
+        content,
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="recipes.{export_format.value}"'},
+    )
+
+
+@recipes_router.post("/import", response_model=ImportRecipesResponse)
+async def import_recipes(
+    request: fastapi.Request,
+    response: fastapi.Response,
+    user: Annotated[common.authentication.AuthenticatedUser, fastapi.Depends(common.authentication.admin)],
+):
+    """
+    Import recipes from a NDJSON body, one recipe per line. Small files are imported right away,
+    larger ones by a celery task which progress is available at /import/{task_id}.
+    Files over the configured maximum size are rejected
+
+    :param request:
+    :param response:
+    :param user:
+    :return:
+    """
+
+    max_bytes = config.recipes_import.max_bytes
+    too_large = fastapi.HTTPException(
+        status_code=fastapi.status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+        detail=f"The file must not be larger than {max_bytes} bytes",
+    )
+    try:
+        content_length = int(request.headers.get("content-length") or 0)
+    except ValueError:
+        # a malformed header is treated as missing, the streamed size is checked anyway
+        content_length = 0
+    if content_length > max_bytes:
+        raise too_large
+
+    file_name = f"{uuid.uuid4().hex}.ndjson"
+    file_path = configuration.IMPORTS_PATH.joinpath(file_name)
+    file_size = 0
+    try:
+        async with aiofiles.open(file_path, mode="wb") as file:
+            async for chunk in request.stream():
+                file_size += len(chunk)
+                # the length header is missing from chunked uploads
+                if file_size > max_bytes:
+                    raise too_large
+                await file.write(chunk)
+    except fastapi.HTTPException:
+        file_path.unlink(missing_ok=True)
+        raise
+
+    if file_size > config.recipes_import.sync_max_bytes:
+        task = features.recipes.tasks.import_recipes_file.delay(file_name, user.id)
+        features.recipes.tasks.set_import_progress(task.id, "PENDING", only_new=True)
+        response.status_code = fastapi.status.HTTP_202_ACCEPTED
+        return ImportRecipesResponse(state="PENDING", task_id=task.id)
+
+    def _import():
+        with file_path.open("rb") as lines:
+            return features.recipes.operations.import_recipes(lines, user)
+
+    try:
+        report = await run_in_threadpool(_import)
+    finally:
+        file_path.unlink(missing_ok=True)
+    return ImportRecipesResponse(state="SUCCESS", **report)
+
+
+@recipes_router.get("/import/{task_id}", response_model=ImportRecipesResponse)
+def get_import_recipes_progress(
+    task_id: str,
+    user: Annotated[common.authentication.AuthenticatedUser, fastapi.Depends(common.authentication.admin)],
+):
+    """
+    Get the progress of a recipes import task
+
+    :param task_id:
+    :param user:
+    :return:
     """
 
-    return features.recipes.operations.get_all_recipes(paginated_input_model, user=user)
+    progress = features.recipes.tasks.get_import_progress(task_id)
+    if progress is None:
+        raise fastapi.HTTPException(
+            status_code=fastapi.status.HTTP_404_NOT_FOUND,
+            detail=f"Import task with id {task_id} not found",
+        )
+    return ImportRecipesResponse(task_id=task_id, **progress)
+
+
+@recipes_router.get("/pantry", response_model=list[PantryRecipeResponse])
+def get_recipes_by_pantry(
+    user: common.authentication.optional_user,
+    session: db.connection.db_session,
+    ingredient_id: list[int] = fastapi.Query(),
+    limit: int = fastapi.Query(default=20, gt=0, le=100),
+):
+    """
+    Get the recipes which can be cooked with the ingredients at hand, ranked by the share of their ingredients
+    found in the pantry
+
+    :param user:
+    :param session:
+    :param ingredient_id: ingredients in the pantry
+    :param limit:
+    :return:
+    """
+
+    ranked = features.recipes.operations.rank_recipes_by_pantry(ingredient_id, user, limit, session=session)
+    responses = build_recipe_responses([recipe for recipe, _, _ in ranked])
+    return [
+        PantryRecipeResponse(
+            coverage=round(matched / (matched + len(missing)), 4),
+            matched_ingredients=matched,
+            missing_ingredients=missing,
+            recipe=response,
+        )
+        for (_, matched, missing), response in zip(ranked, responses)
+    ]
 
 
 @recipes_router.get("/{recipe_id}", response_model=RecipeResponse)
-def get_recipe(user: common.authentication.optional_user, recipe_id: int = fastapi.Path()):
+async def get_recipe(
+    user: common.authentication.optional_user, session: db.connection.async_db_session, recipe_id: int = fastapi.Path()
+):
     """Get recipe"""
 
     try:
-        return features.recipes.operations.get_recipe_by_id(recipe_id, user)
+        recipe = await features.recipes.operations.get_recipe_by_id_async(
+            recipe_id, user, session=session, options=features.recipes.operations.RECIPE_DETAIL_OPTIONS
+        )
+        return await run_in_threadpool(lambda: RecipeResponse(**recipe.to_dict()))
     except features.recipes.exceptions.RecipeNotFoundException:
         raise fastapi.HTTPException(
             status_code=fastapi.status.HTTP_404_NOT_FOUND,
@@ -160,16 +330,20 @@ def get_recipe(user: common.authentication.optional_user, recipe_id: int = fasta
 def create_recipe(
     create_recipe_input_model: RecipeInputModel,
     created_by: common.authentication.authenticated_user,
+    session: db.connection.db_session,
 ):
     """
     Create recipe
 
     :param create_recipe_input_model:
     :param created_by:
+    :param session:
     :return:
     """
     try:
-        return features.recipes.operations.create_recipe(**create_recipe_input_model.__dict__, created_by=created_by)
+        return features.recipes.operations.create_recipe(
+            **create_recipe_input_model.__dict__, created_by=created_by, session=session
+        )
 
     except features.recipes.exceptions.CategoryNotFoundException:
         raise fastapi.HTTPException(
@@ -181,11 +355,17 @@ def create_recipe(
             status_code=fastapi.status.HTTP_400_BAD_REQUEST,
             detail=e.text,
         )
+    except features.recipes.exceptions.IngredientAlreadyInRecipe:
+        raise fastapi.HTTPException(
+            status_code=fastapi.status.HTTP_400_BAD_REQUEST,
+            detail="Ingredients of the recipe must not repeat",
+        )
 
 
 @recipes_router.patch('/{recipe_id}', response_model=RecipeResponse)
 def patch_recipe(
     patched_by: common.authentication.authenticated_user,
+    session: db.connection.db_session,
     recipe_id: int = fastapi.Path(),
     patch_input_model: PatchRecipeInputModel = fastapi.Body(),
 ):
@@ -195,12 +375,13 @@ def patch_recipe(
     :param recipe_id:
     :param patch_input_model:
     :param patched_by:
+    :param session:
     :return:
     """
 
     try:
         return features.recipes.operations.patch_recipe(
-            recipe_id=recipe_id, patch_input_model=patch_input_model, patched_by=patched_by
+            recipe_id=recipe_id, patch_input_model=patch_input_model, patched_by=patched_by, session=session
         )
 
     except features.recipes.exceptions.RecipeNotFoundException:
@@ -213,12 +394,14 @@ def patch_recipe(
 @recipes_router.put('/{recipe_id}', response_model=RecipeResponse)
 def update_recipe(
     updated_by: common.authentication.authenticated_user,
+    session: db.connection.db_session,
     recipe_id: int = fastapi.Path(),
     new_recipe: RecipeInputModel = fastapi.Body(),
 ):
     """
     Update recipe
     :param updated_by:
+    :param session:
     :param recipe_id:
     :param new_recipe:
     :return:
@@ -226,7 +409,7 @@ def update_recipe(
 
     try:
         return features.recipes.operations.update_recipe(
-            recipe_id=recipe_id, update_recipe_input_model=new_recipe, updated_by=updated_by
+            recipe_id=recipe_id, update_recipe_input_model=new_recipe, updated_by=updated_by, session=session
         )
     except features.recipes.exceptions.RecipeNotFoundException:
         raise fastapi.HTTPException(
@@ -238,6 +421,7 @@ def update_recipe(
 @recipes_router.patch("/{recipe_id}/instructions/{instruction_id}", response_model=InstructionResponse)
 def update_instructions(
     user: common.authentication.authenticated_user,
+    session: db.connection.db_session,
     recipe_id: int = fastapi.Path(),
     instruction_id: int = fastapi.Path(),
     patch_instruction_input_model: PatchInstructionInputModel = fastapi.Body(),
@@ -245,6 +429,7 @@ def update_instructions(
     """
     Update instructions
     :param user:
+    :param session:
     :param recipe_id:
     :param instruction_id:
     :param patch_instruction_input_model:
@@ -252,7 +437,7 @@ def update_instructions(
     """
     try:
         updated_instruction = features.recipes.operations.update_instruction(
-            recipe_id, instruction_id, **patch_instruction_input_model.model_dump(), user=user
+            recipe_id, instruction_id, **patch_instruction_input_model.model_dump(), user=user, session=session
         )
         return updated_instruction
     except features.recipes.exceptions.InstructionNotFoundException:
@@ -275,6 +460,7 @@ def update_instructions(
 @recipes_router.post("/{recipe_id}/instructions/", response_model=InstructionResponse)
 def create_instruction(
     user: common.authentication.authenticated_user,
+    session: db.connection.db_session,
     recipe_id: int = fastapi.Path(),
     create_instruction_input_model: CreateInstructionInputModel = fastapi.Body(),
 ):
@@ -282,13 +468,14 @@ def create_instruction(
     Create instructions
 
     :param user:
+    :param session:
     :param recipe_id:
     :param create_instruction_input_model:
     :return:
     """
     try:
         updated_instruction = features.recipes.operations.create_instruction(
-            recipe_id, create_instruction_input_model, user=user
+            recipe_id, create_instruction_input_model, user=user, session=session
         )
         return updated_instruction
     except features.recipes.exceptions.RecipeNotFoundException:
@@ -304,6 +491,7 @@ def create_instruction(
 )
 def delete_instruction(
     user: common.authentication.authenticated_user,
+    session: db.connection.db_session,
     recipe_id: int = fastapi.Path(),
     instruction_id: int = fastapi.Path(),
 ):
@@ -311,12 +499,13 @@ def delete_instruction(
     Delete instruction
 
     :param user:
+    :param session:
     :param recipe_id:
     :param instruction_id:
     :return:
     """
     try:
-        features.recipes.operations.delete_instruction(recipe_id, instruction_id, user)
+        features.recipes.operations.delete_instruction(recipe_id, instruction_id, user, session=session)
     except features.recipes.exceptions.InstructionNotFoundException:
         raise fastapi.HTTPException(
             status_code=fastapi.status.HTTP_404_NOT_FOUND,
@@ -335,17 +524,18 @@ def delete_instruction(
 
 
 @recipes_router.delete("/{recipe_id}", response_model=RecipeResponse)
-def delete_recipe(recipe_id: int, user: common.authentication.authenticated_user):
+def delete_recipe(recipe_id: int, user: common.authentication.authenticated_user, session: db.connection.db_session):
     """
     Delete recipe
 
     :param recipe_id
     :param user
+    :param session
     :return:
     """
 
     try:
-        return features.recipes.operations.delete_recipe(recipe_id=recipe_id, deleted_by=user)
+        return features.recipes.operations.delete_recipe(recipe_id=recipe_id, deleted_by=user, session=session)
     except features.recipes.exceptions.RecipeNotFoundException:
         raise fastapi.HTTPException(
             status_code=fastapi.status.HTTP_404_NOT_FOUND,
@@ -356,20 +546,22 @@ def delete_recipe(recipe_id: int, user: common.authentication.authenticated_user
 @recipes_router.post("/{recipe_id}/ingredients/", status_code=fastapi.status.HTTP_201_CREATED)
 def add_ingredient_to_recipe(
     user: common.authentication.authenticated_user,
+    session: db.connection.db_session,
     recipe_id: int = fastapi.Path(),
     input_ingredient: RecipeIngredientInputModel = fastapi.Body(),
 ):
     """
     Add ingredient to recipe
     :param user:
+    :param session:
     :param recipe_id:
     :param input_ingredient:
     :return:
     """
     try:
-        recipe = features.recipes.operations.get_recipe_by_id(recipe_id, user)
-        ingredient = features.recipes.operations.get_ingredient_from_db(pk=input_ingredient.ingredient_id)
-        features.recipes.operations.add_ingredient_to_recipe(recipe.id, ingredient.id, input_ingredient.quantity, user)
+        features.recipes.operations.add_ingredient_to_recipe(
+            recipe_id, input_ingredient.ingredient_id, input_ingredient.quantity, user, session=session
+        )
     except features.recipes.exceptions.RecipeNotFoundException:
         raise fastapi.HTTPException(
             status_code=fastapi.status.HTTP_400_BAD_REQUEST,
@@ -390,20 +582,24 @@ def add_ingredient_to_recipe(
 @recipes_router.delete("/{recipe_id}/ingredients/{ingredient_id}", status_code=fastapi.status.HTTP_204_NO_CONTENT)
 def remove_ingredient_from_recipe(
     user: common.authentication.authenticated_user,
+    session: db.connection.db_session,
     recipe_id: int = fastapi.Path(),
     ingredient_id: int = fastapi.Path(),
 ):
     """
     Remove ingredient from recipe
     :param user:
+    :param session:
     :param recipe_id:
     :param ingredient_id:
     :return:
     """
     try:
-        recipe = features.recipes.operations.get_recipe_by_id(recipe_id=recipe_id, user=user)
-        ingredient = features.recipes.operations.get_ingredient_from_db(pk=ingredient_id)
-        features.recipes.operations.remove_ingredient_from_recipe(recipe=recipe, ingredient=ingredient, user=user)
+        recipe = features.recipes.operations.get_recipe_by_id(recipe_id=recipe_id, user=user, session=session)
+        ingredient = features.recipes.operations.get_ingredient_from_db(pk=ingredient_id, session=session)
+        features.recipes.operations.remove_ingredient_from_recipe(
+            recipe=recipe, ingredient=ingredient, user=user, session=session
+        )
     except features.recipes.exceptions.RecipeNotFoundException:
         raise fastapi.HTTPException(
             status_code=fastapi.status.HTTP_400_BAD_REQUEST,
@@ -425,54 +621,78 @@ def remove_ingredient_from_recipe(
 def create_ingredient(
     ingredient_input_model: IngredientInput,
     created_by: common.authentication.authenticated_user,
+    session: db.connection.db_session,
 ):
     """
     Create ingredient
     :param ingredient_input_model:
     :param created_by:
+    :param session:
     :return:
     """
     new_ingredient = features.recipes.operations.create_or_get_ingredient(
-        ingredient=ingredient_input_model, created_by=created_by.id
+        ingredient=ingredient_input_model, created_by=created_by.id, session=session
     )
     return new_ingredient
 
 
 @ingredient_router.get("/", response_model=list[IngredientResponse])
-def get_all_ingredients():
+def get_all_ingredients(session: db.connection.db_session):
     """
     Get all ingredients
 
+    :param session:
     :return:
     """
-    all_ingredients = features.recipes.operations.get_all_ingredients_from_db()
+    all_ingredients = features.recipes.operations.get_all_ingredients_from_db(session=session)
     return all_ingredients
 
 
+@ingredient_router.get("/suggest", response_model=list[IngredientResponse])
+def suggest_ingredients(
+    session: db.connection.db_session,
+    q: str = fastapi.Query(min_length=1, max_length=100),
+    limit: int = fastapi.Query(default=10, gt=0, le=50),
+):
+    """
+    Get the ingredients with names most similar to the query, for autocomplete
+
+    :param session:
+    :param q:
+    :param limit:
+    :return:
+    """
+    return features.recipes.operations.suggest_ingredients(q, limit, session=session)
+
+
 @ingredient_router.get("/{ingredient_id}", response_model=IngredientResponse)
-def get_ingredient(ingredient_id: int = fastapi.Path()):
+def get_ingredient(session: db.connection.db_session, ingredient_id: int = fastapi.Path()):
     """
     Get ingredient by id
 
+    :param session
     :param ingredient_id
     :return:
     """
-    ingredient = features.recipes.operations.get_ingredient_from_db(pk=ingredient_id)
+    ingredient = features.recipes.operations.get_ingredient_from_db(pk=ingredient_id, session=session)
     return ingredient
 
 
 @ingredient_router.delete("/{ingredient_id}", status_code=fastapi.status.HTTP_204_NO_CONTENT)
-def delete_ingredient(ingredient_id: int, user: common.authentication.authenticated_user):
+def delete_ingredient(
+    ingredient_id: int, user: common.authentication.authenticated_user, session: db.connection.db_session
+):
     """
     Delete ingredient
 
     :param ingredient_id:
     :param user:
+    :param session:
     :return:
     """
 
     try:
-        features.recipes.operations.delete_ingredient(ingredient_id, user)
+        features.recipes.operations.delete_ingredient(ingredient_id, user, session=session)
     except features.recipes.exceptions.IngredientDoesNotExistException as e:
         raise fastapi.HTTPException(status_code=fastapi.status.HTTP_404_NOT_FOUND, detail=e.text)
 
@@ -480,6 +700,7 @@ def delete_ingredient(ingredient_id: int, user: common.authentication.authentica
 @ingredient_router.patch("/{ingredient_id}", response_model=IngredientResponse)
 def patch_ingredient(
     user: common.authentication.authenticated_user,
+    session: db.connection.db_session,
     ingredient_id: int = fastapi.Path(),
     update_ingredient_input_model: UpdateIngredientInputModel = fastapi.Body(),
 ):
@@ -487,6 +708,7 @@ def patch_ingredient(
     Update ingredient
 
     :param user:
+    :param session:
     :param ingredient_id:
     :param update_ingredient_input_model:
     :return:
@@ -494,7 +716,11 @@ def patch_ingredient(
 
     try:
         ingredient = features.recipes.operations.update_ingredient(
-            ingredient_id, update_ingredient_input_model.field, update_ingredient_input_model.value, updated_by=user.id
+            ingredient_id,
+            update_ingredient_input_model.field,
+            update_ingredient_input_model.value,
+            updated_by=user.id,
+            session=session,
         )
         return ingredient
     except features.recipes.exceptions.IngredientDoesNotExistException as e:
@@ -515,7 +741,7 @@ async def websocket_endpoint(websocket: WebSocket, instruction_id: int = fastapi
     try:
         if not audio_files_path.is_dir():
             raise FileNotFoundError()
-        instruction = features.recipes.operations.get_instruction_by_id(instruction_id)
+        instruction = await features.recipes.operations.get_instruction_by_id_async(instruction_id)
         if not instruction.audio_file:
             raise FileNotFoundError()
         async with aiofiles.open(audio_files_path.joinpath(instruction.audio_file), mode="rb") as audio_file:
@@ -6,10 +6,13 @@ from features.recipes.operations import (
     patch_recipe,
     create_or_get_ingredient,
     create_recipe,
+    import_recipes,
     get_all_recipe_categories,
     get_all_ingredients_from_db,
+    RECIPE_TASK_OPTIONS,
 )
 from features.recipes.exceptions import CategoryNameViolationException
+from features.recipes.helpers import invalidate_recipes_count
 from features.users.operations import get_user_from_db
 from features.recipes.models import Recipe, RecipeInstruction
 from features.recipes.input_models import (
@@ -26,9 +29,12 @@ from openai import OpenAI
 from datetime import datetime, timedelta
 from typing import Type, Tuple
 from gtts import gTTS
+import diskcache
 
 logging = khLogging.Logger("celery-recipes-tasks")
 
+IMPORTS_PROGRESS = diskcache.Cache(directory=configuration.CACHE_PATH.joinpath('imports'), disk=diskcache.JSONDisk)
+
 
 @celery.task
 def seed_recipe_categories():
@@ -68,6 +74,7 @@ def _get_recipes_for_summary_generation() -> list[Type[Recipe]]:
                     ),
                 )
             )
+            .options(*RECIPE_TASK_OPTIONS)
             .all()
         )
 
@@ -243,11 +250,12 @@ def generate_recipes(count: int = 1):
     recipes_categories_to_id = _get_category_to_id_mapping()
     ingredients_name_to_id = _get_ingredient_to_id_mapping()
     existing_recipes = _get_recipe_names()
+    system_user_id = get_system_user_id()
     logging.info("Start generate recipe")
     recipes_added = []
     for _ in range(count):
         try:
-            recipe_ingredient_input_models = []
+            recipe_ingredient_quantities = {}
             recipe_instruction_input_models = []
             recipe_response = _get_recipe(excluded_names=existing_recipes)
             name, category, serves, instructions, ingredients = _parse_chatgpt_recipe_response(recipe_response)
@@ -258,26 +266,32 @@ def generate_recipes(count: int = 1):
             existing_recipes.append(name)
             category_id = recipes_categories_to_id.get(category.upper())
             if not category_id:
-                new_category = create_category(category, get_system_user_id())
+                new_category = create_category(category, system_user_id)
                 category_id = new_category.id
                 recipes_categories_to_id[category.upper()] = category_id
             for _ingredient in ingredients:
                 ingredient_id = ingredients_name_to_id.get(_ingredient.get('name').upper())
                 if not ingredient_id:
-                    ingredient = create_or_get_ingredient(IngredientInput(**_ingredient), get_system_user_id())
+                    ingredient = create_or_get_ingredient(IngredientInput(**_ingredient), system_user_id)
+                    # a close match may be reused under another name
                     ingredients_name_to_id[ingredient.name.upper()] = ingredient.id
+                    ingredients_name_to_id[_ingredient.get('name').upper()] = ingredient.id
                     ingredient_id = ingredient.id
-                recipe_ingredient_input_models.append(
-                    RecipeIngredientInputModel(
-                        ingredient_id=ingredient_id, quantity=float(_ingredient.get("quantity", 0))
-                    )
+                # the ingredients are attached at once, the repeated ones are merged
+                quantity = float(_ingredient.get("quantity", 0))
+                recipe_ingredient_quantities[ingredient_id] = (
+                    recipe_ingredient_quantities.get(ingredient_id, 0) + quantity
                 )
+            recipe_ingredient_input_models = [
+                RecipeIngredientInputModel(ingredient_id=ingredient_id, quantity=quantity)
+                for ingredient_id, quantity in recipe_ingredient_quantities.items()
+            ]
             for instruction in instructions:
                 recipe_instruction_input_models.append(CreateInstructionInputModel(**instruction))
 
             recipe = create_recipe(
                 name=name,
-                created_by=AuthenticatedUser(id=get_system_user_id()),
+                created_by=AuthenticatedUser(id=system_user_id),
                 category_id=category_id,
                 serves=serves,
                 instructions=recipe_instruction_input_models,
@@ -297,10 +311,70 @@ def generate_recipes(count: int = 1):
                     {
                         "is_published": True,
                         "published_on": datetime.utcnow(),
-                        "published_by": get_system_user_id(),
-                        "updated_by": get_system_user_id(),
+                        "published_by": system_user_id,
+                        "updated_by": system_user_id,
                     }
                 )
                 .where(Recipe.id.in_(recipes_added))
             )
+            invalidate_recipes_count(session)
             session.commit()
+
+
+def set_import_progress(task_id: str, state: str, report: dict | None = None, only_new: bool = False):
+    """
+    Store the progress of an import task where the API workers can read it, the celery rpc backend keeps no state
+
+    :param task_id:
+    :param state:
+    :param report: imported and failed counts and the first errors
+    :param only_new: keep the stored progress if the task already reported one
+    :return:
+    """
+    progress = {'state': state, **(report or {})}
+    expire = configuration.Config().recipes_import.progress_ttl
+    if only_new:
+        IMPORTS_PROGRESS.add(task_id, progress, expire=expire)
+    else:
+        IMPORTS_PROGRESS.set(task_id, progress, expire=expire)
+
+
+def get_import_progress(task_id: str) -> dict | None:
+    """
+    Get the stored progress of an import task
+
+    :param task_id:
+    :return: state with the imported and failed counts and the first errors, None for unknown tasks
+    """
+    return IMPORTS_PROGRESS.get(task_id)
+
+
+@celery.task(bind=True)
+def import_recipes_file(self, file_name: str, user_id: int) -> dict:
+    """
+    Celery task importing the recipes of an uploaded NDJSON file, the progress is reported after every chunk
+
+    :param file_name: name of the file in the imports folder, it is deleted afterwards
+    :param user_id:
+    :return: import report
+    """
+    file_path = configuration.IMPORTS_PATH.joinpath(file_name)
+    task_id = self.request.id
+    last_report = {}
+
+    def _progress(report: dict):
+        last_report.update(report)
+        set_import_progress(task_id, 'PROGRESS', report)
+
+    logging.info(f"Start importing recipes from {file_name}")
+    set_import_progress(task_id, 'PROGRESS')
+    try:
+        with file_path.open("rb") as file:
+            report = import_recipes(file, AuthenticatedUser(id=user_id), progress=_progress)
+    except Exception:
+        set_import_progress(task_id, 'FAILURE', last_report)
+        raise
+    finally:
+        file_path.unlink(missing_ok=True)
+    set_import_progress(task_id, 'SUCCESS', report)
+    return report
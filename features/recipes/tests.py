@@ -1,16 +1,37 @@
+import csv
+import json
 import unittest.mock
+import uuid
 
+import grpc
 import pytest
+import sqlalchemy.exc
+import sqlalchemy.orm
+from sqlalchemy.orm import selectinload
 
 import common.authentication
+import common.cache
+import common.grpc_client
+import configuration
 import db.connection
-from features.recipes.input_models import CreateInstructionInputModel
-from tests.fixtures import use_test_db, admin, user
+import features.images.tasks
+import features.recipes.responses
+import features.recipes.router
+import features.recipes.tasks
+from features.recipes.input_models import (
+    CreateInstructionInputModel,
+    IngredientInput,
+    RecipeIngredientInputModel,
+    PatchRecipeInputModel,
+    PSFRecipesInputModel,
+)
+from tests.fixtures import use_test_db, admin, user, query_plans
 from features.recipes import operations
-from features.recipes.models import RecipeCategory, RecipeInstruction, Recipe
+from features.recipes.models import Ingredient, RecipeCategory, RecipeInstruction, Recipe
 from features.recipes.exceptions import (
     CategoryNameViolationException,
     CategoryNotFoundException,
+    IngredientDoesNotExistException,
 )
 from fastapi.testclient import TestClient
 from api import app
@@ -23,6 +44,22 @@ def bypass_published_filter(mocker):
     yield
 
 
+def _create_ingredient(name: str, measurement: str = "g", category: str = "dairy", created_by: int = 1) -> Ingredient:
+    return operations.create_or_get_ingredient(
+        IngredientInput(
+            name=name,
+            calories=1,
+            carbo=1,
+            fats=1,
+            protein=1,
+            cholesterol=1,
+            measurement=measurement,
+            category=category,
+        ),
+        created_by=created_by,
+    )
+
+
 class TestCategoryOperations:
     def test_create_category_success(self, use_test_db, mocker):
         expected_name = "new_category"
@@ -61,6 +98,24 @@ class TestCategoryOperations:
         updated_category = operations.get_category_by_id_or_name(category_id=created_category.id)
         assert updated_category.name == "new_name"
 
+    def test_categories_are_cached_until_changed(self, use_test_db, query_plans):
+        operations.create_category("first", 1)
+        assert len(operations.get_all_recipe_categories()) == 1
+        queries = len(query_plans)
+        assert len(operations.get_all_recipe_categories()) == 1
+        assert len(query_plans) == queries
+
+        operations.create_category("second", 1)
+        assert len(operations.get_all_recipe_categories()) == 2
+
+    def test_categories_cache_invalidated_in_other_workers(self, use_test_db):
+        worker_cache = common.cache.SharedTTLCache('categories', 10, 60, check_interval=0)
+        worker_cache.set('all', ['stale'])
+        assert worker_cache.get('all') == ['stale']
+
+        operations.create_category("new", 1)
+        assert worker_cache.get('all') is None
+
 
 class TestCategoriesEndpoints:
     client = TestClient(app)
@@ -87,7 +142,7 @@ class TestCategoriesEndpoints:
         get_category_spy = mocker.spy(operations, "get_category_by_id_or_name")
         response = cls.client.get(f"/api/categories/{created_category.id}")
         assert response.status_code == 200
-        get_category_spy.assert_called_with(category_id=created_category.id)
+        get_category_spy.assert_called_with(category_id=created_category.id, session=unittest.mock.ANY)
 
     @classmethod
     def test_patch_category(cls, use_test_db, mocker, admin):
@@ -100,7 +155,9 @@ class TestCategoriesEndpoints:
             headers={"Authorization": "Bearer token"},
         )
         assert response.status_code == 200
-        update_category_spy.assert_called_with(category_id=1, field="name", value="updated", updated_by=1)
+        update_category_spy.assert_called_with(
+            category_id=1, field="name", value="updated", updated_by=1, session=unittest.mock.ANY
+        )
 
 
 class TestInstructionsOperations:
@@ -120,8 +177,8 @@ class TestInstructionsOperations:
         operations.create_recipe(**self.recipe, created_by=user)
 
         with db.connection.get_session() as session:
-            recipes = session.query(Recipe).all()
-            recipe = session.query(Recipe).first()
+            recipes = session.query(Recipe).options(selectinload(Recipe.instructions)).all()
+            recipe = recipes[0]
         assert len(recipes) == 1
         assert len(recipe.instructions) == 0
 
@@ -146,8 +203,8 @@ class TestInstructionsOperations:
         operations.create_recipe(**self.recipe, created_by=user)
 
         with db.connection.get_session() as session:
-            recipes = session.query(Recipe).all()
-            recipe = session.query(Recipe).first()
+            recipes = session.query(Recipe).options(selectinload(Recipe.instructions)).all()
+            recipe = recipes[0]
         assert len(recipes) == 1
         assert len(recipe.instructions) == 2
         assert recipes[0].time_to_prepare == 20
@@ -298,7 +355,12 @@ class TestInstructionsEndpoints:
         )
         assert response.status_code == 200
         update_instruction_spy.assert_called_with(
-            recipe_id=1, instruction_id=1, field="instruction", value="updated", user=unittest.mock.ANY
+            recipe_id=1,
+            instruction_id=1,
+            field="instruction",
+            value="updated",
+            user=unittest.mock.ANY,
+            session=unittest.mock.ANY,
         )
 
     def test_patch_instruction_with_wrong_field_fail(self, use_test_db, mocker, bypass_published_filter, user):
@@ -331,7 +393,9 @@ class TestInstructionsEndpoints:
             f"/api/recipes/{created_recipe.id}/instructions/{created_instruction.id}", headers=headers
         )
         assert response.status_code == 204
-        delete_instruction_spy.assert_called_with(recipe_id=1, instruction_id=1, user=unittest.mock.ANY)
+        delete_instruction_spy.assert_called_with(
+            recipe_id=1, instruction_id=1, user=unittest.mock.ANY, session=unittest.mock.ANY
+        )
 
     def test_delete_instruction_with_non_existing_recipe_fail(self, use_test_db, mocker, bypass_published_filter, user):
         operations.create_category("Category", 1)
@@ -344,7 +408,9 @@ class TestInstructionsEndpoints:
         headers = {"Authorization": "Bearer token"}
         response = self.client.delete(f"/api/recipes/{2}/instructions/{created_instruction.id}", headers=headers)
         assert response.status_code == 404
-        delete_instruction_spy.assert_called_with(recipe_id=2, instruction_id=1, user=unittest.mock.ANY)
+        delete_instruction_spy.assert_called_with(
+            recipe_id=2, instruction_id=1, user=unittest.mock.ANY, session=unittest.mock.ANY
+        )
 
     def test_delete_instruction_with_non_existing_instruction_fail(
         self, use_test_db, mocker, bypass_published_filter, user
@@ -359,7 +425,9 @@ class TestInstructionsEndpoints:
         headers = {"Authorization": "Bearer token"}
         response = self.client.delete(f"/api/recipes/{created_recipe.id}/instructions/{2}", headers=headers)
         assert response.status_code == 404
-        delete_instruction_spy.assert_called_with(recipe_id=1, instruction_id=2, user=unittest.mock.ANY)
+        delete_instruction_spy.assert_called_with(
+            recipe_id=1, instruction_id=2, user=unittest.mock.ANY, session=unittest.mock.ANY
+        )
 
     def test_delete_instruction_with_wrong_recipe_fail(self, use_test_db, mocker, bypass_published_filter, user):
         operations.create_category("Category", 1)
@@ -376,4 +444,694 @@ class TestInstructionsEndpoints:
         headers = {"Authorization": "Bearer token"}
         response = self.client.delete(f"/api/recipes/{1}/instructions/{2}", headers=headers)
         assert response.status_code == 404
-        delete_instruction_spy.assert_called_with(recipe_id=1, instruction_id=2, user=unittest.mock.ANY)
+        delete_instruction_spy.assert_called_with(
+            recipe_id=1, instruction_id=2, user=unittest.mock.ANY, session=unittest.mock.ANY
+        )
+
+
+class TestRecipeSummaryOperations:
+    def setup(self):
+        self.recipe = {
+            "name": "name",
+            "category_id": 1,
+            "picture": None,
+            "serves": 4,
+            "summary": "summary",
+            "instructions": [],
+            "ingredients": [],
+        }
+        self.ingredient = {
+            "name": "egg",
+            "calories": 10,
+            "carbo": 1,
+            "fats": 2,
+            "protein": 3,
+            "cholesterol": 4,
+            "measurement": "g",
+            "category": "dairy",
+        }
+
+    def test_recipe_summary_follows_ingredient_changes(self, use_test_db, bypass_published_filter, user):
+        operations.create_category("Category", 1)
+        ingredient = operations.create_or_get_ingredient(IngredientInput(**self.ingredient), created_by=user.id)
+        self.recipe["ingredients"] = [RecipeIngredientInputModel(ingredient_id=ingredient.id, quantity=2)]
+        recipe = operations.create_recipe(**self.recipe, created_by=user)
+        assert recipe.calories == 20
+        assert recipe.proteins == 6
+
+        operations.update_ingredient(ingredient.id, "calories", 15, updated_by=user.id)
+        assert operations.get_recipe_by_id(recipe.id).calories == 30
+
+        operations.remove_ingredient_from_recipe(recipe, ingredient, user)
+        assert operations.get_recipe_by_id(recipe.id).calories == 0
+
+    def test_recipe_summary_follows_instruction_changes(self, use_test_db, bypass_published_filter, user):
+        operations.create_category("Category", 1)
+        recipe = operations.create_recipe(**self.recipe, created_by=user)
+        instruction = {"instruction": "instruction", "category": "Boil", "time": 10, "complexity": 2}
+        created = operations.create_instruction(recipe.id, CreateInstructionInputModel(**instruction), user)
+        operations.create_instruction(recipe.id, CreateInstructionInputModel(**instruction), user)
+        assert operations.get_recipe_by_id(recipe.id).time_to_prepare == 20
+
+        operations.update_instruction(recipe.id, created.id, "complexity", 5, user)
+        assert operations.get_recipe_by_id(recipe.id).complexity == 3.5
+
+        operations.delete_instruction(recipe.id, created.id, user)
+        updated_recipe = operations.get_recipe_by_id(recipe.id)
+        assert updated_recipe.time_to_prepare == 10
+        assert updated_recipe.complexity == 2
+
+
+class TestRecipesEndpoints:
+    def setup(self):
+        self.client = TestClient(app)
+        self.recipe = {
+            "name": "name",
+            "category_id": 1,
+            "picture": None,
+            "serves": 4,
+            "summary": "summary",
+            "instructions": [],
+            "ingredients": [],
+        }
+
+    def test_patch_recipe_uses_single_session(self, use_test_db, mocker, bypass_published_filter, user):
+        operations.create_category("Category", 1)
+        created_recipe = operations.create_recipe(**self.recipe, created_by=user)
+
+        get_session_spy = mocker.spy(db.connection, "get_session")
+        response = self.client.patch(
+            f"/api/recipes/{created_recipe.id}",
+            json={"field": "name", "value": "new name"},
+            headers={'Authorization': 'Bearer token'},
+        )
+        assert response.status_code == 200
+        assert response.json()["name"] == "new name"
+        assert get_session_spy.call_count == 1
+
+    def test_get_recipe_reads_with_async_session(self, use_test_db, mocker, bypass_published_filter, user):
+        operations.create_category("Category", 1)
+        created_recipe = operations.create_recipe(**self.recipe, created_by=user)
+
+        get_session_spy = mocker.spy(db.connection, "get_session")
+        get_async_session_spy = mocker.spy(db.connection, "get_async_session")
+        response = self.client.get(f"/api/recipes/{created_recipe.id}", headers={'Authorization': 'Bearer token'})
+        assert response.status_code == 200
+        assert response.json()["name"] == self.recipe["name"]
+        assert get_session_spy.call_count == 0
+        assert get_async_session_spy.call_count == 1
+
+    def test_recipe_endpoints_load_the_serialized_graph(self, use_test_db, mocker, bypass_published_filter, user):
+        mocker.patch("features.recipes.helpers.get_usernames", return_value={})
+        mocker.patch("features.recipes.helpers.get_image_urls", return_value={})
+        mocker.patch("features.recipes.responses._get_username", return_value="username")
+        operations.create_category("Category", 1)
+        ingredient = operations.create_or_get_ingredient(
+            IngredientInput(
+                name="egg",
+                calories=10,
+                carbo=1,
+                fats=2,
+                protein=3,
+                cholesterol=4,
+                measurement="g",
+                category="dairy",
+            ),
+            created_by=user.id,
+        )
+        self.recipe["instructions"] = [{"instruction": "boil", "category": "Boil", "time": 10, "complexity": 2}]
+        self.recipe["ingredients"] = [{"ingredient_id": ingredient.id, "quantity": 2}]
+
+        response = self.client.post("/api/recipes/", json=self.recipe, headers={'Authorization': 'Bearer token'})
+        assert response.status_code == 200
+        recipe_id = response.json()["id"]
+
+        for response in (
+            self.client.get(f"/api/recipes/{recipe_id}", headers={'Authorization': 'Bearer token'}),
+            self.client.get("/api/recipes/", headers={'Authorization': 'Bearer token'}),
+        ):
+            assert response.status_code == 200
+            recipe = response.json().get("recipes", [response.json()])[0]
+            assert recipe["category"]["name"] == "Category"
+            assert [instruction["instruction"] for instruction in recipe["instructions"]] == ["boil"]
+            assert [ingredient["name"] for ingredient in recipe["ingredients"]] == ["egg"]
+
+        categories = operations.get_all_recipe_categories()
+        with pytest.raises(sqlalchemy.exc.InvalidRequestError):
+            categories[0].recipes
+
+    def test_get_all_recipes_resolves_references_once_per_page(
+        self, use_test_db, mocker, bypass_published_filter, user
+    ):
+        operations.create_category("Category", 1)
+        for _ in range(3):
+            operations.create_recipe(**self.recipe, created_by=user)
+
+        get_usernames_mock = mocker.patch("features.recipes.helpers.get_usernames", return_value={user.id: "username"})
+        get_image_urls_mock = mocker.patch("features.recipes.helpers.get_image_urls", return_value={})
+        get_username_mock = mocker.patch("features.recipes.responses._get_username")
+        response = self.client.get("/api/recipes/", headers={'Authorization': 'Bearer token'})
+        assert response.status_code == 200
+        assert [recipe["created_by"] for recipe in response.json()["recipes"]] == ["username"] * 3
+        assert get_usernames_mock.call_count == 1
+        assert get_image_urls_mock.call_count == 1
+        get_username_mock.assert_not_called()
+
+    def test_get_all_recipes_filters_and_sorts_by_stored_summary(
+        self, use_test_db, mocker, bypass_published_filter, user
+    ):
+        mocker.patch("features.recipes.helpers.get_usernames", return_value={})
+        mocker.patch("features.recipes.helpers.get_image_urls", return_value={})
+        operations.create_category("Category", 1)
+        ingredient = operations.create_or_get_ingredient(
+            IngredientInput(
+                name="egg",
+                calories=10,
+                carbo=1,
+                fats=2,
+                protein=3,
+                cholesterol=4,
+                measurement="g",
+                category="dairy",
+            ),
+            created_by=user.id,
+        )
+        for name, quantity in (("light", 1), ("medium", 2), ("heavy", 5)):
+            self.recipe["name"] = name
+            self.recipe["ingredients"] = [RecipeIngredientInputModel(ingredient_id=ingredient.id, quantity=quantity)]
+            operations.create_recipe(**self.recipe, created_by=user)
+
+        response = self.client.get(
+            "/api/recipes/",
+            params={"filters": "calories:0-25", "sort": "calories:desc"},
+            headers={'Authorization': 'Bearer token'},
+        )
+        assert response.status_code == 200
+        assert [recipe["name"] for recipe in response.json()["recipes"]] == ["medium", "light"]
+
+    def test_get_all_recipes_full_text_search(self, use_test_db, mocker, bypass_published_filter, user):
+        mocker.patch("features.recipes.helpers.get_usernames", return_value={})
+        mocker.patch("features.recipes.helpers.get_image_urls", return_value={})
+        operations.create_category("Category", 1)
+        for name, summary in (
+            ("Chicken curry", "Spicy chicken curry with rice"),
+            ("Beef stew", "Slow cooked, goes well with curry bread"),
+            ("Chickpea salad", "Fresh salad"),
+        ):
+            self.recipe["name"], self.recipe["summary"] = name, summary
+            operations.create_recipe(**self.recipe, created_by=user)
+
+        def search(filters):
+            response = self.client.get(
+                "/api/recipes/", params={"filters": filters}, headers={'Authorization': 'Bearer token'}
+            )
+            assert response.status_code == 200
+            return [recipe["name"] for recipe in response.json()["recipes"]]
+
+        assert search("search:any-curry") == ["Chicken curry", "Beef stew"]
+        assert search("search:any-chick curry") == ["Chicken curry"]
+        assert sorted(search("search:title-chick")) == ["Chicken curry", "Chickpea salad"]
+        assert search("search:summary-fresh") == ["Chickpea salad"]
+
+        params = {"filters": "search:any-curry", "cursor": "", "page_size": 1}
+        response = self.client.get("/api/recipes/", params=params, headers={'Authorization': 'Bearer token'})
+        params["cursor"] = response.json()["next_cursor"]
+        response = self.client.get("/api/recipes/", params=params, headers={'Authorization': 'Bearer token'})
+        assert [recipe["name"] for recipe in response.json()["recipes"]] == ["Beef stew"]
+
+        operations.patch_recipe(
+            recipe_id=3, patch_input_model=PatchRecipeInputModel(field="name", value="Lentil salad"), patched_by=user
+        )
+        assert search("search:title-chick") == ["Chicken curry"]
+
+    def test_get_all_recipes_by_cursor(self, use_test_db, mocker, bypass_published_filter, user):
+        mocker.patch("features.recipes.helpers.get_usernames", return_value={})
+        mocker.patch("features.recipes.helpers.get_image_urls", return_value={})
+        operations.create_category("Category", 1)
+        for name in ("b", "a", "c", "a", "d"):
+            self.recipe["name"] = name
+            operations.create_recipe(**self.recipe, created_by=user)
+
+        names = []
+        params = {"cursor": "", "page_size": 2, "sort": "name:asc"}
+        for _ in range(3):
+            response = self.client.get("/api/recipes/", params=params, headers={'Authorization': 'Bearer token'})
+            assert response.status_code == 200
+            assert response.json()["total_items"] is None
+            names.extend(recipe["name"] for recipe in response.json()["recipes"])
+            params["cursor"] = response.json()["next_cursor"]
+        assert names == ["a", "a", "b", "c", "d"]
+        assert params["cursor"] is None
+
+        response = self.client.get(
+            "/api/recipes/",
+            params={"cursor": "", "page_size": 2, "count": "exact"},
+            headers={'Authorization': 'Bearer token'},
+        )
+        assert response.json()["total_items"] == 5
+        assert response.json()["total_pages"] == 3
+
+        response = self.client.get(
+            "/api/recipes/",
+            params={"cursor": response.json()["next_cursor"], "sort": "name:asc"},
+            headers={'Authorization': 'Bearer token'},
+        )
+        assert response.status_code == 422
+
+    def test_get_all_recipes_caches_total_count(self, use_test_db, mocker, bypass_published_filter, user):
+        mocker.patch("features.recipes.helpers.get_usernames", return_value={})
+        mocker.patch("features.recipes.helpers.get_image_urls", return_value={})
+        operations.create_category("Category", 1)
+        operations.create_recipe(**self.recipe, created_by=user)
+
+        response = self.client.get("/api/recipes/", headers={'Authorization': 'Bearer token'})
+        assert response.json()["total_items"] == 1
+
+        # added without the operations, the cached count is still used
+        with db.connection.get_session() as session:
+            session.add(Recipe(name="hidden", created_by=user.id, serves=1))
+            session.commit()
+        response = self.client.get("/api/recipes/", headers={'Authorization': 'Bearer token'})
+        assert response.json()["total_items"] == 1
+        response = self.client.get(
+            "/api/recipes/", params={"count": "estimate"}, headers={'Authorization': 'Bearer token'}
+        )
+        assert response.json()["total_items"] == 1
+
+        worker_cache = common.cache.SharedTTLCache('recipes_count', 10, 60, check_interval=0)
+        worker_cache.set('|', 1)
+        operations.create_recipe(**self.recipe, created_by=user)
+        response = self.client.get("/api/recipes/", headers={'Authorization': 'Bearer token'})
+        assert response.json()["total_items"] == 3
+        # the counts cached by the other workers are dropped as well
+        assert worker_cache.get('|') is None
+
+    def test_get_recipes_by_pantry(self, use_test_db, mocker, bypass_published_filter, user):
+        mocker.patch("features.recipes.helpers.get_usernames", return_value={})
+        mocker.patch("features.recipes.helpers.get_image_urls", return_value={})
+        operations.create_category("Category", 1)
+        egg, milk, flour = (_create_ingredient(name) for name in ("egg", "milk", "flour"))
+        recipe_ingredients = {"omelette": [egg, milk], "pancakes": [egg, milk, flour], "bread": [flour]}
+        recipes = {}
+        for name, ingredients in recipe_ingredients.items():
+            self.recipe["name"] = name
+            self.recipe["ingredients"] = [
+                RecipeIngredientInputModel(ingredient_id=ingredient.id, quantity=1) for ingredient in ingredients
+            ]
+            recipes[name] = operations.create_recipe(**self.recipe, created_by=user)
+
+        params = {"ingredient_id": [egg.id, milk.id]}
+        response = self.client.get("/api/recipes/pantry", params=params, headers={'Authorization': 'Bearer token'})
+        assert response.status_code == 200
+        assert [(r["recipe"]["name"], r["coverage"], r["missing_ingredients"]) for r in response.json()] == [
+            ("omelette", 1.0, []),
+            ("pancakes", 0.6667, [flour.id]),
+        ]
+
+        # the index is refreshed with the changed recipes
+        operations.add_ingredient_to_recipe(recipes["bread"].id, egg.id, 1, user=user)
+        response = self.client.get(
+            "/api/recipes/pantry", params={**params, "limit": 5}, headers={'Authorization': 'Bearer token'}
+        )
+        assert [r["recipe"]["name"] for r in response.json()] == ["omelette", "pancakes", "bread"]
+
+        response = self.client.get(
+            "/api/recipes/pantry", params={**params, "limit": 1}, headers={'Authorization': 'Bearer token'}
+        )
+        assert [r["recipe"]["name"] for r in response.json()] == ["omelette"]
+
+    def test_rank_recipes_by_pantry_visibility(self, use_test_db, user):
+        operations.create_category("Category", 1)
+        egg, milk = (_create_ingredient(name) for name in ("egg", "milk"))
+        recipes = {}
+        for name, ingredients in {"omelette": [egg, milk], "scrambled eggs": [egg]}.items():
+            self.recipe["name"] = name
+            self.recipe["ingredients"] = [
+                RecipeIngredientInputModel(ingredient_id=ingredient.id, quantity=1) for ingredient in ingredients
+            ]
+            recipes[name] = operations.create_recipe(**self.recipe, created_by=user)
+
+        def _rank(ranking_user):
+            ranked = operations.rank_recipes_by_pantry([egg.id, milk.id], ranking_user)
+            return [recipe.name for recipe, _, _ in ranked]
+
+        assert _rank(None) == []
+        assert _rank(user) == ["omelette", "scrambled eggs"]
+
+        operations.patch_recipe(
+            recipe_id=recipes["omelette"].id,
+            patch_input_model=PatchRecipeInputModel(field="is_published", value="true"),
+            patched_by=user,
+        )
+        assert _rank(None) == ["omelette"]
+        # only the published recipes are indexed
+        assert operations.RECIPE_INGREDIENTS_INDEX.get(recipes["omelette"].id) == {egg.id, milk.id}
+        assert len(operations.RECIPE_INGREDIENTS_INDEX) == 1
+        assert _rank(common.authentication.AuthenticatedUser(id=2)) == ["omelette"]
+        assert _rank(user) == ["omelette", "scrambled eggs"]
+
+        operations.delete_recipe(recipe_id=recipes["scrambled eggs"].id, deleted_by=user)
+        assert _rank(user) == ["omelette"]
+        operations.patch_recipe(
+            recipe_id=recipes["omelette"].id,
+            patch_input_model=PatchRecipeInputModel(field="is_published", value="false"),
+            patched_by=user,
+        )
+        assert _rank(None) == []
+        assert _rank(user) == ["omelette"]
+
+    def test_create_recipe_attaches_ingredients_at_once(self, use_test_db, mocker, bypass_published_filter, user):
+        mocker.patch("features.recipes.helpers.get_usernames", return_value={})
+        mocker.patch("features.recipes.helpers.get_image_urls", return_value={})
+        mocker.patch("features.recipes.responses._get_username", return_value="username")
+        operations.create_category("Category", 1)
+        ingredients = [_create_ingredient(name) for name in ("egg", "milk", "flour")]
+
+        commit_spy = mocker.spy(sqlalchemy.orm.Session, "commit")
+        self.recipe["ingredients"] = [{"ingredient_id": ingredient.id, "quantity": 2} for ingredient in ingredients]
+        response = self.client.post("/api/recipes/", json=self.recipe, headers={'Authorization': 'Bearer token'})
+        assert response.status_code == 200
+        assert [ingredient["name"] for ingredient in response.json()["ingredients"]] == ["egg", "milk", "flour"]
+        assert response.json()["calories"] == 6
+        assert commit_spy.call_count == 1
+
+        for ingredient_ids, detail in (
+            ([ingredients[0].id, 999], "Ingredient with id 999 does not exist"),
+            ([ingredients[0].id, ingredients[0].id], "Ingredients of the recipe must not repeat"),
+        ):
+            self.recipe["ingredients"] = [
+                {"ingredient_id": ingredient_id, "quantity": 2} for ingredient_id in ingredient_ids
+            ]
+            response = self.client.post("/api/recipes/", json=self.recipe, headers={'Authorization': 'Bearer token'})
+            assert response.status_code == 400
+            assert response.json()["detail"] == detail
+        # the recipe is not created without its ingredients
+        with db.connection.get_session() as session:
+            assert session.query(Recipe).count() == 1
+
+    def test_export_recipes(self, use_test_db, user):
+        operations.create_category("Category", 1)
+        ingredients = [
+            _create_ingredient(name)
+            # the names may contain the characters of the CSV and list syntax
+            for name in ("egg", "milk|whole")
+        ]
+        self.recipe["ingredients"] = [
+            RecipeIngredientInputModel(ingredient_id=ingredient.id, quantity=1) for ingredient in ingredients
+        ]
+        published = operations.create_recipe(**self.recipe, created_by=user)
+        operations.patch_recipe(
+            recipe_id=published.id,
+            patch_input_model=PatchRecipeInputModel(field="is_published", value="true"),
+            patched_by=user,
+        )
+        self.recipe["ingredients"] = []
+        draft = operations.create_recipe(**self.recipe, created_by=user)
+
+        assert self.client.get("/api/recipes/export").status_code == 401
+        response = self.client.get("/api/recipes/export", headers={'Authorization': 'Bearer token'})
+        assert response.status_code == 200
+        assert response.headers["content-type"] == "application/x-ndjson"
+        rows = [json.loads(line) for line in response.text.splitlines()]
+        assert [row["id"] for row in rows] == [published.id, draft.id]
+        assert rows[0]["category"] == "Category"
+        assert rows[0]["ingredients"] == ["egg", "milk|whole"]
+        assert rows[0]["calories"] == 2
+
+        response = self.client.get(
+            "/api/recipes/export", params={"format": "CSV"}, headers={'Authorization': 'Bearer token'}
+        )
+        assert response.headers["content-type"].startswith("text/csv")
+        rows = list(csv.DictReader(response.text.splitlines()))
+        assert len(rows) == 2
+        assert tuple(rows[0]) == operations.RECIPE_EXPORT_FIELDS
+        assert json.loads(rows[0]["ingredients"]) == ["egg", "milk|whole"]
+        assert rows[1]["ingredients"] == "[]"
+
+    def test_import_recipes(self, use_test_db, mocker, admin):
+        mocker.patch.object(operations.CONFIG.recipes_import, "chunk_size", 1)
+        operations.create_category("Category", 1)
+        _create_ingredient("tomato", category="vegetables")
+        egg = {
+            "name": "egg",
+            "quantity": 2,
+            "calories": 10,
+            "carbo": 1,
+            "fats": 1,
+            "protein": 1,
+            "cholesterol": 1,
+            "measurement": "g",
+            "category": "dairy",
+        }
+        lines = [
+            {
+                "name": "omelette",
+                "category": "breakfast",
+                "ingredients": [egg],
+                "instructions": [{"instruction": "fry", "category": "Fry", "time": 5, "complexity": 2}],
+            },
+            "not json",
+            {"category": "Category"},
+            {"name": "scrambled eggs", "category": "category", "ingredients": [egg, {**egg, "name": "EGG"}]},
+            # close matches are not merged into the existing ingredients
+            {"name": "salad", "ingredients": [{**egg, "name": "tomatoes"}]},
+        ]
+        body = "\n".join(line if isinstance(line, str) else json.dumps(line) for line in lines)
+
+        response = self.client.post("/api/recipes/import", content=body, headers={'Authorization': 'Bearer token'})
+        assert response.status_code == 200
+        assert response.json()["imported"] == 3
+        assert response.json()["failed"] == 2
+        assert [error["line"] for error in response.json()["errors"]] == [2, 3]
+        assert response.json()["errors"][1]["error"] == "name: Field required"
+        with db.connection.get_session() as session:
+            recipes = (
+                session.query(Recipe)
+                .options(selectinload(Recipe.category), selectinload(Recipe.instructions))
+                .order_by(Recipe.id)
+                .all()
+            )
+            assert [(recipe.name, recipe.category and recipe.category.name) for recipe in recipes] == [
+                ("omelette", "breakfast"),
+                ("scrambled eggs", "Category"),
+                ("salad", None),
+            ]
+            assert [float(recipe.calories) for recipe in recipes] == [20, 40, 20]
+            assert [len(recipe.instructions) for recipe in recipes] == [1, 0, 0]
+        assert sorted(ingredient.name for ingredient in operations.get_all_ingredients_from_db()) == [
+            "egg",
+            "tomato",
+            "tomatoes",
+        ]
+        assert [ingredient.name for ingredient in operations.suggest_ingredients("tomatoes", limit=1)] == ["tomatoes"]
+        assert list(configuration.IMPORTS_PATH.iterdir()) == []
+
+    def test_import_too_large_recipes_file(self, use_test_db, mocker, admin):
+        mocker.patch.object(features.recipes.router.config.recipes_import, "max_bytes", 10)
+        body = json.dumps({"name": "too large"})
+
+        response = self.client.post("/api/recipes/import", content=body, headers={'Authorization': 'Bearer token'})
+        assert response.status_code == 413
+        response = self.client.post(
+            "/api/recipes/import",
+            content=(chunk for chunk in (body[:8].encode(), body[8:].encode())),
+            headers={'Authorization': 'Bearer token'},
+        )
+        assert response.status_code == 413
+        response = self.client.post(
+            "/api/recipes/import",
+            content=(chunk for chunk in (body[:8].encode(), body[8:].encode())),
+            headers={'Authorization': 'Bearer token', 'Content-Length': 'invalid'},
+        )
+        assert response.status_code == 413
+        assert list(configuration.IMPORTS_PATH.iterdir()) == []
+
+    def test_import_large_recipes_file_in_task(self, use_test_db, mocker, admin):
+        mocker.patch.object(features.recipes.router.config.recipes_import, "sync_max_bytes", 10)
+        mocker.patch.object(operations.CONFIG.recipes_import, "chunk_size", 1)
+        task_id = uuid.uuid4().hex
+        delay_mock = mocker.patch.object(
+            features.recipes.tasks.import_recipes_file, "delay", return_value=unittest.mock.Mock(id=task_id)
+        )
+        progress_spy = mocker.spy(features.recipes.tasks, "set_import_progress")
+        body = "\n".join(json.dumps({"name": name}) for name in ("first", "second"))
+
+        response = self.client.post("/api/recipes/import", content=body, headers={'Authorization': 'Bearer token'})
+        assert response.status_code == 202
+        assert response.json()["task_id"] == task_id
+        response = self.client.get(f"/api/recipes/import/{task_id}", headers={'Authorization': 'Bearer token'})
+        assert response.json()["state"] == "PENDING"
+
+        features.recipes.tasks.import_recipes_file.apply(args=delay_mock.call_args.args, task_id=task_id)
+        assert [call.args[1] for call in progress_spy.call_args_list] == [
+            "PENDING",
+            "PROGRESS",
+            "PROGRESS",
+            "PROGRESS",
+            "SUCCESS",
+        ]
+        response = self.client.get(f"/api/recipes/import/{task_id}", headers={'Authorization': 'Bearer token'})
+        assert response.status_code == 200
+        assert response.json()["state"] == "SUCCESS"
+        assert response.json()["imported"] == 2
+        assert list(configuration.IMPORTS_PATH.iterdir()) == []
+
+        response = self.client.get("/api/recipes/import/unknown", headers={'Authorization': 'Bearer token'})
+        assert response.status_code == 404
+
+    def test_hot_queries_use_indexes(self, query_plans, mocker, user):
+        mocker.patch("features.recipes.helpers.get_usernames", return_value={})
+        mocker.patch("features.recipes.helpers.get_image_urls", return_value={})
+        mocker.patch("features.recipes.tasks.gTTS")
+        operations.create_category("Category", 1)
+        self.recipe["instructions"] = [
+            CreateInstructionInputModel(instruction="boil", category="Boil", time=10, complexity=2)
+        ]
+        recipe = operations.create_recipe(**self.recipe, created_by=user)
+        operations.patch_recipe(
+            recipe_id=recipe.id,
+            patch_input_model=PatchRecipeInputModel(field="is_published", value="true"),
+            patched_by=user,
+        )
+        query_plans.clear()
+
+        operations.get_all_recipes(PSFRecipesInputModel(), user=None)
+        operations.get_all_recipes(PSFRecipesInputModel(filters="category:1"), user=None)
+        features.recipes.tasks._get_recipes_for_summary_generation()
+        features.recipes.tasks.generate_instruction_audio_files()
+        features.images.tasks.upload_images_to_cloud_storage()
+
+        plans = "\n".join(query_plans)
+        for index in (
+            "ix_recipes_published_created_on",
+            "ix_recipes_category_id",
+            "ix_recipes_updated_on",
+            "ix_recipes_summary_missing",
+            "ix_recipe_instructions_recipe_id",
+            "ix_recipe_instructions_updated_on",
+            "ix_recipe_instructions_audio_file_missing",
+            "ix_images_not_in_cloudinary",
+        ):
+            assert index in plans
+
+
+class TestIngredientsEndpoints:
+    def setup(self):
+        self.client = TestClient(app)
+
+    def test_suggest_ingredients(self, use_test_db):
+        for name in ("tomatoes", "tomato paste", "potato", "salt"):
+            _create_ingredient(name)
+
+        response = self.client.get("/api/ingredients/suggest", params={"q": "tom"})
+        assert response.status_code == 200
+        assert sorted(ingredient["name"] for ingredient in response.json()) == ["tomato paste", "tomatoes"]
+
+        response = self.client.get("/api/ingredients/suggest", params={"q": "tomatos", "limit": 1})
+        assert [ingredient["name"] for ingredient in response.json()] == ["tomatoes"]
+
+    def test_create_ingredient_reuses_close_match(self, use_test_db):
+        tomatoes = _create_ingredient("tomatoes")
+
+        assert _create_ingredient("Tomato").id == tomatoes.id
+        assert _create_ingredient("tomato", measurement="piece").id != tomatoes.id
+        assert _create_ingredient("potato").id != tomatoes.id
+
+    def test_suggest_ingredients_follows_changes(self, use_test_db, monkeypatch):
+        monkeypatch.setattr(operations.INGREDIENTS_CACHE, "check_interval", 0)
+        tomatoes = _create_ingredient("tomatoes")
+        operations.update_ingredient(tomatoes.id, "name", "cucumbers", 1)
+        response = self.client.get("/api/ingredients/suggest", params={"q": "tom"})
+        assert response.json() == []
+
+        # added and announced by another worker
+        with db.connection.get_session() as session:
+            session.add(
+                Ingredient(
+                    name="tomato paste",
+                    calories=1,
+                    carbo=1,
+                    fats=1,
+                    protein=1,
+                    cholesterol=1,
+                    measurement="gram",
+                    category="vegetables",
+                    created_by=1,
+                )
+            )
+            session.commit()
+        common.cache.SharedTTLCache('ingredients', 10, 60).invalidate()
+        response = self.client.get("/api/ingredients/suggest", params={"q": "tom"})
+        assert [ingredient["name"] for ingredient in response.json()] == ["tomato paste"]
+
+    def test_delete_ingredient_removes_it_from_all_recipes(self, use_test_db, user):
+        operations.create_category("Category", 1)
+        salt, egg = _create_ingredient("salt"), _create_ingredient("egg")
+        recipe_ids = []
+        for ingredients in ([salt, egg], [salt], [egg]):
+            recipe = operations.create_recipe(
+                name="name",
+                category_id=1,
+                serves=1,
+                instructions=[],
+                ingredients=[
+                    RecipeIngredientInputModel(ingredient_id=ingredient.id, quantity=2) for ingredient in ingredients
+                ],
+                created_by=common.authentication.AuthenticatedUser(id=2),
+            )
+            recipe_ids.append(recipe.id)
+
+        assert sorted(operations.delete_ingredient(salt.id, user)) == recipe_ids[:2]
+
+        with db.connection.get_session() as session:
+            recipes = session.query(Recipe).options(selectinload(Recipe.ingredients)).order_by(Recipe.id).all()
+            assert [[mapping.ingredient_id for mapping in recipe.ingredients] for recipe in recipes] == [
+                [egg.id],
+                [],
+                [egg.id],
+            ]
+            assert [float(recipe.calories) for recipe in recipes] == [2, 0, 2]
+            assert [recipe.updated_by for recipe in recipes] == [user.id, user.id, 2]
+        with pytest.raises(IngredientDoesNotExistException):
+            operations.get_ingredient_from_db(pk=salt.id)
+
+
+class UnavailableRpcError(grpc.RpcError):
+    def code(self):
+        return grpc.StatusCode.UNAVAILABLE
+
+
+class TestRecipeResponsesGrpcFallback:
+    def test_circuit_breaker_opens_and_falls_back_to_ids(self, mocker):
+        mocker.patch.dict(common.grpc_client._BREAKERS, clear=True)
+        mocker.patch.object(common.grpc_client.config.grpc_client, "breaker_failure_threshold", 2)
+        stub = mocker.patch("communication.users_pb2_grpc.UsersStub")
+        stub.return_value.get_usernames.side_effect = UnavailableRpcError()
+
+        for _ in range(3):
+            assert features.recipes.responses.get_usernames([1, 2]) == {}
+        assert stub.return_value.get_usernames.call_count == 2
+        assert common.grpc_client.get_circuit_breaker(features.recipes.responses.config.users_grpc_server_host).is_open
+
+    def test_circuit_breaker_closes_after_successful_trial(self, mocker):
+        breaker = common.grpc_client.CircuitBreaker(failure_threshold=1, reset_timeout=0)
+        breaker.record_failure()
+        assert breaker.is_open
+        assert breaker.allow() is True
+        assert breaker.allow() is False
+        breaker.record_success()
+        assert not breaker.is_open
+        assert breaker.allow() is True
+
+    def test_failed_trial_call_is_recorded(self, mocker):
+        breaker = common.grpc_client.CircuitBreaker(failure_threshold=1, reset_timeout=0)
+        mocker.patch.dict(common.grpc_client._BREAKERS, {"localhost:1": breaker}, clear=True)
+        breaker.record_failure()
+        stub = unittest.mock.Mock()
+        stub.return_value.get_usernames.side_effect = ValueError()
+
+        with pytest.raises(ValueError):
+            common.grpc_client.call("localhost:1", stub, "get_usernames", None)
+        assert breaker.is_open
+        # the next trial call is let through
+        assert breaker.allow() is True
@@ -33,6 +33,10 @@ class SamePasswordsException(Exception):
     ...
 
 
+class PasswordHashingBusy(Exception):
+    ...
+
+
 class FailedToSendEmailException(Exception):
     def __init__(self, status_code, text):
         self.status_code = status_code
@@ -1,5 +1,6 @@
 """gRPC server for users feature"""
-from concurrent import futures
+import asyncio
+
 import grpc
 import communication.users_pb2
 import communication.users_pb2_grpc
@@ -8,15 +9,32 @@ import features.users.operations
 
 
 class UserServicer(communication.users_pb2_grpc.UsersServicer):
-    def get_username(self, request, context):
-        username = features.users.operations.get_username(request.user_id)
+    async def get_username(self, request, context):
+        username = await asyncio.to_thread(features.users.operations.get_username, request.user_id)
         message = communication.users_pb2.UsernameResponse(username=username)
         return message
 
+    async def get_usernames(self, request, context):
+        usernames = await features.users.operations.get_usernames_async(request.user_ids)
+        message = communication.users_pb2.UsernamesResponse(usernames=usernames)
+        return message
+
+    async def stream_usernames(self, request_iterator, context):
+        async for request in request_iterator:
+            yield await self.get_usernames(request, context)
+
+
+def create_server() -> grpc.aio.Server:
+    """
+    Create the users gRPC server on the running event loop
+    :return:
+    """
 
-def serve():
-    server = grpc.server(futures.ThreadPoolExecutor(max_workers=10))
+    config = configuration.Config()
+    server = grpc.aio.server(
+        maximum_concurrent_rpcs=config.grpc_server.maximum_concurrent_rpcs,
+        options=config.grpc_server.options,
+    )
     communication.users_pb2_grpc.add_UsersServicer_to_server(UserServicer(), server=server)
-    server.add_insecure_port(configuration.Config().users_grpc_server_host)
-    server.start()
-    server.wait_for_termination()
+    server.add_insecure_port(config.users_grpc_server_host)
+    return server
@@ -1,7 +1,7 @@
 from typing import Optional
 
 from sqlalchemy.orm import relationship
-from sqlalchemy import String, LargeBinary, ForeignKey, Boolean, DateTime, func, Integer
+from sqlalchemy import String, LargeBinary, ForeignKey, Boolean, DateTime, func, Integer, Index
 from sqlalchemy.orm import Mapped, mapped_column
 
 from features import DbBaseModel
@@ -18,12 +18,8 @@ class User(DbBaseModel):
     username: Mapped[str] = mapped_column(String(30), unique=True)
     email: Mapped[str] = mapped_column(String(50), unique=True)
     password: Mapped[bytes] = mapped_column(LargeBinary())
-    is_email_confirmed: Mapped[bool] = mapped_column(
-        Boolean, default=False, server_default="false"
-    )
-    updated_by: Mapped[Optional[int]] = mapped_column(
-        ForeignKey("Users.id"), nullable=True, init=False
-    )
+    is_email_confirmed: Mapped[bool] = mapped_column(Boolean, default=False, server_default="false")
+    updated_by: Mapped[Optional[int]] = mapped_column(ForeignKey("Users.id"), nullable=True, init=False)
     updated_on: Mapped[datetime.datetime] = mapped_column(
         DateTime,
         server_default=func.current_timestamp(),
@@ -51,14 +47,10 @@ class ConfirmationToken(DbBaseModel):
     """Email confirmation and passoword reset confirmation token DB model"""
 
     __tablename__ = "CONFIRMATION_TOKEN"
-    id: Mapped[int] = mapped_column(
-        Integer, primary_key=True, nullable=False, init=False
-    )
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, nullable=False, init=False)
     token: Mapped[str] = mapped_column(String(43), nullable=False)
     user_id: Mapped[int] = mapped_column(ForeignKey("Users.id"), nullable=False)
-    created_on: Mapped[datetime.datetime] = mapped_column(
-        DateTime, server_default=func.current_timestamp(), init=False
-    )
+    created_on: Mapped[datetime.datetime] = mapped_column(DateTime, server_default=func.current_timestamp(), init=False)
     expired_on: Mapped[datetime.datetime] = mapped_column(DateTime, nullable=False)
     token_type: Mapped[str] = mapped_column(String(20), nullable=False)
 
@@ -68,9 +60,7 @@ class Role(DbBaseModel):
 
     id: Mapped[int] = mapped_column(primary_key=True, init=False)
     name: Mapped[str] = mapped_column(String(50), unique=True)
-    created_on: Mapped[datetime.datetime] = mapped_column(
-        DateTime, server_default=func.current_timestamp(), init=False
-    )
+    created_on: Mapped[datetime.datetime] = mapped_column(DateTime, server_default=func.current_timestamp(), init=False)
     created_by: Mapped[int] = mapped_column(ForeignKey("Users.id"), nullable=True)
 
     users = relationship(
@@ -86,13 +76,17 @@ class Role(DbBaseModel):
 class UserRole(DbBaseModel):
     __tablename__ = "user_roles"
 
-    user_id: Mapped[int] = mapped_column(
-        Integer, ForeignKey("Users.id", ondelete="RESTRICT"), primary_key=True
-    )
-    role_id: Mapped[int] = mapped_column(
-        Integer, ForeignKey("Roles.id", ondelete="RESTRICT"), primary_key=True
-    )
+    user_id: Mapped[int] = mapped_column(Integer, ForeignKey("Users.id", ondelete="RESTRICT"), primary_key=True)
+    role_id: Mapped[int] = mapped_column(Integer, ForeignKey("Roles.id", ondelete="RESTRICT"), primary_key=True)
     added_by: Mapped[int] = mapped_column(ForeignKey("Users.id"), nullable=True)
-    added_on: Mapped[datetime.datetime] = mapped_column(
-        DateTime, server_default=func.current_timestamp(), init=False
-    )
+    added_on: Mapped[datetime.datetime] = mapped_column(DateTime, server_default=func.current_timestamp(), init=False)
+
+
+# tokens are looked up by their value and the active tokens of a user are expired before issuing a new one
+Index('ix_confirmation_token_token', ConfirmationToken.token)
+Index(
+    'ix_confirmation_token_user_id_token_type',
+    ConfirmationToken.user_id,
+    ConfirmationToken.token_type,
+    ConfirmationToken.expired_on,
+)
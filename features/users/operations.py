@@ -1,9 +1,11 @@
+import asyncio
+import concurrent.futures
 import pathlib
 import secrets
-from typing import Optional
+import threading
+from typing import Optional, Iterable
 
 import features.users.exceptions
-from db.connection import get_session
 
 import datetime
 
@@ -11,19 +13,20 @@ from datetime import datetime, timedelta
 
 import bcrypt
 from jose import jwt
-from sqlalchemy import update
+from sqlalchemy import update, select
+import sqlalchemy.orm
+from sqlalchemy.ext.asyncio import AsyncSession
 from fastapi.templating import Jinja2Templates
 from httpx import AsyncClient
 
+import common.cache
 import configuration
 import db.connection
 import features.users.exceptions
-from db.connection import get_session
 from .input_models import RegisterUserInputModel
 from .models import User, Role, UserRole, ConfirmationToken
 from .constants import TokenTypes
 import khLogging
-from functools import cache
 
 logging = khLogging.Logger.get_child_logger(__file__)
 
@@ -31,15 +34,55 @@ config = configuration.Config()
 
 brevo = configuration.BrevoSettings()
 
+# usernames are read by the recipes service for every listed recipe, a rename is seen by all workers
+USERNAMES_CACHE = common.cache.SharedTTLCache(
+    'usernames', config.usernames_cache.max_size, config.usernames_cache.ttl, config.usernames_cache.check_interval
+)
+
+# roles change rarely, they are cached in every worker and invalidated in all of them on change
+ROLES_CACHE = common.cache.SharedTTLCache(
+    'roles', config.reference_cache.max_size, config.reference_cache.ttl, config.reference_cache.check_interval
+)
+
+# bcrypt takes hundreds of milliseconds of CPU, it runs in a bounded pool so it never blocks the event loop
+# and a burst of sign ins is rejected instead of piling up
+PASSWORD_HASHING_POOL = concurrent.futures.ThreadPoolExecutor(
+    max_workers=config.password_hashing.workers, thread_name_prefix='password-hashing'
+)
+_PASSWORD_HASHING_SLOTS = threading.BoundedSemaphore(
+    config.password_hashing.workers + config.password_hashing.max_pending
+)
+
+
+def _submit_password_job(function, *args) -> concurrent.futures.Future:
+    """
+    Run a password hashing job in the pool
+
+    :param function:
+    :param args:
+    :return:
+    :raises PasswordHashingBusy: when all the workers are busy and the queue is full
+    """
+
+    if not _PASSWORD_HASHING_SLOTS.acquire(blocking=False):
+        raise features.users.exceptions.PasswordHashingBusy()
+    try:
+        future = PASSWORD_HASHING_POOL.submit(function, *args)
+    except RuntimeError:
+        _PASSWORD_HASHING_SLOTS.release()
+        raise
+    future.add_done_callback(lambda _: _PASSWORD_HASHING_SLOTS.release())
+    return future
+
 
 def hash_password(password: str) -> bytes:
     """
-    Hash password
+    Hash password with the configured cost factor
 
     :param password:
     :return:
     """
-    salt = bcrypt.gensalt()
+    salt = bcrypt.gensalt(rounds=config.password_hashing.rounds)
     hashed_password = bcrypt.hashpw(password.encode("utf-8"), salt)
     return hashed_password
 
@@ -56,20 +99,44 @@ def check_password(user: User, password: str) -> bool:
     return bcrypt.checkpw(password.encode("utf-8"), user.password)
 
 
-def create_new_user(user: RegisterUserInputModel) -> User:
+async def hash_password_async(password: str) -> bytes:
+    """
+    Hash password in the password hashing pool
+
+    :param password:
+    :return:
+    """
+
+    return await asyncio.wrap_future(_submit_password_job(hash_password, password))
+
+
+async def check_password_async(user: User, password: str) -> bool:
+    """
+    Check if passwords match in the password hashing pool
+
+    :param user:
+    :param password:
+    :return:
+    """
+
+    return await asyncio.wrap_future(_submit_password_job(check_password, user, password))
+
+
+def create_new_user(user: RegisterUserInputModel, session: sqlalchemy.orm.Session = None) -> User:
     """
     Create user
 
     :param user:
+    :param session:
     :return:
     """
 
-    with get_session() as session:
+    with db.connection.session_scope(session) as session:
         try:
-            if get_user_from_db(username=user.username, email=user.email):
+            if get_user_from_db(username=user.username, email=user.email, session=session):
                 raise features.users.exceptions.UserAlreadyExists()
         except features.users.exceptions.UserDoesNotExistException:
-            user.password = hash_password(password=user.password)
+            user.password = _submit_password_job(hash_password, user.password).result()
             db_user = User(username=user.username, email=user.email, password=user.password)
             session.add(db_user)
             session.commit()
@@ -78,45 +145,104 @@ def create_new_user(user: RegisterUserInputModel) -> User:
     return db_user
 
 
-def signin_user(username: str, password: str) -> User:
+def signin_user(username: str, password: str, session: sqlalchemy.orm.Session = None) -> User:
     """
     Get user and check if username and password are correct
 
     :param username:
     :param password:
+    :param session:
     :return:
     """
 
-    current_user = get_user_from_db(username=username)
+    current_user = get_user_from_db(username=username, session=session)
+    _check_signin(current_user, username)
+    _check_signin_password(username, _submit_password_job(check_password, current_user, password).result())
+    return current_user
+
+
+async def signin_user_async(username: str, password: str, session: AsyncSession = None) -> User:
+    """
+    Get user and check if username and password are correct without blocking the event loop on the DB
+
+    :param username:
+    :param password:
+    :param session:
+    :return:
+    """
+
+    current_user = await get_user_from_db_async(username=username, session=session)
+    _check_signin(current_user, username)
+    _check_signin_password(username, await check_password_async(current_user, password))
+    return current_user
+
+
+def _check_signin(current_user: User, username: str) -> None:
+    """
+    Check if the user is allowed to sign in at all, before the password is checked in the hashing pool
+
+    :param current_user:
+    :param username:
+    :return:
+    """
+
+    if not current_user:
+        logging.warning(f"Failed logging attempt for {username}")
+        raise features.users.exceptions.AccessDenied()
     if config.context == configuration.ContextOptions.PROD and not current_user.is_email_confirmed:
         raise features.users.exceptions.AccessDenied()
-    if not current_user or not check_password(current_user, password):
+
+
+def _check_signin_password(username: str, password_matches: bool) -> None:
+    """
+    Check if the password of the user matched
+
+    :param username:
+    :param password_matches:
+    :return:
+    """
+
+    if not password_matches:
         logging.warning(f"Failed logging attempt for {username}")
         raise features.users.exceptions.AccessDenied()
 
-    return current_user
 
+def _get_user_filters(*, pk: int = None, username: str = None, email: str = None) -> list:
+    """
+    Get user filters by pk, username or email
+
+    :param pk:
+    :param username:
+    :param email:
+    :return:
+    """
+
+    filters = []
+    if pk:
+        filters.append(User.id == pk)
+    elif username:
+        filters.append(User.username == username)
+    elif email:
+        filters.append(User.email == email)
+    return filters
 
-def get_user_from_db(*, pk: int = None, username: str = None, email: str = None) -> User | None:
+
+def get_user_from_db(
+    *, pk: int = None, username: str = None, email: str = None, session: sqlalchemy.orm.Session = None
+) -> User | None:
     """
     Get user from DB by pk, username or email
 
     :param pk:
     :param username:
     :param email:
+    :param session:
     :return:
     """
 
-    with get_session() as session:
+    with db.connection.session_scope(session) as session:
         query = session.query(User)
-        filters = []
-
-        if pk:
-            filters.append(User.id == pk)
-        elif username:
-            filters.append(User.username == username)
-        elif email:
-            filters.append(User.email == email)
+        filters = _get_user_filters(pk=pk, username=username, email=email)
 
         if filters:
             query = query.filter(*filters)
@@ -128,20 +254,57 @@ def get_user_from_db(*, pk: int = None, username: str = None, email: str = None)
     return user
 
 
-def get_all_users() -> list:
+async def get_user_from_db_async(
+    *, pk: int = None, username: str = None, email: str = None, session: AsyncSession = None
+) -> User:
+    """
+    Get user from DB by pk, username or email without blocking the event loop
+
+    :param pk:
+    :param username:
+    :param email:
+    :param session:
+    :return:
+    """
+
+    filters = _get_user_filters(pk=pk, username=username, email=email)
+    async with db.connection.async_session_scope(session) as session:
+        user = (await session.scalars(select(User).where(*filters).limit(1))).first()
+
+    if not user:
+        raise features.users.exceptions.UserDoesNotExistException()
+    return user
+
+
+def get_all_users(session: sqlalchemy.orm.Session = None) -> list:
     """
     Fetch all the users from the DB
 
+    :param session:
     :return:
     """
 
-    with get_session() as session:
+    with db.connection.session_scope(session) as session:
         all_users = session.query(User).all()
 
     return all_users
 
 
-def update_user(user_id: int, field: str, value: str, updated_by) -> User:
+async def get_all_users_async(session: AsyncSession = None) -> list:
+    """
+    Fetch all the users from the DB without blocking the event loop
+
+    :param session:
+    :return:
+    """
+
+    async with db.connection.async_session_scope(session) as session:
+        all_users = (await session.scalars(select(User))).all()
+
+    return list(all_users)
+
+
+def update_user(user_id: int, field: str, value: str, updated_by, session: sqlalchemy.orm.Session = None) -> User:
     """
     Update user
 
@@ -149,12 +312,15 @@ def update_user(user_id: int, field: str, value: str, updated_by) -> User:
     :param field:
     :param value:
     :param updated_by:
+    :param session:
     :return:
     """
-    user = get_user_from_db(pk=user_id)
-    with get_session() as session:
+    with db.connection.session_scope(session) as session:
+        user = get_user_from_db(pk=user_id, session=session)
         session.execute(update(User), [{"id": user.id, f"{field}": value, "updated_by": updated_by}])
         session.commit()
+        if field.lower() == 'username':
+            USERNAMES_CACHE.invalidate()
         user.__setattr__(field, value)
         logging.info(f"User #{user.id} updated. {updated_by} set {field}={value}")
         return user
@@ -193,29 +359,39 @@ def create_token(
     return encoded_jwt, token_type
 
 
-def get_all_roles() -> list:
+def get_all_roles(session: sqlalchemy.orm.Session = None, include_users: bool = False) -> list:
     """
-    Get all roles
+    Get all roles. Without their users the roles are cached, they are loaded with a session of their own,
+    so they are never expired by the given one
 
+    :param session:
+    :param include_users:
     :return:
     """
-    with db.connection.get_session() as session:
-        roles = session.query(Role).all()
-        return roles
+    if include_users:
+        with db.connection.session_scope(session) as session:
+            return session.query(Role).all()
 
+    def _load():
+        with db.connection.session_scope() as own_session:
+            return own_session.query(Role).options(sqlalchemy.orm.noload(Role.users)).all()
 
-def get_role(pk: int = None, role_name: str = None) -> Role | None:
+    return list(ROLES_CACHE.get_or_load('all', _load))
+
+
+def get_role(pk: int = None, role_name: str = None, session: sqlalchemy.orm.Session = None) -> Role | None:
     """
     Get role by id or name
 
     :param pk:
     :param role_name:
+    :param session:
     :return:
     """
     if not pk and not role_name:
         raise ValueError("Neither pk nor role_name is provided")
 
-    with db.connection.get_session() as session:
+    with db.connection.session_scope(session) as session:
         query = session.query(Role)
         filters = []
 
@@ -235,87 +411,90 @@ def get_role(pk: int = None, role_name: str = None) -> Role | None:
     return role
 
 
-def check_user_role(user_id: int, role_id: int) -> bool:
+def check_user_role(user_id: int, role_id: int, session: sqlalchemy.orm.Session = None) -> bool:
     """
     Create role
 
     :param user_id:
     :param role_id:
+    :param session:
     :return:
     """
 
-    user = get_user_from_db(pk=user_id)
-    role = get_role(pk=role_id)
+    user = get_user_from_db(pk=user_id, session=session)
+    role = get_role(pk=role_id, session=session)
     if role not in user.roles:
         return False
 
     return True
 
 
-def create_role(name: str, created_by: int) -> Role:
+def create_role(name: str, created_by: int, session: sqlalchemy.orm.Session = None) -> Role:
     """
     Create role
 
     :param name:
     :param created_by:
+    :param session:
     :return:
     """
     try:
-        role = get_role(role_name=name)
+        role = get_role(role_name=name, session=session)
         if role:
             raise features.users.exceptions.RoleAlreadyExists
     except features.users.exceptions.RoleDoesNotExistException:
-        with db.connection.get_session() as session:
+        with db.connection.session_scope(session) as session:
             role = Role(name=name, created_by=created_by)
             session.add(role)
             session.commit()
             session.refresh(role)
+        ROLES_CACHE.invalidate()
         logging.info(f"Role {name} with #{role.id} was created by #{created_by}")
         return role
 
 
-def add_user_to_role(user_id: int, role_id: int, added_by: int) -> None:
+def add_user_to_role(user_id: int, role_id: int, added_by: int, session: sqlalchemy.orm.Session = None) -> None:
     """
     Assign role to user
 
     :param user_id:
     :param role_id:
     :param added_by:
+    :param session:
     :return:
     """
-    user = get_user_from_db(pk=user_id)
-    role = get_role(pk=role_id)
+    with db.connection.session_scope(session) as session:
+        user = get_user_from_db(pk=user_id, session=session)
+        role = get_role(pk=role_id, session=session)
 
-    if check_user_role(user_id, role_id):
-        raise features.users.exceptions.UserWithRoleExist
+        if role in user.roles:
+            raise features.users.exceptions.UserWithRoleExist
 
-    with db.connection.get_session() as session:
         user_role = UserRole(user_id=user.id, role_id=role.id, added_by=added_by)
         session.add(user_role)
         session.commit()
+        session.expire(user, ['roles'])
     logging.info(f"User #{user.id} was add to role #{role.id} by #{added_by}")
 
 
-def remove_user_from_role(user_id: int, role_id: int, removed_by: int) -> None:
+def remove_user_from_role(user_id: int, role_id: int, removed_by: int, session: sqlalchemy.orm.Session = None) -> None:
     """
     Remove user from role
 
     :param user_id:
     :param role_id:
     :param removed_by:
+    :param session:
     :return:
     """
-    user = get_user_from_db(pk=user_id)
-    role = get_role(pk=role_id)
+    with db.connection.session_scope(session) as session:
+        user = get_user_from_db(pk=user_id, session=session)
+        role = get_role(pk=role_id, session=session)
 
-    if not check_user_role(user_id, role_id):
-        raise features.users.exceptions.UserWithRoleDoesNotExist
+        if role not in user.roles:
+            raise features.users.exceptions.UserWithRoleDoesNotExist
 
-    with db.connection.get_session() as session:
-        if role in user.roles:
-            user.roles.remove(role)
-
-        session.add(user)
+        user.roles.remove(role)
         session.commit()
         session.refresh(user)
     logging.info(f"User #{user.id} was removed from role #{role.id} by #{removed_by}")
@@ -411,16 +590,17 @@ async def send_email(*, token: ConfirmationToken, recipient: User):
     return response
 
 
-def expire_all_existing_tokens_for_user(*, user: User, token_type) -> None:
+def expire_all_existing_tokens_for_user(*, user: User, token_type, session: sqlalchemy.orm.Session = None) -> None:
     """
     Expire all existing tokens if exists for the user of the requested type
 
     :param user:
     :param token_type:
+    :param session:
     :return:
     """
 
-    with get_session() as session:
+    with db.connection.session_scope(session) as session:
         current_datetime = datetime.utcnow()
         tokens = (
             session.query(ConfirmationToken)
@@ -439,16 +619,19 @@ def expire_all_existing_tokens_for_user(*, user: User, token_type) -> None:
                 session.refresh(token)
 
 
-def generate_email_password_token(*, user: User, token_type: str) -> ConfirmationToken:
+def generate_email_password_token(
+    *, user: User, token_type: str, session: sqlalchemy.orm.Session = None
+) -> ConfirmationToken:
     """
     Generate new token of the requested type
 
     :param user:
     :param token_type:
+    :param session:
     :return:
     """
 
-    expire_all_existing_tokens_for_user(user=user, token_type=token_type)
+    expire_all_existing_tokens_for_user(user=user, token_type=token_type, session=session)
 
     confirmation_token = configuration.ConfirmationToken()
 
@@ -463,7 +646,7 @@ def generate_email_password_token(*, user: User, token_type: str) -> Confirmatio
 
     expiration_time = datetime.utcnow() + timedelta(minutes=int(expiration_minutes))
 
-    with get_session() as session:
+    with db.connection.session_scope(session) as session:
         token_obj = ConfirmationToken(
             token=token,
             user_id=user.id,
@@ -478,17 +661,18 @@ def generate_email_password_token(*, user: User, token_type: str) -> Confirmatio
     return token_obj
 
 
-def check_if_token_is_valid(token: str) -> ConfirmationToken | None:
+def check_if_token_is_valid(token: str, session: sqlalchemy.orm.Session = None) -> ConfirmationToken | None:
     """
     Get the token from db if exists, check if token is expired
 
     :param token:
+    :param session:
     :return:
     """
 
     current_datetime = datetime.utcnow()
 
-    with get_session() as session:
+    with db.connection.session_scope(session) as session:
         token = (
             session.query(ConfirmationToken)
             .filter(
@@ -501,15 +685,16 @@ def check_if_token_is_valid(token: str) -> ConfirmationToken | None:
     return token or None
 
 
-def confirm_email(token: ConfirmationToken) -> User:
+def confirm_email(token: ConfirmationToken, session: sqlalchemy.orm.Session = None) -> User:
     """
     Mark the user email as confirmed and expire the token
 
     :param token:
+    :param session:
     :return:
     """
-    with get_session() as session:
-        user = get_user_from_db(pk=token.user_id)
+    with db.connection.session_scope(session) as session:
+        user = get_user_from_db(pk=token.user_id, session=session)
         user.is_email_confirmed = True
         token.expired_on = datetime.utcnow()
         session.add(user)
@@ -521,7 +706,9 @@ def confirm_email(token: ConfirmationToken) -> User:
     return user
 
 
-def update_user_password(user: User, new_password: str, token: ConfirmationToken) -> User:
+def update_user_password(
+    user: User, new_password: str, token: ConfirmationToken, session: sqlalchemy.orm.Session = None
+) -> User:
     """
     Validate the new password
     Check if the new password does not match the old password
@@ -531,37 +718,79 @@ def update_user_password(user: User, new_password: str, token: ConfirmationToken
     :param user:
     :param new_password:
     :param token:
+    :param session:
     :return:
     """
 
     RegisterUserInputModel.validate_password(new_password)
 
-    if check_password(user, new_password):
+    if _submit_password_job(check_password, user, new_password).result():
         raise features.users.exceptions.SamePasswordsException()
 
-    hashed_password = hash_password(new_password)
+    hashed_password = _submit_password_job(hash_password, new_password).result()
     user.password = hashed_password
 
-    with get_session() as session:
+    with db.connection.session_scope(session) as session:
         token.expired_on = datetime.utcnow()
         session.add(token)
         session.add(user)
         session.commit()
         session.refresh(token)
         session.refresh(user)
-        session.close()
 
     return user
 
 
-@cache
 def get_username(user_id: int) -> Optional[str]:
     """
-    Get username from the db
+    Get username from the db, cached
     :param user_id:
     :return:
     """
 
-    with db.connection.get_session() as session:
-        username = session.query(User.username).where(User.id == user_id).scalar()
-        return username
+    return get_usernames([user_id]).get(user_id)
+
+
+def get_usernames(user_ids: Iterable[int], session: sqlalchemy.orm.Session = None) -> dict[int, str]:
+    """
+    Get the usernames of multiple users, the ones which are not cached are fetched from the db with a single query
+    :param user_ids:
+    :param session:
+    :return:
+    """
+
+    user_ids = set(user_ids)
+    usernames = USERNAMES_CACHE.get_many(user_ids)
+    missing = user_ids - usernames.keys()
+    if not missing:
+        return usernames
+
+    generation = USERNAMES_CACHE.generation
+    with db.connection.session_scope(session) as session:
+        rows = session.execute(select(User.id, User.username).where(User.id.in_(missing)))
+        loaded = {user_id: username for user_id, username in rows}
+    USERNAMES_CACHE.set_many(loaded, generation)
+    return usernames | loaded
+
+
+async def get_usernames_async(user_ids: Iterable[int], session: AsyncSession = None) -> dict[int, str]:
+    """
+    Get the usernames of multiple users without blocking the event loop,
+    the ones which are not cached are fetched from the db with a single query
+    :param user_ids:
+    :param session:
+    :return:
+    """
+
+    user_ids = set(user_ids)
+    usernames = USERNAMES_CACHE.get_many(user_ids)
+    missing = user_ids - usernames.keys()
+    if not missing:
+        return usernames
+
+    generation = USERNAMES_CACHE.generation
+    async with db.connection.async_session_scope(session) as session:
+        rows = await session.execute(select(User.id, User.username).where(User.id.in_(missing)))
+        loaded = {user_id: username for user_id, username in rows}
+    USERNAMES_CACHE.set_many(loaded, generation)
+    return usernames | loaded
@@ -2,16 +2,19 @@
 
 import fastapi
 from fastapi import APIRouter, HTTPException
+from fastapi.concurrency import run_in_threadpool
 
 import common.authentication
+import db.connection
 import features.users.exceptions
 from .constants import TokenTypes
 from .input_models import RegisterUserInputModel, UpdateUserInputModel, CreateUserRole
 from .operations import (
     create_new_user,
-    signin_user,
-    get_all_users,
+    signin_user_async,
+    get_all_users_async,
     get_user_from_db,
+    get_user_from_db_async,
     create_token,
 )
 from .responses import (
@@ -28,22 +31,34 @@ user_router = APIRouter()
 roles_router = APIRouter()
 
 
+def _password_hashing_busy() -> HTTPException:
+    return HTTPException(
+        status_code=fastapi.status.HTTP_429_TOO_MANY_REQUESTS,
+        detail="Too many sign ins at the moment, try again later",
+        headers={"Retry-After": "1"},
+    )
+
+
 @user_router.post(
     "/signup",
     response_model=UsersResponseModel,
     status_code=fastapi.status.HTTP_201_CREATED,
 )
-async def signup(user: RegisterUserInputModel):
+async def signup(user: RegisterUserInputModel, session: db.connection.db_session):
     """
     Sing up user
 
     :param user:
+    :param session:
     :return:
     """
     try:
-        db_user = create_new_user(user)
-        token = features.users.operations.generate_email_password_token(
-            user=db_user, token_type=TokenTypes.EMAIL_CONFIRMATION
+        db_user = await run_in_threadpool(create_new_user, user, session=session)
+        token = await run_in_threadpool(
+            features.users.operations.generate_email_password_token,
+            user=db_user,
+            token_type=TokenTypes.EMAIL_CONFIRMATION,
+            session=session,
         )
         await features.users.operations.send_email(token=token, recipient=db_user)
         return db_user
@@ -52,6 +67,8 @@ async def signup(user: RegisterUserInputModel):
             status_code=fastapi.status.HTTP_409_CONFLICT,
             detail="User with this username or email already exists!",
         )
+    except features.users.exceptions.PasswordHashingBusy:
+        raise _password_hashing_busy()
     except features.users.exceptions.FailedToSendEmailException as e:
         raise HTTPException(
             status_code=e.status_code,
@@ -60,16 +77,19 @@ async def signup(user: RegisterUserInputModel):
 
 
 @user_router.post("/signin", response_model=JwtTokenResponseModel)
-async def signin(request: Annotated[OAuth2PasswordRequestForm, fastapi.Depends()]):
+async def signin(
+    request: Annotated[OAuth2PasswordRequestForm, fastapi.Depends()], session: db.connection.async_db_session
+):
     """
     Sing in user
 
     :param request:
+    :param session:
     :return:
     """
     try:
         # Sign in user and create jwt token
-        user = signin_user(request.username, request.password)
+        user = await signin_user_async(request.username, request.password, session=session)
         token, token_type = create_token(user_id=user.id, user_role_ids=user.user_role_ids)
         return {"access_token": token, "token_type": token_type}
     except features.users.exceptions.AccessDenied:
@@ -77,6 +97,8 @@ async def signin(request: Annotated[OAuth2PasswordRequestForm, fastapi.Depends()
             status_code=fastapi.status.HTTP_403_FORBIDDEN,
             detail="Incorrect username or password",
         )
+    except features.users.exceptions.PasswordHashingBusy:
+        raise _password_hashing_busy()
 
     except features.users.exceptions.UserDoesNotExistException:
         raise HTTPException(
@@ -90,14 +112,15 @@ async def show_all_users(
     user: Annotated[
         common.authentication.AuthenticatedUser,
         fastapi.Depends(common.authentication.admin),
-    ]
+    ],
+    session: db.connection.async_db_session,
 ):
     """
     Show all users
 
     :return:
     """
-    all_users = get_all_users()
+    all_users = await get_all_users_async(session=session)
     return all_users
 
 
@@ -108,16 +131,18 @@ async def get_user(
         common.authentication.AuthenticatedUser,
         fastapi.Depends(AdminOrMe(identifier_variable="user_id")),
     ],
+    session: db.connection.async_db_session,
 ):
     """
     Show user details
 
     :param user_id:
     :param user:
+    :param session:
     :return:
     """
     try:
-        user = get_user_from_db(pk=user_id)
+        user = await get_user_from_db_async(pk=user_id, session=session)
         return user
     except features.users.exceptions.UserDoesNotExistException:
         raise fastapi.HTTPException(
@@ -132,6 +157,7 @@ def patch_user(
         common.authentication.AuthenticatedUser,
         fastapi.Depends(AdminOrMe(identifier_variable="user_id")),
     ],
+    session: db.connection.db_session,
     user_id: int = fastapi.Path(),
     update_user_input_model: UpdateUserInputModel = fastapi.Body(),
 ):
@@ -139,13 +165,14 @@ def patch_user(
     Update user email
 
     :param user:
+    :param session:
     :param user_id:
     :param update_user_input_model:
     :return:
     """
     try:
         updated_user = features.users.operations.update_user(
-            user_id, **update_user_input_model.model_dump(), updated_by=user.id
+            user_id, **update_user_input_model.model_dump(), updated_by=user.id, session=session
         )
         return features.users.responses.UsersResponseModel(**updated_user.__dict__)
     except features.users.exceptions.UserDoesNotExistException:
@@ -161,16 +188,18 @@ def get_all_roles(
         common.authentication.AuthenticatedUser,
         fastapi.Depends(common.authentication.admin),
     ],
+    session: db.connection.db_session,
     include_users: bool = False,
 ):
     """
     Show all roles
 
     :param user:
+    :param session:
     :param include_users:
     :return:
     """
-    roles = features.users.operations.get_all_roles()
+    roles = features.users.operations.get_all_roles(session=session, include_users=include_users)
 
     if include_users:
         return [RolesWithUsersResponseModel(**role.__dict__) for role in roles]
@@ -185,15 +214,17 @@ def get_role_with_users(
         common.authentication.AuthenticatedUser,
         fastapi.Depends(common.authentication.admin),
     ],
+    session: db.connection.db_session,
 ):
     """
     Get role
 
     :param role_id:
     :param user:
+    :param session:
     :return:
     """
-    role = features.users.operations.get_role(role_id)
+    role = features.users.operations.get_role(role_id, session=session)
     return role
 
 
@@ -204,16 +235,18 @@ def create_role(
         common.authentication.AuthenticatedUser,
         fastapi.Depends(common.authentication.admin),
     ],
+    session: db.connection.db_session,
 ):
     """
     Create role
 
     :param role_request:
     :param user:
+    :param session:
     :return:
     """
     try:
-        role = features.users.operations.create_role(role_request.name, created_by=user.id)
+        role = features.users.operations.create_role(role_request.name, created_by=user.id, session=session)
     except features.users.exceptions.RoleAlreadyExists:
         raise fastapi.HTTPException(status_code=fastapi.status.HTTP_409_CONFLICT, detail=f"Role already exist")
 
@@ -226,6 +259,7 @@ def add_user_to_role(
         common.authentication.AuthenticatedUser,
         fastapi.Depends(common.authentication.admin),
     ],
+    session: db.connection.db_session,
     user_id: int = fastapi.Path(),
     role_id: int = fastapi.Body(),
 ):
@@ -235,11 +269,12 @@ def add_user_to_role(
     :param user_id:
     :param role_id:
     :param user:
+    :param session:
     :return:
     """
 
     try:
-        features.users.operations.add_user_to_role(user_id, role_id, added_by=user.id)
+        features.users.operations.add_user_to_role(user_id, role_id, added_by=user.id, session=session)
     except features.users.exceptions.UserDoesNotExistException:
         raise fastapi.HTTPException(status_code=fastapi.status.HTTP_404_NOT_FOUND, detail=f"User does not exist")
     except features.users.exceptions.RoleDoesNotExistException:
@@ -259,6 +294,7 @@ def remove_user_from_role(
         common.authentication.AuthenticatedUser,
         fastapi.Depends(common.authentication.admin),
     ],
+    session: db.connection.db_session,
 ):
     """
     Remove user from role
@@ -266,11 +302,12 @@ def remove_user_from_role(
     :param user_id:
     :param role_id:
     :param user:
+    :param session:
     :return:
     """
 
     try:
-        features.users.operations.remove_user_from_role(user_id, role_id, user.id)
+        features.users.operations.remove_user_from_role(user_id, role_id, user.id, session=session)
     except features.users.exceptions.UserDoesNotExistException:
         raise fastapi.HTTPException(status_code=fastapi.status.HTTP_404_NOT_FOUND, detail=f"User does not exist")
     except features.users.exceptions.RoleDoesNotExistException:
@@ -283,38 +320,40 @@ def remove_user_from_role(
 
 
 @user_router.get("/confirm-email/{token}")
-async def confirm_email(token: str):
+async def confirm_email(token: str, session: db.connection.db_session):
     """
     Confirm email
 
     :param token:
+    :param session:
     :return:
     """
 
-    confirm_token = features.users.operations.check_if_token_is_valid(token=token)
+    confirm_token = features.users.operations.check_if_token_is_valid(token=token, session=session)
     if confirm_token is None:
         raise HTTPException(status_code=fastapi.status.HTTP_400_BAD_REQUEST, detail="Invalid token")
 
-    features.users.operations.confirm_email(confirm_token)
+    features.users.operations.confirm_email(confirm_token, session=session)
 
     return fastapi.status.HTTP_200_OK
 
 
 @user_router.post("/request-password-reset")
-async def request_password_reset(username: str, email: str):
+async def request_password_reset(username: str, email: str, session: db.connection.db_session):
     """
     Request password reset
 
     :param username:
     :param email:
+    :param session:
     :return:
     """
     try:
-        db_user = get_user_from_db(username=username)
+        db_user = get_user_from_db(username=username, session=session)
         if db_user.email != email:
             raise HTTPException(status_code=fastapi.status.HTTP_400_BAD_REQUEST)
         token = features.users.operations.generate_email_password_token(
-            user=db_user, token_type=TokenTypes.PASSWORD_RESET
+            user=db_user, token_type=TokenTypes.PASSWORD_RESET, session=session
         )
         await features.users.operations.send_email(token=token, recipient=db_user)
         return fastapi.status.HTTP_200_OK
@@ -329,22 +368,25 @@ async def request_password_reset(username: str, email: str):
 
 
 @user_router.post("/reset-password/{token}")
-async def reset_password(token: str, new_password: str):
+async def reset_password(token: str, new_password: str, session: db.connection.db_session):
     """
     Reset password
 
     :param token:
     :param new_password:
+    :param session:
     :return:
     """
 
-    reset_token = features.users.operations.check_if_token_is_valid(token=token)
+    reset_token = features.users.operations.check_if_token_is_valid(token=token, session=session)
 
     if reset_token is None:
         raise HTTPException(status_code=fastapi.status.HTTP_400_BAD_REQUEST, detail="Invalid token")
     try:
-        user = get_user_from_db(pk=reset_token.user_id)
-        features.users.operations.update_user_password(user, new_password, reset_token)
+        user = get_user_from_db(pk=reset_token.user_id, session=session)
+        await run_in_threadpool(
+            features.users.operations.update_user_password, user, new_password, reset_token, session=session
+        )
 
     except ValueError as e:
         raise HTTPException(status_code=fastapi.status.HTTP_422_UNPROCESSABLE_ENTITY, detail=e.args)
@@ -358,4 +400,7 @@ async def reset_password(token: str, new_password: str):
             detail="The new password can not be the same as the old password",
         )
 
+    except features.users.exceptions.PasswordHashingBusy:
+        raise _password_hashing_busy()
+
     return fastapi.status.HTTP_200_OK
@@ -1,13 +1,18 @@
+import asyncio
 import datetime
+import threading
 
 import bcrypt
 import pytest
 
 from unittest.mock import patch, AsyncMock, ANY
 
+import common.authentication
+import communication.users_pb2
 import configuration
 import db.connection
-from tests.fixtures import use_test_db
+import features.users.grpc_server
+from tests.fixtures import use_test_db, query_plans
 from features.users import operations, input_models, exceptions, constants, models
 from fastapi.testclient import TestClient
 from api import app
@@ -135,6 +140,23 @@ class TestUserOperations:
         with pytest.raises(exceptions.AccessDenied):
             operations.signin_user(USER_DATA["username"], wrong_password)
 
+    @staticmethod
+    def test_signin_user_unconfirmed_email_skips_password_check(use_test_db, monkeypatch):
+        """
+        Test that signin of a user with unconfirmed email is denied without hashing the password
+        :param use_test_db:
+        :param monkeypatch:
+        :return:
+        """
+        operations.create_new_user(user=input_models.RegisterUserInputModel(**USER_DATA))
+        monkeypatch.setattr(operations.config, "context", configuration.ContextOptions.PROD)
+        with patch.object(operations, "_submit_password_job") as submit_password_job:
+            with pytest.raises(exceptions.AccessDenied):
+                operations.signin_user(USER_DATA["username"], USER_DATA["password"])
+            with pytest.raises(exceptions.AccessDenied):
+                asyncio.run(operations.signin_user_async(USER_DATA["username"], USER_DATA["password"]))
+        submit_password_job.assert_not_called()
+
     @staticmethod
     def test_get_user_from_db_with_pk_expected_success(use_test_db):
         """
@@ -657,6 +679,24 @@ class TestUserOperations:
         assert operations.check_if_token_is_valid(token=password_token.token) is None
         assert operations.check_if_token_is_valid(token=email_token.token) is None
 
+    @staticmethod
+    def test_token_lookups_use_indexes(query_plans):
+        """
+        Check that the token lookups search the token indexes
+        :param query_plans:
+        :return:
+        """
+        user = operations.create_new_user(user=input_models.RegisterUserInputModel(**USER_DATA))
+        token = operations.generate_email_password_token(user=user, token_type=constants.TokenTypes.PASSWORD_RESET)
+        query_plans.clear()
+
+        operations.expire_all_existing_tokens_for_user(user=user, token_type=constants.TokenTypes.PASSWORD_RESET)
+        operations.check_if_token_is_valid(token=token.token)
+
+        plans = "\n".join(query_plans)
+        assert "SEARCH CONFIRMATION_TOKEN USING INDEX ix_confirmation_token_user_id_token_type" in plans
+        assert "SEARCH CONFIRMATION_TOKEN USING INDEX ix_confirmation_token_token" in plans
+
     @staticmethod
     def test_confirm_email_expected_success(use_test_db):
         """
@@ -694,6 +734,124 @@ class TestUserOperations:
         assert operations.check_password(user=user_with_new_password, password=USER_DATA["password"]) is False
         assert password_token.expired_on < datetime.datetime.utcnow()
 
+    @staticmethod
+    def test_get_usernames_single_query(use_test_db):
+        """
+        Check that the usernames of multiple users are fetched at once and missing users are left out
+        :param use_test_db:
+        :return:
+        """
+        user = operations.create_new_user(user=input_models.RegisterUserInputModel(**USER_DATA))
+        with db.connection.get_session() as session:
+            with patch.object(session, "execute", wraps=session.execute) as execute_spy:
+                usernames = operations.get_usernames([user.id, user.id, 999], session=session)
+        assert usernames == {user.id: USER_DATA["username"]}
+        assert execute_spy.call_count == 1
+
+    @staticmethod
+    def test_usernames_are_cached_until_renamed(use_test_db):
+        """
+        Check that the cached usernames are not fetched again and a rename invalidates them
+        :param use_test_db:
+        :return:
+        """
+        user = operations.create_new_user(user=input_models.RegisterUserInputModel(**USER_DATA))
+        cache = operations.USERNAMES_CACHE
+        assert operations.get_usernames([user.id]) == {user.id: USER_DATA["username"]}
+        assert cache.stats()["misses"] == 1
+
+        with db.connection.get_session() as session:
+            with patch.object(session, "execute", wraps=session.execute) as execute_spy:
+                assert operations.get_usernames([user.id], session=session) == {user.id: USER_DATA["username"]}
+                assert operations.get_username(user.id) == USER_DATA["username"]
+        assert execute_spy.call_count == 0
+        assert cache.stats()["hits"] == 2
+
+        operations.update_user(user_id=user.id, field="username", value="renamed", updated_by=user.id)
+        assert operations.get_username(user.id) == "renamed"
+
+    @staticmethod
+    def test_get_usernames_from_generator(use_test_db):
+        """
+        Check that the ids of a generator are read only once and the uncached ones are fetched
+        :param use_test_db:
+        :return:
+        """
+        user = operations.create_new_user(user=input_models.RegisterUserInputModel(**USER_DATA))
+        assert operations.get_usernames(user_id for user_id in [user.id]) == {user.id: USER_DATA["username"]}
+        operations.USERNAMES_CACHE.clear()
+        usernames = asyncio.run(operations.get_usernames_async(user_id for user_id in [user.id]))
+        assert usernames == {user.id: USER_DATA["username"]}
+
+    @staticmethod
+    def test_grpc_stream_usernames(use_test_db):
+        """
+        Check that every request of the stream gets its own response
+        :param use_test_db:
+        :return:
+        """
+        user = operations.create_new_user(user=input_models.RegisterUserInputModel(**USER_DATA))
+
+        async def requests():
+            yield communication.users_pb2.UsernamesRequest(user_ids=[user.id])
+            yield communication.users_pb2.UsernamesRequest(user_ids=[999])
+
+        async def stream_usernames():
+            servicer = features.users.grpc_server.UserServicer()
+            return [response async for response in servicer.stream_usernames(requests(), None)]
+
+        responses = asyncio.run(stream_usernames())
+        assert [dict(response.usernames) for response in responses] == [{user.id: USER_DATA["username"]}, {}]
+
+    @staticmethod
+    def test_hash_password_uses_configured_rounds(monkeypatch):
+        """
+        Check that the bcrypt cost factor comes from the configuration
+        :param monkeypatch:
+        :return:
+        """
+        monkeypatch.setattr(operations.config.password_hashing, "rounds", 4)
+        hashed_password = asyncio.run(operations.hash_password_async(USER_DATA["password"]))
+        assert hashed_password.startswith(b"$2b$04$")
+        assert bcrypt.checkpw(USER_DATA["password"].encode("utf-8"), hashed_password)
+
+    @staticmethod
+    def test_system_user_id_is_resolved_once(monkeypatch):
+        """
+        Check that the system user id is kept in memory after it is resolved
+        :param monkeypatch:
+        :return:
+        """
+        monkeypatch.setattr(common.authentication, "_SYSTEM_USER_ID", None)
+        with patch.object(common.authentication.CACHE, "get", return_value=None) as cache_get, patch.object(
+            common.authentication.CACHE, "set"
+        ) as cache_set, patch("common.authentication._get_system_user_id_from_db", return_value=5) as from_db:
+            assert common.authentication.get_system_user_id() == 5
+            assert common.authentication.get_system_user_id() == 5
+        cache_get.assert_called_once()
+        cache_set.assert_called_once_with('system_user_id', 5)
+        from_db.assert_called_once()
+
+    @staticmethod
+    def test_verified_tokens_are_cached(use_test_db):
+        """
+        Check that a repeated token is verified once and kept until it expires
+        :param use_test_db:
+        :return:
+        """
+        token, _ = operations.create_token(user_id=1, user_role_ids=[2])
+        cache = common.authentication.VERIFIED_TOKENS_CACHE
+        with patch("jose.jwt.decode", wraps=common.authentication.jwt.decode) as decode_spy:
+            for _ in range(3):
+                user = asyncio.run(common.authentication.extract_user_data_from_jwt(token))
+                assert (user.id, user.roles) == (1, [2])
+        decode_spy.assert_called_once()
+        assert cache.stats()["hits"] == 2
+
+        expired_token, _ = operations.create_token(user_id=1, expires_delta=datetime.timedelta(seconds=-1))
+        assert asyncio.run(common.authentication.extract_user_data_from_jwt(expired_token)) is None
+        assert len(cache) == 1
+
 
 class TestUserInputModelEmailValidation:
     """
@@ -918,6 +1076,27 @@ class TestUserEndpoints:
         assert "token_type" in response.json()
         assert response.json()["token_type"] == "Bearer"
 
+    @classmethod
+    def test_signin_endpoint_password_hashing_busy_expected_exception(cls, use_test_db, monkeypatch):
+        """
+        Test signin user endpoint while all the password hashing workers are busy. Expected exception
+        :param use_test_db:
+        :param monkeypatch:
+        :return:
+        """
+
+        operations.create_new_user(user=input_models.RegisterUserInputModel(**USER_DATA))
+        monkeypatch.setattr(operations, "_PASSWORD_HASHING_SLOTS", threading.BoundedSemaphore(1))
+        operations._PASSWORD_HASHING_SLOTS.acquire()
+        payload = {"username": USER_DATA["username"], "password": USER_DATA["password"]}
+        response = cls.client.post("/api/users/signin/", data=payload)
+
+        assert response.status_code == 429
+        assert response.headers["Retry-After"] == "1"
+
+        operations._PASSWORD_HASHING_SLOTS.release()
+        assert cls.client.post("/api/users/signin/", data=payload).status_code == 200
+
     @classmethod
     def test_signin_endpoint_wrong_username_expected_exception(cls, use_test_db):
         """
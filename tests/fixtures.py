@@ -1,6 +1,12 @@
+import uuid
+
+import sqlalchemy.event
 from pytest import fixture
 
 import common.authentication
+import features.recipes.helpers
+import features.recipes.operations
+import features.users.operations
 from db import connection
 from features import DbBaseModel
 from common.authentication import AuthenticatedUser
@@ -8,19 +14,55 @@ from common.authentication import AuthenticatedUser
 
 @fixture
 def use_test_db(monkeypatch, mocker):
-    monkeypatch.setattr(connection, "CONNECTION_STRING", f"sqlite:///:memory:")
+    database_path = f"file:{uuid.uuid4().hex}?mode=memory&cache=shared&uri=true"
+    monkeypatch.setattr(connection, "CONNECTION_STRING", f"sqlite:///{database_path}")
+    monkeypatch.setattr(connection, "ASYNC_CONNECTION_STRING", f"sqlite+aiosqlite:///{database_path}")
     test_engine = connection._get_test_engine()
     mocker.patch("db.connection.get_engine", return_value=test_engine)
+    mocker.patch("db.connection.get_async_engine", return_value=connection._get_async_test_engine())
     DbBaseModel.metadata.create_all(bind=connection.get_engine())
+    features.recipes.helpers.RECIPES_COUNT_CACHE.clear()
+    features.recipes.operations.reset_ingredient_name_index()
+    features.recipes.operations.reset_recipe_ingredients_index()
+    features.recipes.operations.CATEGORIES_CACHE.clear()
+    features.recipes.operations.INGREDIENTS_CACHE.clear()
+    features.users.operations.ROLES_CACHE.clear()
+    features.users.operations.USERNAMES_CACHE.clear()
+    common.authentication.VERIFIED_TOKENS_CACHE.clear()
+    yield
+    test_engine.dispose()
+
+
+@fixture
+def query_plans(use_test_db):
+    """
+    Collect the sqlite query plans of the SELECT statements executed by the test, one line of steps per statement
+    """
+
+    plans = []
+
+    def explain(connection, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith('SELECT'):
+            rows = cursor.connection.execute(f'EXPLAIN QUERY PLAN {statement}', parameters).fetchall()
+            plans.append(' / '.join(row[-1] for row in rows))
+
+    engine = connection.get_engine()
+    sqlalchemy.event.listen(engine, 'after_cursor_execute', explain)
+    yield plans
+    sqlalchemy.event.remove(engine, 'after_cursor_execute', explain)
 
 
 @fixture
 def admin(mocker):
+    # the same token is decoded to other claims by the fixtures
+    common.authentication.VERIFIED_TOKENS_CACHE.clear()
     mocker.patch("jose.jwt.decode", return_value={"sub": "1", "roles": [1]})
     yield
 
 
 @fixture
 def user(mocker):
+    # the same token is decoded to other claims by the fixtures
+    common.authentication.VERIFIED_TOKENS_CACHE.clear()
     mocker.patch("jose.jwt.decode", return_value={"sub": "1"})
     yield common.authentication.AuthenticatedUser(id=1)